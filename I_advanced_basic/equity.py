@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+# -----------------
+# Эквити игроков в холдеме: доля банка, которую в среднем получает каждый игрок
+# при известных карманных картах, части борда и вышедших из игры (мертвых) картах.
+# Розыгрыши борда делаются методом Монте-Карло в нескольких процессах.
+# Джокеры '?B' и '?R' оцениваются так же, как в best_wild_hand.
+# -----------------
+
+import math
+import random
+import time
+import multiprocessing
+from collections import Counter, namedtuple
+from functools import lru_cache
+from itertools import combinations, permutations
+from statistics import NormalDist
+
+import poker
+
+BOARD_SIZE = 5
+# Розыгрышей в одной порции. Порция - единица работы процесса и проверки точности
+SHARD_TRIALS = 2000
+
+EquityResult = namedtuple('EquityResult', 'equity stderr wins ties trials seconds throughput')
+
+
+def game_deck(wild=False):
+    """Колода: 52 карты и, если wild, два джокера"""
+    return list(poker.CARD_CODES) + (poker.JOKERS if wild else [])
+
+
+def remaining_deck(players, board, dead, wild=False):
+    """Карты колоды, которые еще могут выйти на борд. Проверяет, что известные карты не повторяются"""
+    deck = game_deck(wild)
+    known = [card for hole in players for card in hole] + list(board) + list(dead)
+    unknown = [card for card in known if card not in poker.CARD_CODES and card not in poker.JOKERS]
+    if unknown:
+        raise ValueError("Неизвестные карты: %s" % " ".join(unknown))
+    repeated = sorted(set(card for card in known if known.count(card) > 1))
+    if repeated:
+        raise ValueError("Карты встречаются дважды: %s" % " ".join(repeated))
+    if len(board) > BOARD_SIZE:
+        raise ValueError("На борде не больше %d карт" % BOARD_SIZE)
+    if len(players) < 2 or any(len(hole) != 2 for hole in players):
+        raise ValueError("Нужно хотя бы два игрока с двумя карманными картами")
+    return [card for card in deck if card not in known]
+
+
+def equity_shard(players, board, deck, trials, seed, shard):
+    """Разыгрывает trials бордов. Для каждого игрока возвращает сумму долей банка,
+    сумму их квадратов, число побед и число дележей"""
+    rng = random.Random("%d:%d" % (seed, shard))
+    missing = BOARD_SIZE - len(board)
+    shares = [0.0] * len(players)
+    squares = [0.0] * len(players)
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+
+    wild = any(card in poker.JOKERS for card in deck + board + [card for hole in players for card in hole])
+    if wild:
+        def strengths(runout):
+            return [poker.wild_hand_strength(hole + runout) for hole in players]
+        board = list(board)
+    else:
+        # Без джокеров "руки" оцениваются сразу по кодам карт
+        codes = poker.CARD_CODES
+        players = [[codes[card] for card in hole] for hole in players]
+        board = [codes[card] for card in board]
+        deck = [codes[card] for card in deck]
+        evaluate7 = poker.evaluate7
+
+        def strengths(runout):
+            return [evaluate7(*hole, *runout) for hole in players]
+
+    for _ in range(trials):
+        hand_strengths = strengths(board + rng.sample(deck, missing))
+        best = max(hand_strengths)
+        winners = [i for i, strength in enumerate(hand_strengths) if strength == best]
+        share = 1 / len(winners)
+        for i in winners:
+            shares[i] += share
+            squares[i] += share * share
+            if len(winners) == 1:
+                wins[i] += 1
+            else:
+                ties[i] += 1
+    return shares, squares, wins, ties
+
+
+def monte_carlo_equity(players, board=(), dead=(), trials=100000, seed=0, workers=None,
+                       precision=None, confidence=0.95, wild=False):
+    """Эквити игроков методом Монте-Карло.
+    players - карманные карты игроков, board - известные карты борда, dead - вышедшие из игры карты,
+    wild - есть ли в колоде джокеры. Разыгрывается не больше trials бордов порциями по SHARD_TRIALS,
+    розыгрыш прекращается раньше, когда половина доверительного интервала (с уровнем confidence)
+    для эквити каждого игрока не больше precision.
+    Порции разыгрываются с собственными seed и учитываются по порядку, поэтому результат при данном seed
+    не зависит от числа процессов workers"""
+    players = [list(hole) for hole in players]
+    board = list(board)
+    deck = remaining_deck(players, board, dead, wild)
+    workers = workers or multiprocessing.cpu_count()
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    shards = [(players, board, deck, min(SHARD_TRIALS, trials - start), seed, shard)
+              for shard, start in enumerate(range(0, trials, SHARD_TRIALS))]
+    shares = [0.0] * len(players)
+    squares = [0.0] * len(players)
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+    done = 0
+    started = time.time()
+    pool = None
+    if workers == 1 or len(shards) == 1:
+        results = (equity_shard(*shard) for shard in shards)
+    else:
+        pool = multiprocessing.Pool(min(workers, len(shards)))
+        results = pool.imap(_equity_shard, shards)
+    try:
+        for shard, result in zip(shards, results):
+            for total, part in zip((shares, squares, wins, ties), result):
+                for i, value in enumerate(part):
+                    total[i] += value
+            done += shard[3]
+            if precision is not None and max(_stderr(shares, squares, done)) * z <= precision:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    seconds = max(time.time() - started, 1e-9)
+    return EquityResult(equity=[share / done for share in shares], stderr=_stderr(shares, squares, done),
+                        wins=wins, ties=ties, trials=done, seconds=seconds, throughput=done / seconds)
+
+
+def exact_equity(players, board=(), dead=()):
+    """Точное эквити перебором всех розыгрышей борда, без джокеров.
+    Розыгрыши, переходящие друг в друга при перестановке мастей, не меняющей известные карты,
+    дают одинаковый исход, поэтому оценивается по одному из них с весом - числом таких розыгрышей.
+    Ответы запоминаются для последних EXACT_CACHE_SIZE раскладов с точностью до перестановки мастей"""
+    players = [list(hole) for hole in players]
+    board = list(board)
+    remaining_deck(players, board, dead)
+    if any(card in poker.JOKERS for hole in players for card in hole + board + list(dead)):
+        raise ValueError("Точный перебор не поддерживает джокеров, используйте monte_carlo_equity")
+
+    started = time.time()
+    equity, wins, ties, trials = _exact_equity(*canonical_spot(players, board, dead))
+    seconds = max(time.time() - started, 1e-9)
+    return EquityResult(equity=list(equity), stderr=[0.0] * len(players), wins=list(wins), ties=list(ties),
+                        trials=trials, seconds=seconds, throughput=trials / seconds)
+
+
+def canonical_spot(players, board, dead):
+    """Расклад с мастями, переставленными так, чтобы он был наименьшим среди всех перестановок.
+    Порядок игроков сохраняется, порядок карт внутри групп - нет"""
+    spots = []
+    for suits in permutations(poker.SUITS):
+        rename = dict(zip(poker.SUITS, suits))
+        spots.append(tuple(tuple(sorted(card[0] + rename[card[1]] for card in group))
+                           for group in players + [board, dead]))
+    spot = min(spots)
+    return spot[:len(players)], spot[-2], spot[-1]
+
+
+EXACT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=EXACT_CACHE_SIZE)
+def _exact_equity(players, board, dead):
+    groups = list(players) + [board, dead]
+    known = set(card for group in groups for card in group)
+    codes = poker.CARD_CODES
+    holes = [[codes[card] for card in hole] for hole in players]
+    board_codes = [codes[card] for card in board]
+    evaluate7 = poker.evaluate7
+
+    shares = [0.0] * len(players)
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+    trials = 0
+    for runout, weight in distinct_runouts(groups, known, BOARD_SIZE - len(board)):
+        runout = board_codes + [codes[card] for card in runout]
+        strengths = [evaluate7(*hole, *runout) for hole in holes]
+        best = max(strengths)
+        winners = [i for i, strength in enumerate(strengths) if strength == best]
+        for i in winners:
+            shares[i] += weight / len(winners)
+            if len(winners) == 1:
+                wins[i] += weight
+            else:
+                ties[i] += weight
+        trials += weight
+    return tuple(share / trials for share in shares), tuple(wins), tuple(ties), trials
+
+
+def suit_classes(groups):
+    """Классы взаимозаменяемых мастей: у мастей одного класса одинаковые ранги в каждой группе известных карт"""
+    classes = {}
+    for suit in poker.SUITS:
+        signature = tuple(frozenset(card[0] for card in group if card[1] == suit) for group in groups)
+        classes.setdefault(signature, []).append(suit)
+    return list(classes.values())
+
+
+def distinct_runouts(groups, known, size):
+    """Розыгрыши size карт с точностью до перестановки мастей внутри suit_classes и их кратности"""
+    class_options = []
+    for suits in suit_classes(groups):
+        available = [rank for rank in poker.RANKS if rank + suits[0] not in known]
+        class_options.append(_class_runouts(suits, available, size))
+
+    def combine(i, left):
+        if i == len(class_options):
+            if not left:
+                yield [], 1
+            return
+        for used in range(left + 1):
+            for cards, weight in class_options[i].get(used, ()):
+                for rest, rest_weight in combine(i + 1, left - used):
+                    yield cards + rest, weight * rest_weight
+
+    return combine(0, size)
+
+
+def _class_runouts(suits, available, size):
+    """Для класса мастей с одинаковыми свободными рангами - все способы взять из него до size карт
+    с точностью до перестановки этих мастей, по числу взятых карт: списки (карты, кратность).
+    Наборы рангов по мастям идут по неубыванию, кратность - число их различных перестановок"""
+    subsets = [ranks for count in range(min(size, len(available)) + 1) for ranks in combinations(available, count)]
+    options = {}
+
+    def choose(suit_index, start, left, chosen):
+        if suit_index == len(suits):
+            weight = math.factorial(len(suits))
+            for repeats in Counter(chosen).values():
+                weight //= math.factorial(repeats)
+            cards = [rank + suit for suit, ranks in zip(suits, chosen) for rank in ranks]
+            options.setdefault(len(cards), []).append((cards, weight))
+            return
+        for i in range(start, len(subsets)):
+            # Наборы отсортированы по размеру, дальше только больше
+            if len(subsets[i]) > left:
+                break
+            choose(suit_index + 1, i, left - len(subsets[i]), chosen + [subsets[i]])
+
+    choose(0, 0, size, [])
+    return options
+
+
+def _equity_shard(args):
+    return equity_shard(*args)
+
+
+def _stderr(shares, squares, trials):
+    """Стандартная ошибка средней доли банка по суммам долей и их квадратов"""
+    if trials < 2:
+        return [math.inf] * len(shares)
+    errors = []
+    for share, square in zip(shares, squares):
+        variance = max(square - share * share / trials, 0.0) / (trials - 1)
+        errors.append(math.sqrt(variance / trials))
+    return errors
+
+
+def test_monte_carlo_equity():
+    print ("test_monte_carlo_equity...")
+    players = ["AS AD".split(), "KS KD".split()]
+    result = monte_carlo_equity(players, trials=20000, seed=1, workers=2)
+    assert result.trials == 20000
+    # AA против KK - около 82%
+    assert abs(result.equity[0] - 0.82) < 4 * result.stderr[0] + 0.01
+    assert abs(sum(result.equity) - 1) < 1e-9
+    # Результат зависит только от seed
+    assert result.equity == monte_carlo_equity(players, trials=20000, seed=1, workers=1).equity
+    # На ривере все известно
+    river = monte_carlo_equity(players, board="2C 7H 9D JC KH".split(), trials=10000, workers=1)
+    assert river.equity == [0.0, 1.0] and river.stderr == [0.0, 0.0]
+    print ('OK')
+
+
+def test_early_stop():
+    print ("test_early_stop...")
+    players = ["AS KS".split(), "QH QD".split()]
+    result = monte_carlo_equity(players, trials=1000000, seed=2, workers=2, precision=0.01)
+    assert result.trials < 1000000
+    assert max(result.stderr) * NormalDist().inv_cdf(0.975) <= 0.01
+    assert result.equity == monte_carlo_equity(players, trials=1000000, seed=2, workers=1, precision=0.01).equity
+    print ('OK')
+
+
+def test_wild_equity():
+    print ("test_wild_equity...")
+    # Туз с черным джокером против слабой руки
+    players = ["?B AD".split(), "2C 7H".split()]
+    result = monte_carlo_equity(players, dead=["?R"], trials=4000, seed=3, workers=1, wild=True)
+    assert result.equity[0] > 0.8
+    try:
+        monte_carlo_equity(["AS AD".split(), "AS KD".split()])
+    except ValueError:
+        pass
+    else:
+        assert False, "повторяющиеся карты"
+    print ('OK')
+
+
+def test_exact_equity():
+    print ("test_exact_equity...")
+    players = ["AH KH".split(), "2C 2D".split(), "9S 9C".split()]
+    board = "3H 4H JD".split()
+    result = exact_equity(players, board)
+    # Сверка с перебором всех розыгрышей подряд
+    deck = remaining_deck(players, board, [])
+    shares = [0.0] * len(players)
+    runouts = list(combinations(deck, 2))
+    for runout in runouts:
+        strengths = [poker.hand_strength(hole + board + list(runout)) for hole in players]
+        winners = [i for i, strength in enumerate(strengths) if strength == max(strengths)]
+        for i in winners:
+            shares[i] += 1 / len(winners)
+    assert result.trials == len(runouts)
+    assert all(abs(share / len(runouts) - equity) < 1e-12 for share, equity in zip(shares, result.equity))
+    # Тот же расклад с переставленными мастями берется из кэша
+    hits = _exact_equity.cache_info().hits
+    renamed = exact_equity(["AS KS".split(), "2C 2H".split(), "9D 9C".split()], "3S 4S JH".split())
+    assert renamed.equity == result.equity and _exact_equity.cache_info().hits == hits + 1
+    # Кратности покрывают все розыгрыши
+    groups = [["AS", "KS"], ["QH", "QD"], [], []]
+    assert (sum(weight for _, weight in distinct_runouts(groups, {"AS", "KS", "QH", "QD"}, 3))
+            == math.comb(48, 3))
+    print ('OK')
+
+
+if __name__ == '__main__':
+    test_monte_carlo_equity()
+    test_early_stop()
+    test_wild_equity()
+    test_exact_equity()
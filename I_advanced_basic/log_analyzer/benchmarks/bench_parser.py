@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the line parser: the single-pass bytes parser of loganalyzer.parse_log
+# against the original parse_log/parse_line pair (three regular expressions per line).
+#
+# Usage: python bench_parser.py [--lines 200000] [--urls 5000] [--error-rate 0.001] [--repeat 3]
+
+import os
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "loganalyzer"))
+
+import loganalyzer  # noqa: E402
+
+LINE_TEMPLATE = ('{ip} -  - [29/Jun/2017:03:50:22 +0300] "{method} {url} HTTP/1.1" 200 927 "-" '
+                 '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+                 '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time}\n')
+
+
+def legacy_parse_line(line):
+    link_re = r"(GET|POST)\s+(.*)\s+?HTTP\/"
+    req_time_re = r"(\d+\.\d+)$"
+    try:
+        link = re.search(link_re, line).group(2)
+        request_time = re.search(req_time_re, line).group(1)
+    except:
+        logging.info("Не удалось распарсить строчку: " + line)
+        pass
+
+    return [link, float(request_time)]
+
+
+def legacy_parse_log(iterable):
+    report_raw_data = {
+        "total_count": 0, "total_req_time": 0, "total_errors": 0
+    }
+
+    line_valid_pattern = re.compile(
+        r'([\.\d]*) ([\-\d\w]*) +([\-\d\w\.]*) (\[.*\]) \"(GET|POST) (?P<href>.*)\" (\d*) (\d*) (\".*\") (\".*\") (\".*\") (\".*\") (\".*\") (?P<request_time>\d*\.\d*)'
+    )
+
+    for line in iterable:
+
+        try:
+            line = line.decode("UTF-8").strip()
+        except:
+            line = line.strip()
+
+        if not line_valid_pattern.match(line):
+            report_raw_data["total_errors"] += 1
+            continue
+
+        entry = legacy_parse_line(line)
+        url = entry[0]
+        req_time = entry[1]
+
+        report_raw_data["total_count"] += 1
+        report_raw_data["total_req_time"] += req_time
+
+        if entry[0] in report_raw_data.keys():
+            report_raw_data[url].append(req_time)
+        else:
+            report_raw_data[url] = [req_time]
+
+    return report_raw_data
+
+
+def generate_lines(lines, urls, error_rate, seed=42):
+    rnd = random.Random(seed)
+    url_pool = ["/api/v2/banner/%d" % rnd.randint(1, 10 ** 8) for _ in range(urls)]
+    generated = []
+    for _ in range(lines):
+        if rnd.random() < error_rate:
+            generated.append(b"some garbage that is not a ui_short line\n")
+            continue
+        line = LINE_TEMPLATE.format(ip="1.196.116.%d" % rnd.randint(1, 254),
+                                    method=rnd.choice(("GET", "POST")),
+                                    url=rnd.choice(url_pool),
+                                    request_time="%.3f" % rnd.expovariate(2))
+        generated.append(line.encode("UTF-8"))
+    return generated
+
+
+def best_time(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(lines)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--urls', type=int, default=5000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args(args)
+
+    lines = generate_lines(options.lines, options.urls, options.error_rate)
+
+    legacy_time, legacy_data = best_time(legacy_parse_log, lines, options.repeat)
+    new_time, new_data = best_time(loganalyzer.parse_log, lines, options.repeat)
+
+    for key in ("total_count", "total_errors"):
+        assert legacy_data[key] == new_data[key], key
+    assert {k: v for k, v in legacy_data.items() if k not in loganalyzer.TOTALS} == \
+        {k: v for k, v in new_data.items() if k not in loganalyzer.TOTALS}
+
+    print("lines: %d, distinct urls: %d, errors: %d" % (len(lines), len(new_data) - 3, new_data["total_errors"]))
+    print("legacy parse_log/parse_line: %8.3f s  %12.0f lines/s" % (legacy_time, len(lines) / legacy_time))
+    print("single-pass parse_log:       %8.3f s  %12.0f lines/s" % (new_time, len(lines) / new_time))
+    print("speedup: %.2fx" % (legacy_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
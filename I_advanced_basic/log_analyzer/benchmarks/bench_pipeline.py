@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# Benchmark of the whole analyzer pipeline on a generated log: wall time, lines/s and peak RSS
+# of open_log, parse_log, construct_report and generate_report_html. Every stage runs in a process
+# of its own, taking its input from the previous stage through a pickle. Results are written as JSON
+# and can be compared against a stored baseline; a stage slower than the tolerance fails the run.
+#
+# Usage: python bench_pipeline.py [--lines 1M] [--urls 10000] [--zipf 1.1] [--error-rate 0.001] [--gzip]
+#                                 [--stats-mode exact] [--workers 1] [--repeat 1]
+#                                 [--output results.json] [--baseline baseline.json] [--tolerance 0.1]
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import pickle
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+import genlog
+
+LOGANALYZER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "loganalyzer")
+sys.path.insert(0, LOGANALYZER_DIR)
+import profiling  # noqa: E402
+REPORT_TEMPLATE = os.path.join(LOGANALYZER_DIR, "files", "templates", "report.html")
+LOG_DATE = datetime(2017, 6, 30)
+STAGES = ("open_log", "parse_log", "construct_report", "generate_report_html")
+LOG_DATA_FILE = "log_data.pickle"
+REPORT_DATA_FILE = "report_data.pickle"
+
+
+def measure(results, stage, func, lines=None):
+    started = time.perf_counter()
+    result = func()
+    wall_time = time.perf_counter() - started
+    results[stage] = {"wall_time": round(wall_time, 4), "peak_rss_kb": profiling.peak_rss_kb()}
+    if lines is not None:
+        results[stage]["lines_per_sec"] = round(lines / wall_time) if wall_time else None
+    return result
+
+
+def count_lines(lines):
+    total = 0
+    for _ in lines:
+        total += 1
+    return total
+
+
+def save(log_dir, name, data):
+    with open(os.path.join(log_dir, name), "wb") as data_file:
+        pickle.dump(data, data_file, pickle.HIGHEST_PROTOCOL)
+
+
+def load(log_dir, name):
+    path = os.path.join(log_dir, name)
+    with open(path, "rb") as data_file:
+        data = pickle.load(data_file)
+    os.remove(path)
+    return data
+
+
+def run_stage(stage, log_dir, ext, stats_mode, workers, report_size, lines=None):
+    """Runs one pipeline stage in a fresh process, so peak RSS is the stage's own (with its input loaded)"""
+    import loganalyzer
+
+    log_info = loganalyzer.LogInfo(log_dir, LOG_DATE, ext)
+    results = {}
+
+    if stage == "open_log":
+        lines = measure(results, stage, lambda: count_lines(loganalyzer.open_log(log_info)))
+        results[stage]["lines_per_sec"] = round(lines / results[stage]["wall_time"])
+        results["lines"] = lines
+    elif stage == "parse_log":
+        config = {"STATS_MODE": stats_mode, "WORKERS": workers, "REPORT_HISTORY": ""}
+        # Includes reading the log, as in a real run
+        log_data = measure(results, stage, lambda: loganalyzer.get_log_data(config, log_info), lines)
+        save(log_dir, LOG_DATA_FILE, log_data)
+        results["total_errors"] = log_data["total_errors"]
+    elif stage == "construct_report":
+        log_data = load(log_dir, LOG_DATA_FILE)
+        save(log_dir, REPORT_DATA_FILE,
+             measure(results, stage, lambda: loganalyzer.construct_report(1, log_data, report_size)))
+    else:
+        report_data = load(log_dir, REPORT_DATA_FILE)
+        report_path = os.path.join(log_dir, "report.html")
+        measure(results, stage, lambda: loganalyzer.generate_report_html(REPORT_TEMPLATE, report_path, report_data))
+        os.remove(report_path)
+    return results
+
+
+def send_result(connection, func, args):
+    connection.send(func(*args))
+    connection.close()
+
+
+def in_process(context, func, *args):
+    """Calls func(*args) in a new process. Unlike a pool worker, it isn't daemonic and may start pools of its own"""
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_result, args=(sender, func, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    finally:
+        receiver.close()
+        process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("%s%r failed with exit code %s" % (func.__name__, args, process.exitcode))
+    return result
+
+
+def best_of(runs):
+    stages = {}
+    for stage in STAGES:
+        fastest = min((run[stage] for run in runs), key=lambda result: result["wall_time"])
+        stages[stage] = dict(fastest)
+        rss = [run[stage]["peak_rss_kb"] for run in runs if run[stage]["peak_rss_kb"] is not None]
+        stages[stage]["peak_rss_kb"] = max(rss) if rss else None
+    return stages
+
+
+def compare(results, baseline, tolerance):
+    """Prints the stage times against the baseline and returns the stages that got slower than the tolerance"""
+    params, baseline_params = results["params"], baseline.get("params", {})
+    changed = [key for key in params if baseline_params.get(key) != params[key]]
+    if changed:
+        print("warning: the baseline was run with other %s" % ", ".join(changed))
+
+    regressions = []
+    print("%-22s %12s %12s %9s" % ("stage", "baseline, s", "current, s", "change"))
+    for stage in STAGES:
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not before["wall_time"]:
+            continue
+        current = results["stages"][stage]
+        ratio = current["wall_time"] / before["wall_time"]
+        print("%-22s %12.3f %12.3f %+8.1f%%" % (stage, before["wall_time"], current["wall_time"], (ratio - 1) * 100))
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=genlog.count, default="1M", help='Log size, e.g. 1M, 10M or 100M lines')
+    parser.add_argument('--urls', type=int, default=10000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stats-mode', default="exact")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--report-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs to take the best time of')
+    parser.add_argument('--work-dir', help='Where to generate the log (a temporary directory by default)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed slowdown of a stage, 0.1 is 10%%')
+    options = parser.parse_args(args)
+
+    params = {"lines": options.lines, "urls": options.urls, "zipf": options.zipf, "error_rate": options.error_rate,
+              "gzip": options.gzip, "seed": options.seed, "stats_mode": options.stats_mode,
+              "workers": options.workers, "report_size": options.report_size}
+    ext = ".gz" if options.gzip else None
+    work_dir = os.path.abspath(options.work_dir or tempfile.mkdtemp())
+    log_path = os.path.join(work_dir, "nginx-access-ui.log-" + LOG_DATE.strftime("%Y%m%d") + (ext or ""))
+
+    try:
+        started = time.perf_counter()
+        genlog.write_log(log_path, options.lines, options.urls, options.zipf, options.error_rate, options.seed,
+                         options.gzip)
+        print("generated %s (%d bytes) in %.1f s" % (log_path, os.path.getsize(log_path),
+                                                     time.perf_counter() - started))
+
+        context = multiprocessing.get_context("spawn")
+        runs = []
+        for _ in range(options.repeat):
+            run = {}
+            for stage in STAGES:
+                run.update(in_process(context, run_stage, stage, work_dir, ext, options.stats_mode, options.workers,
+                                      options.report_size, run.get("lines")))
+            runs.append(run)
+        log_size = os.path.getsize(log_path)
+    finally:
+        if options.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    results = {
+        "params": params,
+        "environment": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                        "platform": platform.platform(), "cpus": os.cpu_count()},
+        "log_bytes": log_size,
+        "total_errors": runs[0]["total_errors"],
+        "stages": best_of(runs),
+    }
+
+    for stage in STAGES:
+        result = results["stages"][stage]
+        print("%-22s %9.3f s %14s %12s" % (stage, result["wall_time"],
+                                          "%d lines/s" % result["lines_per_sec"] if "lines_per_sec" in result else "",
+                                          "%d KB" % result["peak_rss_kb"] if result["peak_rss_kb"] else ""))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.tolerance)
+        if regressions:
+            print("slower than the baseline: %s" % ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
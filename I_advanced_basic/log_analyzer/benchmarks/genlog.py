@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Deterministic generator of ui_short nginx logs for the benchmarks.
+# The same arguments and seed always give byte-for-byte the same log.
+#
+# Usage: python genlog.py OUTPUT [--lines 1M] [--urls 10000] [--zipf 1.1] [--error-rate 0.001] [--gzip] [--seed 42]
+
+import gzip
+import random
+import argparse
+from itertools import accumulate
+
+LINE_TEMPLATE = ('{ip} -  - [29/Jun/2017:03:50:22 +0300] "{method} {url} HTTP/1.1" 200 {size} "-" '
+                 '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+                 '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time}\n')
+ERROR_LINE = "some garbage that is not a ui_short line\n"
+URL_TEMPLATES = ("/api/v2/banner/{id}", "/api/v2/group/{id}/statistic/sites/?date_type=day",
+                 "/api/v2/slot/{id}/groups", "/api/1/campaigns/?id={id}", "/export/appinstall_raw/2017-06-{day:02d}/")
+BATCH = 10000
+SUFFIXES = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}
+
+
+def count(value):
+    """Parses line counts like 1M, 100k or 2500"""
+    suffix = value[-1:].lower()
+    if suffix in SUFFIXES:
+        return int(float(value[:-1]) * SUFFIXES[suffix])
+    return int(value)
+
+
+def url_pool(urls, rnd):
+    return [rnd.choice(URL_TEMPLATES).format(id=rnd.randint(1, 10 ** 8), day=rnd.randint(1, 30))
+            for _ in range(urls)]
+
+
+def generate_lines(lines, urls=10000, zipf=1.1, error_rate=0.001, seed=42):
+    """Yields batches of log text. URL popularity follows Zipf's law with exponent `zipf` (0 is uniform)"""
+    rnd = random.Random(seed)
+    pool = url_pool(urls, rnd)
+    cum_weights = list(accumulate(1 / rank ** zipf for rank in range(1, urls + 1)))
+    # Mean request time of every URL, independent of its popularity
+    mean_times = [0.05 + rnd.expovariate(2) for _ in range(urls)]
+    ranks = range(urls)
+
+    for start in range(0, lines, BATCH):
+        batch = []
+        for rank in rnd.choices(ranks, cum_weights=cum_weights, k=min(BATCH, lines - start)):
+            if rnd.random() < error_rate:
+                batch.append(ERROR_LINE)
+                continue
+            batch.append(LINE_TEMPLATE.format(ip="1.196.%d.%d" % (rnd.randint(0, 255), rnd.randint(1, 254)),
+                                              method="GET" if rnd.random() < 0.9 else "POST",
+                                              url=pool[rank],
+                                              size=rnd.randint(0, 100000),
+                                              request_time="%.3f" % rnd.expovariate(1 / mean_times[rank])))
+        yield "".join(batch)
+
+
+def write_log(path, lines, urls=10000, zipf=1.1, error_rate=0.001, seed=42, compress=False):
+    # mtime=0 keeps gzip output reproducible
+    log_file = gzip.GzipFile(path, 'wb', mtime=0) if compress else open(path, 'wb')
+    with log_file:
+        for batch in generate_lines(lines, urls, zipf, error_rate, seed):
+            log_file.write(batch.encode("UTF-8"))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output')
+    parser.add_argument('--lines', type=count, default="1M", help='Number of lines, e.g. 1M, 10M or 100M')
+    parser.add_argument('--urls', type=int, default=10000, help='Number of distinct URLs')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of URL popularity, 0 for uniform')
+    parser.add_argument('--error-rate', type=float, default=0.001, help='Share of lines that are not ui_short')
+    parser.add_argument('--gzip', action='store_true', help='Compress the log')
+    parser.add_argument('--seed', type=int, default=42)
+    options = parser.parse_args(args)
+
+    write_log(options.output, options.lines, options.urls, options.zipf, options.error_rate, options.seed,
+              options.gzip)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import re
+import math
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from collections import Counter
+
+from sketch import QuantileSketch
+
+# Fields of a ui_short line in the order they come in it, with what each of them may look like.
+# nginx escapes double quotes inside variables, so quoted fields can't contain them.
+LINE_FIELDS = (
+    ("remote_addr", rb"[.\d]*"),
+    ("remote_user", rb"[-\w]*"),
+    ("http_x_real_ip", rb"[-\w.]*"),
+    ("time_local", rb"[^\]]*"),
+    ("method", rb"GET|POST"),
+    ("href", rb'[^"]*?'),
+    ("status", rb"\d*"),
+    ("body_bytes_sent", rb"\d*"),
+    ("http_referer", rb'[^"]*'),
+    ("http_user_agent", rb'[^"]*'),
+    ("http_x_forwarded_for", rb'[^"]*'),
+    ("http_x_request_id", rb'[^"]*'),
+    ("http_x_rb_user", rb'[^"]*'),
+    ("request_time", rb"\d+\.\d+"),
+)
+LINE_TEMPLATE = (rb'\s*{remote_addr} {remote_user} +{http_x_real_ip} \[{time_local}\] "{method} +{href} +HTTP/[^"]*" '
+                 rb'{status} {body_bytes_sent} "{http_referer}" "{http_user_agent}" "{http_x_forwarded_for}" '
+                 rb'"{http_x_request_id}" "{http_x_rb_user}" {request_time}\s*$')
+# What the URL timings of the report itself are made of
+URL_FIELDS = ("href", "request_time")
+
+# Lines an aggregator gets at a time
+BATCH_SIZE = 4096
+
+AGGREGATORS = {}
+
+
+def build_line_re(fields):
+    """Regular expression of a ui_short line that captures only the given fields, in the order of the line"""
+    fields = set(fields)
+    unknown = fields.difference(name for name, pattern in LINE_FIELDS)
+    if unknown:
+        raise ValueError("Unknown log fields: %s" % ", ".join(sorted(unknown)))
+
+    parts = {}
+    for name, pattern in LINE_FIELDS:
+        if name in fields:
+            pattern = b"(?P<%s>%s)" % (name.encode("ascii"), pattern)
+        elif b"|" in pattern:
+            pattern = b"(?:%s)" % pattern
+        parts["{%s}" % name] = pattern
+    line_pattern = re.sub(rb"{\w+}", lambda field: parts[field.group().decode("ascii")], LINE_TEMPLATE)
+    return re.compile(line_pattern)
+
+
+def register(aggregator_class):
+    AGGREGATORS[aggregator_class.name] = aggregator_class
+    return aggregator_class
+
+
+class Aggregator(object):
+    """An extra section of the report, fed with the fields it declares from the same pass over the log as the URL timings.
+
+    Lines reach update() in batches, as one list of raw bytes per field in `fields`. finish() is called once
+    the log has been read, after which the state only has str keys and can be merged, stored as JSON with state()
+    and reported with rows().
+    """
+
+    name = None
+    title = None
+    fields = ()
+
+    def update(self, *columns):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def rows(self, report_size):
+        raise NotImplementedError
+
+    def state(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state):
+        raise NotImplementedError
+
+
+def decode_keys(values, merge):
+    # Different raw bytes can decode to the same text
+    decoded = {}
+    for key, value in values.items():
+        key = key.decode("UTF-8", "replace")
+        if key in decoded:
+            decoded[key] = merge(decoded[key], value)
+        else:
+            decoded[key] = value
+    return decoded
+
+
+@register
+class StatusHistogram(Aggregator):
+    name = "status"
+    title = "Requests by status"
+    fields = ("status",)
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def update(self, statuses):
+        self.counts.update(statuses)
+
+    def finish(self):
+        self.counts = Counter(decode_keys(self.counts, int.__add__))
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def rows(self, report_size):
+        total = sum(self.counts.values())
+        return [{"status": status, "count": count, "count_perc": round(count / total * 100, 3)}
+                for status, count in sorted(self.counts.items())]
+
+    def state(self):
+        return dict(self.counts)
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls()
+        aggregator.counts.update(state)
+        return aggregator
+
+
+@register
+class HourlyLatency(Aggregator):
+    name = "hourly"
+    title = "Request time by hour"
+    fields = ("time_local", "request_time")
+    accuracy = 0.01
+
+    def __init__(self):
+        self.hours = {}
+
+    def update(self, times_local, request_times):
+        # "29/Jun/2017:03:50:23 +0300" up to the hour. Lines come in time order, so a batch is a few runs of an hour
+        hours = [time_local[:14] for time_local in times_local]
+        for hour, run in groupby(zip(hours, request_times), itemgetter(0)):
+            hour_sketch = self.hours.get(hour)
+            if hour_sketch is None:
+                hour_sketch = self.hours[hour] = QuantileSketch(self.accuracy)
+            hour_sketch.update([float(request_time) for _, request_time in run])
+
+    def finish(self):
+        self.hours = decode_keys(self.hours, QuantileSketch.merge)
+
+    def merge(self, other):
+        for hour, hour_sketch in other.hours.items():
+            if hour in self.hours:
+                self.hours[hour].merge(hour_sketch)
+            else:
+                self.hours[hour] = sketch_from_state(sketch_state(hour_sketch))
+
+    def rows(self, report_size):
+        rows = []
+        for hour in sorted(self.hours, key=parse_hour):
+            hour_sketch = self.hours[hour]
+            time_med, time_p90, time_p99 = hour_sketch.quantiles(0.5, 0.9, 0.99)
+            rows.append({"hour": parse_hour(hour).strftime("%Y-%m-%d %H:00"),
+                         "count": hour_sketch.count,
+                         "time_avg": round(hour_sketch.mean(), 3),
+                         "time_med": round(time_med, 3),
+                         "time_p90": round(time_p90, 3),
+                         "time_p99": round(time_p99, 3),
+                         "time_max": round(hour_sketch.max, 3)})
+        return rows
+
+    def state(self):
+        return {hour: sketch_state(hour_sketch) for hour, hour_sketch in self.hours.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls()
+        aggregator.hours = {hour: sketch_from_state(hour_state) for hour, hour_state in state.items()}
+        return aggregator
+
+
+def parse_hour(hour):
+    try:
+        return datetime.strptime(hour, "%d/%b/%Y:%H")
+    except ValueError:
+        return datetime.min
+
+
+def sketch_state(sketch):
+    return {"accuracy": sketch.accuracy, "count": sketch.count, "sum": sketch.sum, "min": sketch.min,
+            "max": sketch.max, "zero_count": sketch.zero_count, "bins": list(sketch.bins.items())}
+
+
+def sketch_from_state(state):
+    sketch = QuantileSketch(state["accuracy"])
+    sketch.count, sketch.sum, sketch.min, sketch.max = state["count"], state["sum"], state["min"], state["max"]
+    sketch.zero_count = state["zero_count"]
+    sketch.bins = {key: count for key, count in state["bins"]}
+    return sketch
+
+
+class SumAggregator(Aggregator):
+    """Number of lines and sum of a numeric field per key"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.sums = {}
+
+    def update(self, keys, values):
+        self.counts.update(keys)
+        sums = self.sums
+        for key, value in zip(keys, values):
+            if key in sums:
+                sums[key] += float(value)
+            else:
+                sums[key] = float(value)
+
+    def finish(self):
+        self.counts = Counter(decode_keys(self.counts, int.__add__))
+        self.sums = decode_keys(self.sums, float.__add__)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        for key, value in other.sums.items():
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def state(self):
+        return {key: [count, self.sums[key]] for key, count in self.counts.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls()
+        for key, (count, value_sum) in state.items():
+            aggregator.counts[key] = count
+            aggregator.sums[key] = value_sum
+        return aggregator
+
+
+@register
+class TopClients(SumAggregator):
+    name = "clients"
+    title = "Top client IPs"
+    fields = ("remote_addr", "request_time")
+
+    def rows(self, report_size):
+        total_count = sum(self.counts.values())
+        return [{"ip": ip, "count": count, "count_perc": round(count / total_count * 100, 3),
+                 "time_sum": round(self.sums[ip], 3)}
+                for ip, count in self.counts.most_common(report_size)]
+
+
+@register
+class BytesSent(SumAggregator):
+    name = "bytes"
+    title = "Bytes sent by URL"
+    fields = ("href", "body_bytes_sent")
+
+    def rows(self, report_size):
+        total_bytes = math.fsum(self.sums.values()) or 1
+        top = sorted(self.sums.items(), key=itemgetter(1), reverse=True)[:report_size]
+        return [{"url": url, "count": self.counts[url], "bytes_sum": int(bytes_sum),
+                 "bytes_avg": round(bytes_sum / self.counts[url], 3),
+                 "bytes_perc": round(bytes_sum / total_bytes * 100, 3)}
+                for url, bytes_sum in top]
+
+
+class Pipeline(object):
+    """The aggregators a parser feeds besides the URL timings, and the line regex that captures all their fields"""
+
+    def __init__(self, names, normalize=None):
+        unknown = [name for name in names if name not in AGGREGATORS]
+        if unknown:
+            raise ValueError("Unknown aggregators %s. Expected some of: %s"
+                             % (", ".join(unknown), ", ".join(AGGREGATORS)))
+        self.names = list(names)
+        self.normalize = normalize
+
+        fields = list(URL_FIELDS)
+        for name in self.names:
+            fields.extend(field for field in AGGREGATORS[name].fields if field not in fields)
+        self.line_re = build_line_re(fields)
+        self.index = {field: self.line_re.groupindex[field] - 1 for field in fields}
+        self.url_fields = itemgetter(*(self.index[field] for field in URL_FIELDS))
+
+    def start(self):
+        return PipelineRun(self)
+
+
+class PipelineRun(object):
+    """Aggregators of one parse. The parser appends the groups of every matched line to `batch`
+    and calls feed() once it holds BATCH_SIZE lines and when the log is over"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.sections = {name: AGGREGATORS[name]() for name in pipeline.names}
+        self.batch = []
+
+    def feed(self):
+        if not self.batch:
+            return
+        columns = {}
+        for name, aggregator in self.sections.items():
+            for field in aggregator.fields:
+                if field not in columns:
+                    columns[field] = self._column(field)
+            aggregator.update(*[columns[field] for field in aggregator.fields])
+        self.batch.clear()
+
+    def _column(self, field):
+        column = list(map(itemgetter(self.pipeline.index[field]), self.batch))
+        if field == "href" and self.pipeline.normalize is not None:
+            column = list(map(self.pipeline.normalize, column))
+        return column
+
+    def finish(self, log_data):
+        self.feed()
+        for aggregator in self.sections.values():
+            aggregator.finish()
+        return attach(log_data, self.sections)
+
+
+class SectionedLog(dict):
+    """log_data of parse_log along with the extra aggregators in `sections`"""
+
+    sections = None
+
+
+def attach(log_data, sections):
+    if not sections:
+        return log_data
+    if type(log_data) is dict:
+        log_data = SectionedLog(log_data)
+    log_data.sections = sections
+    return log_data
+
+
+def get_sections(log_data):
+    return getattr(log_data, "sections", None) or {}
+
+
+def merge_sections(parts):
+    merged = {}
+    for sections in parts:
+        for name, aggregator in sections.items():
+            if name in merged:
+                merged[name].merge(aggregator)
+            else:
+                merged[name] = AGGREGATORS[name].from_state(aggregator.state())
+    return merged
+
+
+def report_sections(log_data, report_size):
+    return [{"name": name, "title": aggregator.title, "rows": aggregator.rows(report_size)}
+            for name, aggregator in get_sections(log_data).items()]
@@ -0,0 +1,221 @@
+import os
+import sys
+import gzip
+import json
+import struct
+from array import array
+
+import aggregators
+import columnar
+import heavy
+import reportio
+from columnar import TOTALS
+from sketch import QuantileSketch
+
+# Binary layout of a stored aggregate:
+#   MAGIC | version (uint16) | header length (uint32) | JSON header | sections
+# The header lists the binary sections (name, array typecode, item count) in the order
+# they follow it. Sections are little-endian packed arrays.
+MAGIC = b"LAGG"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHI")
+GZIP_MAGIC = b"\x1f\x8b"
+
+# "times" keeps every request time grouped by URL in file order and can be loaded as either
+# the exact or the columnar log data. "sketch" keeps the per-URL quantile sketches,
+# plus the time sum errors in the heavy-hitters mode.
+# The states of the extra AGGREGATORS, if any, are kept in the header under "aggregators".
+LAYOUTS = ("times", "sketch")
+
+
+class AggregateError(Exception):
+    pass
+
+
+class StaleAggregateError(AggregateError):
+    pass
+
+
+def log_source(log_path):
+    stat = os.stat(log_path)
+    return {"name": os.path.basename(log_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def dump(log_data, fileobj, source=None, settings=None):
+    header = {key: log_data[key] for key in TOTALS}
+    header["source"] = source
+    header["settings"] = settings or {}
+    sections = aggregators.get_sections(log_data)
+    if sections:
+        header["aggregators"] = {name: aggregator.state() for name, aggregator in sections.items()}
+
+    if isinstance(log_data, columnar.ColumnarLog):
+        counts, times = columnar.group_by_url(log_data)
+        urls, sections = list(log_data.urls), [("counts", counts), ("times", times)]
+        header["layout"] = "times"
+    else:
+        urls = [url for url in log_data if url not in TOTALS]
+        entries = [log_data[url] for url in urls]
+        if entries and isinstance(entries[0], QuantileSketch):
+            header["layout"] = "sketch"
+            header["accuracy"] = entries[0].accuracy
+            sections = _sketch_sections(entries)
+            if isinstance(log_data, heavy.HeavyLog):
+                header["heavy"] = {"capacity": log_data.capacity, "floor": log_data.floor}
+                sections.append(("errors", array('d', (log_data.errors.get(url, 0.0) for url in urls))))
+        else:
+            header["layout"] = "times"
+            times = array('d')
+            for entry in entries:
+                times.extend(entry)
+            sections = [("counts", array('q', map(len, entries))), ("times", times)]
+
+    header["urls"] = urls
+    header["sections"] = [[name, data.typecode, len(data)] for name, data in sections]
+    header_bytes = json.dumps(header).encode("UTF-8")
+
+    fileobj.write(PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+    fileobj.write(header_bytes)
+    for name, data in sections:
+        if sys.byteorder == "big":
+            data = array(data.typecode, data)
+            data.byteswap()
+        data.tofile(fileobj)
+
+
+def load(fileobj, stats_mode="exact", accuracy=None, source=None, settings=None):
+    header, sections = load_raw(fileobj, source, settings)
+    layout = header["layout"]
+
+    if layout == "sketch":
+        sketch_mode = "heavy" if "heavy" in header else "approx"
+        if stats_mode != sketch_mode or header["accuracy"] != accuracy:
+            raise AggregateError("Stored sketches can only be loaded in the %s mode with accuracy %r"
+                                 % (sketch_mode, header["accuracy"]))
+        entries = _sketches_from_sections(header["accuracy"], sections)
+        if sketch_mode == "heavy":
+            log_data = heavy.HeavyLog(header["heavy"]["capacity"], header["heavy"]["floor"],
+                                      **{key: header[key] for key in TOTALS})
+            log_data.update(zip(header["urls"], entries))
+            log_data.errors = {url: error for url, error in zip(header["urls"], sections["errors"]) if error}
+            return header, _attach_aggregators(header, log_data)
+    elif stats_mode == "heavy":
+        raise AggregateError("Stored request times can't be loaded in the heavy mode")
+    else:
+        counts, times = sections["counts"], sections["times"]
+        if stats_mode == "columnar":
+            log_data = columnar.from_url_groups(header["urls"], counts, times, header["total_errors"])
+            return header, _attach_aggregators(header, log_data)
+        entries = []
+        start = 0
+        for count in counts:
+            entries.append(times[start:start + count].tolist())
+            start += count
+        if stats_mode == "approx":
+            entries = [_sketch_from_times(entry, accuracy) for entry in entries]
+
+    log_data = {key: header[key] for key in TOTALS}
+    log_data.update(zip(header["urls"], entries))
+    return header, _attach_aggregators(header, log_data)
+
+
+def _attach_aggregators(header, log_data):
+    states = header.get("aggregators", {})
+    unknown = [name for name in states if name not in aggregators.AGGREGATORS]
+    if unknown:
+        raise AggregateError("Unknown aggregators %s" % ", ".join(unknown))
+    return aggregators.attach(log_data, {name: aggregators.AGGREGATORS[name].from_state(state)
+                                         for name, state in states.items()})
+
+
+def load_raw(fileobj, source=None, settings=None):
+    header = _read_header(fileobj)
+    if source is not None and header["source"] != source:
+        raise StaleAggregateError("Aggregate of %s doesn't match the log anymore" % source["name"])
+    if settings is not None and header.get("settings", {}) != settings:
+        raise StaleAggregateError("Aggregate was parsed with other settings: %r" % header.get("settings", {}))
+
+    sections = {}
+    for name, typecode, length in header["sections"]:
+        data = array(typecode)
+        try:
+            data.fromfile(fileobj, length)
+        except EOFError:
+            raise AggregateError("Truncated aggregate file")
+        if sys.byteorder == "big":
+            data.byteswap()
+        sections[name] = data
+    return header, sections
+
+
+def open_aggregate(path):
+    """Opens a stored aggregate for reading, whether it was saved compressed or not"""
+    fileobj = open(path, 'rb')
+    if fileobj.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        fileobj.seek(0)
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    fileobj.seek(0)
+    return fileobj
+
+
+def read_header(path):
+    with open_aggregate(path) as fileobj:
+        return _read_header(fileobj)
+
+
+def save(log_data, path, source=None, settings=None, compress=False):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with reportio.atomic_open(path, compress, binary=True) as fileobj:
+        dump(log_data, fileobj, source, settings)
+
+
+def _read_header(fileobj):
+    preamble = fileobj.read(PREAMBLE.size)
+    if len(preamble) != PREAMBLE.size:
+        raise AggregateError("Truncated aggregate file")
+    magic, version, header_length = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise AggregateError("Not an aggregate file")
+    if version != VERSION:
+        raise AggregateError("Unsupported aggregate file version %d" % version)
+    return json.loads(fileobj.read(header_length).decode("UTF-8"))
+
+
+def _sketch_sections(sketches):
+    sections = {"counts": array('q'), "sums": array('d'), "mins": array('d'), "maxs": array('d'),
+                "zero_counts": array('q'), "bin_lengths": array('q'),
+                "bin_keys": array('q'), "bin_counts": array('q')}
+    for sketch in sketches:
+        sections["counts"].append(sketch.count)
+        sections["sums"].append(sketch.sum)
+        sections["mins"].append(sketch.min)
+        sections["maxs"].append(sketch.max)
+        sections["zero_counts"].append(sketch.zero_count)
+        sections["bin_lengths"].append(len(sketch.bins))
+        sections["bin_keys"].extend(sketch.bins.keys())
+        sections["bin_counts"].extend(sketch.bins.values())
+    return list(sections.items())
+
+
+def _sketches_from_sections(accuracy, sections):
+    sketches = []
+    start = 0
+    for i, bin_length in enumerate(sections["bin_lengths"]):
+        sketch = QuantileSketch(accuracy)
+        sketch.count = sections["counts"][i]
+        sketch.sum = sections["sums"][i]
+        sketch.min = sections["mins"][i]
+        sketch.max = sections["maxs"][i]
+        sketch.zero_count = sections["zero_counts"][i]
+        end = start + bin_length
+        sketch.bins = dict(zip(sections["bin_keys"][start:end], sections["bin_counts"][start:end]))
+        start = end
+        sketches.append(sketch)
+    return sketches
+
+
+def _sketch_from_times(times, accuracy):
+    sketch = QuantileSketch(accuracy)
+    for value in times:
+        sketch.add(value)
+    return sketch
@@ -0,0 +1,151 @@
+import math
+import statistics
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # The columnar backend is optional
+    np = None
+
+# Rounding to 3 digits can reorder sums that lie closer than this, so such URLs are
+# all kept as top-K candidates and ordered by the rounded value just like the list backend does
+ROUNDING_MARGIN = 0.001
+# Keys of the totals that every kind of log data holds next to its URLs
+TOTALS = ('total_count', 'total_req_time', 'total_errors')
+
+
+class ColumnarLog(dict):
+    """Parsed log as packed columns: one (url_id, request_time) pair per request.
+
+    The dict part holds the same totals as the log_data of parse_log,
+    the URLs themselves are interned into `urls`, indexed by url_id.
+    """
+
+    def __init__(self, urls, url_ids, request_times, total_errors=0):
+        super().__init__(total_count=len(request_times),
+                         total_req_time=math.fsum(request_times),
+                         total_errors=total_errors)
+        self.urls = urls
+        self.url_ids = url_ids
+        self.request_times = request_times
+
+
+def merge_columnar(parts):
+    # Parts have to come in file order to keep the per-URL order of request times
+    urls = []
+    url_index = {}
+    url_ids = array('i')
+    request_times = array('d')
+    total_errors = 0
+
+    for part in parts:
+        remap = []
+        for url in part.urls:
+            url_id = url_index.get(url)
+            if url_id is None:
+                url_id = url_index[url] = len(urls)
+                urls.append(url)
+            remap.append(url_id)
+        if remap == list(range(len(remap))):
+            url_ids.extend(part.url_ids)
+        else:
+            url_ids.extend(remap[url_id] for url_id in part.url_ids)
+        request_times.extend(part.request_times)
+        total_errors += part["total_errors"]
+
+    return ColumnarLog(urls, url_ids, request_times, total_errors)
+
+
+def group_by_url(log_data):
+    """Returns per-URL counts and the request times grouped by URL, each group in file order"""
+    if np is None:
+        counts = array('q', [0]) * len(log_data.urls)
+        for url_id in log_data.url_ids:
+            counts[url_id] += 1
+        order = sorted(range(len(log_data.url_ids)), key=log_data.url_ids.__getitem__)
+        return counts, array('d', map(log_data.request_times.__getitem__, order))
+
+    url_ids = np.frombuffer(log_data.url_ids, dtype=np.int32)
+    counts = np.bincount(url_ids, minlength=len(log_data.urls)).astype(np.int64)
+    times = np.frombuffer(log_data.request_times, dtype=np.float64)[np.argsort(url_ids, kind='stable')]
+    return array('q', counts.tobytes()), array('d', times.tobytes())
+
+
+def from_url_groups(urls, counts, request_times, total_errors=0):
+    if np is None:
+        url_ids = array('i')
+        for url_id, count in enumerate(counts):
+            url_ids.extend(array('i', [url_id]) * count)
+    else:
+        url_ids = np.repeat(np.arange(len(urls), dtype=np.int32), np.frombuffer(counts, dtype=np.int64))
+        url_ids = array('i', url_ids.tobytes())
+    return ColumnarLog(urls, url_ids, request_times, total_errors)
+
+
+def url_report(log_data, report_size):
+    if np is None:
+        raise RuntimeError("The columnar backend requires numpy")
+
+    url_count = len(log_data.urls)
+    if not url_count or report_size <= 0:
+        return []
+
+    url_ids = np.frombuffer(log_data.url_ids, dtype=np.int32)
+    request_times = np.frombuffer(log_data.request_times, dtype=np.float64)
+
+    counts = np.bincount(url_ids, minlength=url_count)
+    sums = np.bincount(url_ids, weights=request_times, minlength=url_count)
+
+    if report_size < url_count:
+        kth_sum = np.partition(sums, url_count - report_size)[url_count - report_size]
+        candidates = np.flatnonzero(sums >= kth_sum - ROUNDING_MARGIN)
+    else:
+        candidates = np.arange(url_count)
+
+    # Only the candidate URLs get their request times gathered; a stable sort by id
+    # keeps every URL's times in file order, so the sums match the list backend to the bit
+    selected = np.zeros(url_count, dtype=bool)
+    selected[candidates] = True
+    mask = selected[url_ids]
+    candidate_url_ids = url_ids[mask]
+    by_url = np.argsort(candidate_url_ids, kind='stable')
+    candidate_times = request_times[mask][by_url]
+    group_bounds = np.searchsorted(candidate_url_ids[by_url], candidates).tolist() + [len(candidate_times)]
+
+    groups = []
+    for i, url_id in enumerate(candidates.tolist()):
+        times = candidate_times[group_bounds[i]:group_bounds[i + 1]]
+        time_sum = sum(times.tolist())
+        groups.append((round(time_sum, 3), url_id, time_sum, times))
+    # Stable sort of the ascending ids by the rounded sum is the order of the list backend
+    groups.sort(key=lambda group: group[0], reverse=True)
+
+    total_count = log_data["total_count"]
+    total_req_time = log_data["total_req_time"]
+    report = []
+    for rounded_sum, url_id, time_sum, times in groups[:report_size]:
+        count = int(counts[url_id])
+        sorted_times = np.sort(times)
+        middle = count // 2
+        if count % 2:
+            time_med = float(sorted_times[middle])
+        else:
+            time_med = (float(sorted_times[middle - 1]) + float(sorted_times[middle])) / 2
+        report.append({"count": count,
+                       "time_avg": round(mean(times), 3),
+                       "time_max": round(float(sorted_times[-1]), 3),
+                       "time_sum": rounded_sum,
+                       "url": log_data.urls[url_id],
+                       "time_med": round(time_med, 3),
+                       "time_perc": round((time_sum / total_req_time * 100), 3),
+                       "count_perc": round((count / total_count * 100), 3)})
+    return report
+
+
+def mean(times):
+    # statistics.mean is exact but slow. fsum/len is off by an ulp at most, which only
+    # matters when the mean sits right on a rounding boundary of the report
+    estimate = math.fsum(times) / len(times)
+    if round(estimate * (1 - 1e-12), 3) == round(estimate * (1 + 1e-12), 3):
+        return estimate
+    return statistics.mean(times.tolist())
@@ -0,0 +1,133 @@
+import os
+import time
+
+from sketch import QuantileSketch
+
+
+class LogFollower(object):
+    """Incrementally reads complete lines appended to a growing log.
+
+    Every call reads only the bytes written since the previous one. A rotated log
+    (the path now points to another file) is read to its end before switching to
+    the new file, a truncated one is read again from the start. Lines are yielded
+    chunk by chunk as they are read, so a long backlog is never held in memory at once.
+    """
+
+    def __init__(self, log_path, from_start=False, chunk_size=1 << 20):
+        self.log_path = log_path
+        # A log that exists when following starts is skipped unless asked otherwise,
+        # every file that appears later is read from its very beginning
+        self.skip_existing = not from_start
+        self.chunk_size = chunk_size
+        self.log_file = None
+        self.file_id = None
+        self.offset = 0
+        self.pending = b""
+
+    def read_lines(self):
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            # Between the rotation of the old log and the creation of the new one
+            stat = None
+
+        if self.log_file is not None and stat is not None and (stat.st_dev, stat.st_ino) != self.file_id:
+            yield from self._read_available()
+            yield from self._flush_pending()
+            self.close()
+
+        if self.log_file is None:
+            if stat is None:
+                return
+            self._open(stat)
+        elif stat is not None and stat.st_size < self.offset:
+            self.log_file.seek(0)
+            self.offset = 0
+            self.pending = b""
+
+        yield from self._read_available()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+        self.log_file = None
+        self.file_id = None
+
+    def _open(self, stat):
+        self.log_file = open(self.log_path, 'rb')
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.offset = 0
+        self.pending = b""
+        if self.skip_existing:
+            self.offset = self.log_file.seek(0, os.SEEK_END)
+        self.skip_existing = False
+
+    def _read_available(self):
+        while True:
+            data = self.log_file.read(self.chunk_size)
+            if not data:
+                return
+            self.offset += len(data)
+            data = self.pending + data
+            complete, _, self.pending = data.rpartition(b"\n")
+            if complete:
+                yield from complete.split(b"\n")
+
+    def _flush_pending(self):
+        lines = [self.pending] if self.pending else []
+        self.pending = b""
+        return lines
+
+
+class TimeBucket(object):
+    __slots__ = ('start', 'count', 'errors', 'entries')
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.errors = 0
+        self.entries = {}
+
+
+class RollingWindow(object):
+    """Per-URL sketches in fixed-size time buckets, kept for `span` seconds.
+
+    Statistics over the last N seconds are a merge of the buckets, so their cost
+    depends on the number of URLs and buckets, not on the number of requests.
+    """
+
+    def __init__(self, span, bucket_seconds=60, accuracy=0.01):
+        self.span = span
+        self.bucket_seconds = bucket_seconds
+        self.accuracy = accuracy
+        self.buckets = []
+
+    def current(self, now=None):
+        if now is None:
+            now = time.time()
+        start = now - now % self.bucket_seconds
+        if not self.buckets or self.buckets[-1].start < start:
+            self.buckets.append(TimeBucket(start))
+        self.expire(now)
+        return self.buckets[-1]
+
+    def expire(self, now):
+        oldest = now - self.span
+        while self.buckets and self.buckets[0].start + self.bucket_seconds <= oldest:
+            self.buckets.pop(0)
+
+    def collect(self, seconds, now=None):
+        if now is None:
+            now = time.time()
+        window = TimeBucket(now - seconds)
+        for bucket in self.buckets:
+            if bucket.start + self.bucket_seconds <= now - seconds:
+                continue
+            window.count += bucket.count
+            window.errors += bucket.errors
+            for key, bucket_sketch in bucket.entries.items():
+                window_sketch = window.entries.get(key)
+                if window_sketch is None:
+                    window_sketch = window.entries[key] = QuantileSketch(self.accuracy)
+                window_sketch.merge(bucket_sketch)
+        return window
@@ -0,0 +1,202 @@
+import os
+import gzip
+import zlib
+import struct
+
+try:
+    import indexed_gzip
+except ImportError:  # Without it single-member gzip logs are read by one process
+    indexed_gzip = None
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+FEXTRA = 4
+INDEX_SUFFIX = ".gzidx"
+# Distance between two access points of the index, in uncompressed bytes
+INDEX_SPACING = 4 << 20
+# How far past a split target a member header is looked for
+SCAN_LIMIT = 4 << 20
+BLOCK_SIZE = 1 << 20
+
+
+class SplitError(Exception):
+    """A region doesn't start or end on a member boundary after all"""
+
+
+def index_path(log_path):
+    return log_path + INDEX_SUFFIX
+
+
+def open_gzip(log_path):
+    """Opens a gzip log for a sequential read.
+
+    With indexed_gzip installed, the read also builds the access-point index
+    that save_index stores next to the log for later parallel reads.
+    """
+    if indexed_gzip is None or has_index(log_path):
+        return gzip.open(log_path, 'rb')
+    return indexed_gzip.IndexedGzipFile(log_path, spacing=INDEX_SPACING)
+
+
+def save_index(gzip_file, log_path):
+    if indexed_gzip is None or not isinstance(gzip_file, indexed_gzip.IndexedGzipFile):
+        return False
+    try:
+        gzip_file.export_index(index_path(log_path))
+    except (OSError, indexed_gzip.ZranError):
+        return False
+    return True
+
+
+def has_index(log_path):
+    path = index_path(log_path)
+    return os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(log_path)
+
+
+def plan_chunks(log_path, parts):
+    """Returns a reader function and the (start, end) regions it can read independently,
+    or (None, []) if the log can only be read sequentially"""
+    boundaries = find_member_boundaries(log_path, parts)
+    if len(boundaries) > 2:
+        return read_members, list(zip(boundaries, boundaries[1:]))
+
+    if indexed_gzip is not None and has_index(log_path):
+        with indexed_gzip.IndexedGzipFile(log_path, index_file=index_path(log_path)) as gzip_file:
+            size = gzip_file.seek(0, os.SEEK_END)
+        bounds = sorted(set(size * i // parts for i in range(parts + 1)))
+        return read_indexed, list(zip(bounds, bounds[1:]))
+
+    return None, []
+
+
+def find_member_boundaries(log_path, parts):
+    """Compressed offsets of member starts that split the file into about `parts` regions.
+
+    BGZF-style members (pigz --independent, bgzip) state their own size in the header,
+    so they are walked without decompressing. Elsewhere a member header is looked for
+    after every split target and only accepted if a decompressor takes it.
+    """
+    size = os.path.getsize(log_path)
+    with open(log_path, 'rb') as log_file:
+        members = _bgzf_members(log_file, size)
+        if members is not None:
+            bounds = [0]
+            for i in range(1, parts):
+                target = size * i // parts
+                start = members[min(_bisect(members, target), len(members) - 1)]
+                if bounds[-1] < start < size:
+                    bounds.append(start)
+            return bounds + [size]
+
+        bounds = [0]
+        for i in range(1, parts):
+            start = _find_member_start(log_file, max(size * i // parts, bounds[-1] + 1), size)
+            if start is not None and bounds[-1] < start < size:
+                bounds.append(start)
+        return bounds + [size]
+
+
+def read_members(log_path, start, end):
+    """Yields the lines of the gzip members stored in the compressed range [start, end)"""
+    with open(log_path, 'rb') as log_file:
+        log_file.seek(start)
+        try:
+            with gzip.GzipFile(fileobj=_Region(log_file, end - start)) as gzip_file:
+                for line in gzip_file:
+                    yield line
+        except (EOFError, OSError, zlib.error) as e:
+            raise SplitError("Range %d-%d of %s is not made of whole gzip members: %s" % (start, end, log_path, e))
+
+
+def read_indexed(log_path, start, end):
+    """Yields the lines of the uncompressed range [start, end), seeking through the stored index"""
+    with indexed_gzip.IndexedGzipFile(log_path, index_file=index_path(log_path)) as gzip_file:
+        gzip_file.seek(start)
+        remaining = end - start
+        pending = b""
+        while remaining > 0:
+            block = gzip_file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if pending:
+            yield pending
+
+
+class _Region(object):
+    # A read-only view of the next `length` bytes of a file
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _bisect(values, target):
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _bgzf_members(log_file, size):
+    starts = []
+    offset = 0
+    while offset < size:
+        log_file.seek(offset)
+        header = log_file.read(18)
+        if len(header) < 18 or header[:3] != GZIP_MAGIC or not header[3] & FEXTRA:
+            return None
+        xlen, = struct.unpack("<H", header[10:12])
+        extra = header[12:] + log_file.read(max(0, xlen - 6))
+        block_size = None
+        position = 0
+        while position + 4 <= xlen:
+            subfield_id, subfield_length = extra[position:position + 2], struct.unpack("<H", extra[position + 2:position + 4])[0]
+            if subfield_id == b"BC" and subfield_length == 2:
+                block_size = struct.unpack("<H", extra[position + 4:position + 6])[0] + 1
+                break
+            position += 4 + subfield_length
+        if block_size is None:
+            return None
+        starts.append(offset)
+        offset += block_size
+    return starts if offset == size else None
+
+
+def _find_member_start(log_file, offset, size):
+    scanned = 0
+    while scanned < SCAN_LIMIT and offset < size:
+        log_file.seek(offset)
+        window = log_file.read(BLOCK_SIZE + len(GZIP_MAGIC) - 1)
+        position = window.find(GZIP_MAGIC)
+        while position != -1:
+            if _is_member_start(log_file, offset + position):
+                return offset + position
+            position = window.find(GZIP_MAGIC, position + 1)
+        offset += BLOCK_SIZE
+        scanned += BLOCK_SIZE
+    return None
+
+
+def _is_member_start(log_file, offset):
+    log_file.seek(offset)
+    data = log_file.read(1 << 16)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    try:
+        output = decompressor.decompress(data, 1 << 12)
+    except zlib.error:
+        return False
+    return bool(output) or decompressor.eof
@@ -0,0 +1,136 @@
+import heapq
+
+from columnar import TOTALS
+from sketch import QuantileSketch
+
+
+class SpaceSaving(object):
+    """Weighted Space-Saving summary (Metwally et al.) of at most `capacity` keys.
+
+    Every tracked key has a sketch of its request times. When a new key comes while all
+    the slots are taken, the key with the least estimated time sum is evicted and the newcomer
+    inherits its estimate as the error: the true time sum of a key lies between the sum
+    of its sketch and that plus its error. Any key with more than 1/capacity of the total time is tracked.
+    """
+
+    def __init__(self, capacity, accuracy=0.01):
+        if capacity < 1:
+            raise ValueError("Space-Saving capacity must be positive, got %r" % capacity)
+        self.capacity = capacity
+        self.accuracy = accuracy
+        self.entries = {}
+        self.errors = {}
+        # One (estimate, key) item per tracked key. Estimates only grow,
+        # so an item is refreshed lazily when it comes to the top
+        self._heap = []
+
+    def estimate(self, key):
+        return self.entries[key].sum + self.errors.get(key, 0.0)
+
+    def floor(self):
+        """Upper bound of the time sum of any untracked key"""
+        if len(self.entries) < self.capacity:
+            return 0.0
+        return min(map(self.estimate, self.entries))
+
+    def add(self, key, value):
+        entry = self.entries.get(key)
+        if entry is None:
+            error = self._evict() if len(self.entries) >= self.capacity else 0.0
+            entry = self.entries[key] = QuantileSketch(self.accuracy)
+            if error:
+                self.errors[key] = error
+            heapq.heappush(self._heap, (error + value, key))
+        entry.add(value)
+
+    def _evict(self):
+        heap = self._heap
+        while True:
+            estimate, key = heap[0]
+            current = self.estimate(key)
+            if current == estimate:
+                break
+            heapq.heapreplace(heap, (current, key))
+        heapq.heappop(heap)
+        del self.entries[key]
+        self.errors.pop(key, None)
+        return estimate
+
+
+class HeavyLog(dict):
+    """Log data of the heavy-hitters mode.
+
+    The dict part is the same as the log_data of parse_log in the approx mode, but holds only
+    the tracked URLs. `errors` has the time sum error of the URLs that replaced others and
+    `floor` bounds the time sum of every URL that isn't there.
+    """
+
+    def __init__(self, capacity, floor=0.0, errors=None, **totals):
+        super().__init__(**totals)
+        self.capacity = capacity
+        self.floor = floor
+        self.errors = errors if errors is not None else {}
+
+
+def from_summary(summary, decode, total_count, total_req_time, total_errors):
+    log_data = HeavyLog(summary.capacity, summary.floor(), total_count=total_count,
+                        total_req_time=total_req_time, total_errors=total_errors)
+    for key, entry in summary.entries.items():
+        url = decode(key)
+        error = summary.errors.get(key, 0.0)
+        if url in log_data:
+            log_data[url].merge(entry)
+            error += log_data.errors.get(url, 0.0)
+        else:
+            log_data[url] = entry
+        if error:
+            log_data.errors[url] = error
+    return log_data
+
+
+def merge_heavy(parts):
+    """Merges summaries of separate parts of a log and keeps the `capacity` URLs with the largest estimates.
+
+    A URL missing from a part may still have taken up to that part's floor there,
+    which is added to its error.
+    """
+    capacity = max(part.capacity for part in parts)
+    urls = {}
+    for part in parts:
+        for url in part:
+            if url not in TOTALS:
+                urls[url] = None
+
+    merged = {}
+    errors = {}
+    for url in urls:
+        entry = None
+        error = 0.0
+        for part in parts:
+            if url in part:
+                if entry is None:
+                    entry = QuantileSketch(part[url].accuracy)
+                entry.merge(part[url])
+                error += part.errors.get(url, 0.0)
+            else:
+                error += part.floor
+        merged[url] = entry
+        errors[url] = error
+
+    ranked = sorted(urls, key=lambda url: merged[url].sum + errors[url], reverse=True)
+    kept, dropped = ranked[:capacity], ranked[capacity:]
+    floor = sum(part.floor for part in parts)
+    if dropped:
+        floor = max(floor, merged[dropped[0]].sum + errors[dropped[0]])
+
+    log_data = HeavyLog(capacity, floor,
+                        total_count=sum(part["total_count"] for part in parts),
+                        total_req_time=sum(part["total_req_time"] for part in parts),
+                        total_errors=sum(part["total_errors"] for part in parts))
+    kept = set(kept)
+    for url in urls:
+        if url in kept:
+            log_data[url] = merged[url]
+            if errors[url]:
+                log_data.errors[url] = errors[url]
+    return log_data
@@ -9,26 +9,72 @@
 import sys
 import os
 import argparse
-import gzip
 import re
 import json
 import string
 import logging
 import statistics
+import math
+import multiprocessing
+from itertools import chain, compress, repeat
+from functools import partial
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from decimal import Decimal
 from datetime import datetime
-import tempfile
+import time
+import socket
+from array import array
+from random import Random
+
+import aggregators
+import aggstore
+import columnar
+import gzindex
+import heavy
+import mapped
+import profiling
+import reportio
+import urlnorm
+from columnar import TOTALS
+from follow import LogFollower, RollingWindow
+from sketch import QuantileSketch
 
 CONFIG = {
     "REPORT_SIZE": 100,
     "REPORT_DIR": ".\\files\\reports",
     "LOG_DIR": ".\\files\\log",
     "REPORT_TEMPLATE": ".\\files\\templates\\report.html",
+    "REPORT_FORMAT": "html",
+    "REPORT_PAGE_SIZE": 1000,
+    "REPORT_GZIP": False,
     "LOG_FILE": ".\\files\\logfile",
-    "ERROR_THRESHOLD": 0.01
+    "REPORT_HISTORY": ".\\files\\report_history",
+    "PARTIAL_DIR": ".\\files\\partials",
+    "ERROR_THRESHOLD": 0.01,
+    "ERROR_MIN_LINES": 1000,
+    "WORKERS": 1,
+    "MMAP": False,
+    "STATS_MODE": "exact",
+    "QUANTILE_ACCURACY": 0.01,
+    "URL_RULES": [],
+    "URL_BUDGET": 10000,
+    "AGGREGATORS": [],
+    "FOLLOW_WINDOWS": [5, 15, 60],
+    "FOLLOW_INTERVAL": 10
 }
 
+STATS_MODES = ("exact", "approx", "columnar", "heavy")
+
+# z of the one-sided 99.9% confidence bound the early abort is based on
+ERROR_CONFIDENCE_Z = 3.09
+SAMPLE_SEED = 0
+
+# Named after the variable, so log infos can be pickled for the worker processes
+LogInfo = namedtuple('LogInfo', 'dir date ext')
+LOG_NAME_RE = re.compile(r'nginx-access-ui\.log-(?P<date>\d{8})(?P<ext>\.txt|\.gz|\.log)?$')
+
 os.chdir(os.path.dirname(__file__))
 
 def setup_logger(logfile=None):
@@ -45,23 +91,90 @@ def load_config(config, args=None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', help='Load an external log file')
-    cfg_location = parser.parse_args(args).config
+    parser.add_argument('--workers', type=int, help='Number of processes to parse a plain-text log with')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Read plain-text logs through a read-only memory map instead of buffered reads')
+    parser.add_argument('--stats-mode', choices=STATS_MODES,
+                        help='"approx" keeps per-URL quantile sketches instead of every request time, '
+                             '"columnar" keeps request times in packed arrays and aggregates them with numpy, '
+                             '"heavy" keeps sketches of only the URL_BUDGET URLs with the largest time sums')
+    parser.add_argument('--from', dest='date_from', help='First day (YYYYMMDD) of a multi-day trend report')
+    parser.add_argument('--to', dest='date_to', help='Last day (YYYYMMDD) of a multi-day trend report')
+    parser.add_argument('--follow', nargs='?', const=True, metavar='LOG',
+                        help='Follow a growing log (nginx-access-ui.log in LOG_DIR by default) '
+                             'and keep re-rendering reports over the last FOLLOW_WINDOWS minutes')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the report even if it exists, from the stored aggregate if there is one')
+    parser.add_argument('--backfill', action='store_true',
+                        help='Build the missing reports of every log in LOG_DIR (within --from/--to), '
+                             'WORKERS logs at a time')
+    parser.add_argument('--format', choices=reportio.REPORT_FORMATS,
+                        help='"html-pages" writes the report rows into page files the report loads as it is scrolled, '
+                             '"ndjson" and "csv" write them for other tools')
+    parser.add_argument('--gzip', action='store_true', help='Compress the ndjson and csv reports')
+    parser.add_argument('--map', nargs='?', const=True, metavar='LOG',
+                        help='Write the partial aggregate of LOG (the latest log in LOG_DIR by default) '
+                             'into PARTIAL_DIR, to be merged with the partials of other frontends by --reduce')
+    parser.add_argument('--reduce', nargs='+', metavar='PARTIAL',
+                        help='Build the report of the logs the partial aggregates (or stored aggregates) were made of')
+    parser.add_argument('--sample', type=float, metavar='RATE',
+                        help='Parse only a RATE share of the lines of the log and scale the counts and sums up, '
+                             'for a quick approximate report')
+    parser.add_argument('--profile', nargs='?', const='stages', choices=profiling.PROFILE_MODES,
+                        help='Log the time and memory of every stage and the parsing progress, and add them '
+                             'to the report. "cprofile" and "tracemalloc" also profile the parser in detail')
+    parsed_args = parser.parse_args(args)
+    cfg_location = parsed_args.config
+
+    overrides = {}
+    if parsed_args.workers is not None:
+        overrides["WORKERS"] = parsed_args.workers
+    if parsed_args.mmap:
+        overrides["MMAP"] = True
+    if parsed_args.stats_mode is not None:
+        overrides["STATS_MODE"] = parsed_args.stats_mode
+    if parsed_args.date_from is not None:
+        overrides["DATE_FROM"] = parsed_args.date_from
+    if parsed_args.date_to is not None:
+        overrides["DATE_TO"] = parsed_args.date_to
+    if parsed_args.follow is not None:
+        overrides["FOLLOW"] = True
+        if parsed_args.follow is not True:
+            overrides["FOLLOW_LOG"] = parsed_args.follow
+    if parsed_args.force:
+        overrides["FORCE"] = True
+    if parsed_args.backfill:
+        overrides["BACKFILL"] = True
+    if parsed_args.format is not None:
+        overrides["REPORT_FORMAT"] = parsed_args.format
+    if parsed_args.gzip:
+        overrides["REPORT_GZIP"] = True
+    if parsed_args.map is not None:
+        overrides["MAP"] = True
+        if parsed_args.map is not True:
+            overrides["MAP_LOG"] = parsed_args.map
+    if parsed_args.reduce is not None:
+        overrides["REDUCE"] = parsed_args.reduce
+    if parsed_args.sample is not None:
+        overrides["SAMPLE"] = parsed_args.sample
+    if parsed_args.profile is not None:
+        overrides["PROFILE"] = parsed_args.profile
 
     if not cfg_location:
-        return config
+        return {**config, **overrides}
 
     try:
         with open(cfg_location, 'r') as cfg_file:
             external_config = json.load(cfg_file)
-            merged_config = {**config, **external_config}
+            merged_config = {**config, **external_config, **overrides}
             return merged_config
     except Exception as e:
         error(e)
 
 
 def choose_log(log_dir):
-    log_info = namedtuple('log_info', 'dir date ext')
-    log_name_pattern = re.compile('nginx-access-ui\.log-(?P<date>\d{8})(?P<ext>\.txt|\.gz|\.log)?$')
+    log_info = LogInfo
+    log_name_pattern = LOG_NAME_RE
 
     if not os.path.isdir(log_dir):
         error("Error loading log. %s folder not found." % log_dir)
@@ -89,7 +202,52 @@ def choose_log(log_dir):
         error("No logs found")
 
 
-def open_log(log_info):
+def scan_logs(log_dir):
+    """Every log in log_dir by its date, from a single pass over the directory"""
+    if not os.path.isdir(log_dir):
+        error("Error loading log. %s folder not found." % log_dir)
+
+    logs = {}
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            log_re = LOG_NAME_RE.match(entry.name)
+            if log_re is None or not entry.is_file():
+                continue
+            log_date = datetime.strptime(log_re.group('date'), '%Y%m%d')
+            log_ext = log_re.group('ext')
+            # A day can be present both plain and gzipped; one of them is enough, the plain one is faster to read
+            if log_date not in logs or (log_ext or "") < (getattr(logs[log_date], "ext") or ""):
+                logs[log_date] = LogInfo(log_dir, log_date, log_ext)
+    return logs
+
+
+def choose_logs(log_dir, date_from=None, date_to=None):
+    logs = scan_logs(log_dir)
+    log_dates = [log_date for log_date in sorted(logs)
+                 if (date_from is None or log_date >= date_from) and (date_to is None or log_date <= date_to)]
+
+    if not log_dates:
+        error("No logs found")
+    return [logs[log_date] for log_date in log_dates]
+
+
+def get_log_info(log_path):
+    log_re = LOG_NAME_RE.match(os.path.basename(log_path))
+    if log_re is None:
+        error("%s is not named like a log: nginx-access-ui.log-YYYYMMDD[.gz]" % log_path)
+    return LogInfo(os.path.dirname(log_path), datetime.strptime(log_re.group('date'), '%Y%m%d'), log_re.group('ext'))
+
+
+def parse_date(date_str):
+    for date_format in ('%Y%m%d', '%Y-%m-%d', '%Y.%m.%d'):
+        try:
+            return datetime.strptime(date_str, date_format)
+        except ValueError:
+            continue
+    error("Can't parse date %s. Expected YYYYMMDD or YYYY-MM-DD" % date_str)
+
+
+def get_log_path(log_info):
     log_dir = getattr(log_info, "dir")
     log_date = getattr(log_info, "date")
     log_ext = getattr(log_info, "ext")
@@ -101,64 +259,344 @@ def open_log(log_info):
     else:
         log_name = 'nginx-access-ui.log-' + log_date_str + log_ext
 
-    log_path = os.path.join(log_dir, log_name)
+    return os.path.join(log_dir, log_name)
 
+
+def open_log(log_info, use_mmap=False):
+    log_ext = getattr(log_info, "ext")
+    log_path = get_log_path(log_info)
+
+    if use_mmap and log_ext in [".log", ".txt", None]:
+        yield from mapped.read_lines(log_path)
+        return
     if log_ext in [".log", ".txt", None]:
-        log_file = open(log_path, 'r')
+        log_file = open(log_path, 'rb')
     else:
-        log_file = gzip.open(log_path, 'r')
+        log_file = gzindex.open_gzip(log_path)
 
     for line in log_file:
         yield line
+    if log_ext == ".gz" and gzindex.save_index(log_file, log_path):
+        info("Saved the gzip index of %s" % log_path)
     log_file.close()
 
 
+# One pass over the raw bytes both validates a ui_short line and captures the two fields we need.
+# With AGGREGATORS configured, the parsers use a regex that captures their fields as well
+LINE_RE = aggregators.build_line_re(aggregators.URL_FIELDS)
+
+
+def decode_url(raw_url):
+    return raw_url.decode("UTF-8", "replace")
+
+
 def parse_line(line):
-    link_re = "(GET|POST)\s+(.*)\s+?HTTP\/"
-    req_time_re = "(\d+\.\d+)$"
-    try:
-        link = re.search(link_re, line).group(2)
-        request_time = re.search(req_time_re, line).group(1)
-    except:
-        info("Не удалось распарсить строчку: " + line)
-        pass
+    if isinstance(line, str):
+        line = line.encode("UTF-8")
 
-    return [link, float(request_time)]
+    match = LINE_RE.match(line)
+    if match is None:
+        return None
 
+    href, request_time = match.groups()
+    return decode_url(href), float(request_time)
 
-def parse_log(iterable):
+
+def parse_log(iterable, sketch_accuracy=None, normalize=None, on_error=None, pipeline=None):
     report_raw_data = {
         "total_count": 0, "total_req_time": 0, "total_errors": 0
     }
 
-    line_valid_pattern = re.compile(
-        '([\.\d]*) ([\-\d\w]*) +([\-\d\w\.]*) (\[.*\]) \"(GET|POST) (?P<href>.*)\" (\d*) (\d*) (\".*\") (\".*\") (\".*\") (\".*\") (\".*\") (?P<request_time>\d*\.\d*)'
-    )
+    # Either every request time of a URL is kept in a list,
+    # or it is folded into a sketch of bounded size
+    if sketch_accuracy is None:
+        new_entry, add_time = list, list.append
+    else:
+        new_entry, add_time = partial(QuantileSketch, sketch_accuracy), QuantileSketch.add
+
+    match_line, run, batch, url_fields = start_pipeline(pipeline)
+    # Keyed by the raw bytes of the URL, so every distinct URL is decoded only once
+    raw_url_times = {}
+    total_lines = 0
+    total_errors = 0
 
     for line in iterable:
+        total_lines += 1
+        if type(line) is str:
+            line = line.encode("UTF-8")
+
+        match = match_line(line)
+        if match is None:
+            total_errors += 1
+            if on_error is not None:
+                on_error(total_lines, total_errors)
+            continue
+
+        if batch is None:
+            href, request_time = match.groups()
+        else:
+            groups = match.groups()
+            href, request_time = url_fields(groups)
+            batch.append(groups)
+            if len(batch) >= aggregators.BATCH_SIZE:
+                run.feed()
+        if normalize is not None:
+            href = normalize(href)
+        times = raw_url_times.get(href)
+        if times is None:
+            times = raw_url_times[href] = new_entry()
+        add_time(times, float(request_time))
+
+    report_raw_data["total_count"] = total_lines - total_errors
+    report_raw_data["total_errors"] = total_errors
+
+    for href, times in raw_url_times.items():
+        url = decode_url(href)
+        if url in report_raw_data:
+            merge_entry(report_raw_data[url], times)
+        else:
+            report_raw_data[url] = times
+
+    report_raw_data["total_req_time"] = total_request_time(report_raw_data)
+    return report_raw_data if run is None else run.finish(report_raw_data)
 
-        try:
-            line = line.decode("UTF-8").strip()
-        except:
-            line = line.strip()
 
-        if not line_valid_pattern.match(line):
-            report_raw_data["total_errors"] += 1
+def parse_log_columnar(iterable, normalize=None, on_error=None, pipeline=None):
+    match_line, run, batch, url_fields = start_pipeline(pipeline)
+    raw_url_ids = {}
+    url_ids = array('i')
+    request_times = array('d')
+    append_url_id = url_ids.append
+    append_request_time = request_times.append
+    total_errors = 0
+
+    for line in iterable:
+        if type(line) is str:
+            line = line.encode("UTF-8")
+
+        match = match_line(line)
+        if match is None:
+            total_errors += 1
+            if on_error is not None:
+                on_error(len(request_times) + total_errors, total_errors)
             continue
 
-        entry = parse_line(line)
-        url = entry[0]
-        req_time = entry[1]
+        if batch is None:
+            href, request_time = match.groups()
+        else:
+            groups = match.groups()
+            href, request_time = url_fields(groups)
+            batch.append(groups)
+            if len(batch) >= aggregators.BATCH_SIZE:
+                run.feed()
+        if normalize is not None:
+            href = normalize(href)
+        url_id = raw_url_ids.get(href)
+        if url_id is None:
+            url_id = raw_url_ids[href] = len(raw_url_ids)
+        append_url_id(url_id)
+        append_request_time(float(request_time))
+
+    urls = []
+    url_index = {}
+    remap = []
+    for href in raw_url_ids:
+        url = decode_url(href)
+        if url not in url_index:
+            url_index[url] = len(urls)
+            urls.append(url)
+        remap.append(url_index[url])
+    if len(urls) != len(remap):
+        url_ids = array('i', (remap[url_id] for url_id in url_ids))
+
+    log_data = columnar.ColumnarLog(urls, url_ids, request_times, total_errors)
+    return log_data if run is None else run.finish(log_data)
+
+
+def parse_log_heavy(iterable, url_budget, sketch_accuracy=0.01, normalize=None, on_error=None, pipeline=None):
+    match_line, run, batch, url_fields = start_pipeline(pipeline)
+    summary = heavy.SpaceSaving(url_budget, sketch_accuracy)
+    add = summary.add
+    total_lines = 0
+    total_errors = 0
+    total_req_time = 0.0
 
-        report_raw_data["total_count"] += 1
-        report_raw_data["total_req_time"] += req_time
+    for line in iterable:
+        total_lines += 1
+        if type(line) is str:
+            line = line.encode("UTF-8")
+
+        match = match_line(line)
+        if match is None:
+            total_errors += 1
+            if on_error is not None:
+                on_error(total_lines, total_errors)
+            continue
 
-        if entry[0] in report_raw_data.keys():
-            report_raw_data[url].append(req_time)
+        if batch is None:
+            href, request_time = match.groups()
         else:
-            report_raw_data[url] = [req_time]
+            groups = match.groups()
+            href, request_time = url_fields(groups)
+            batch.append(groups)
+            if len(batch) >= aggregators.BATCH_SIZE:
+                run.feed()
+        if normalize is not None:
+            href = normalize(href)
+        request_time = float(request_time)
+        total_req_time += request_time
+        add(href, request_time)
+
+    log_data = heavy.from_summary(summary, decode_url, total_lines - total_errors, total_req_time, total_errors)
+    return log_data if run is None else run.finish(log_data)
+
+
+def start_pipeline(pipeline):
+    """The line matcher of a parse, and the run of its extra aggregators with the batch
+    the matched lines go to and the getter of the URL fields from their groups, if there are any"""
+    if pipeline is None:
+        return LINE_RE.match, None, None, None
+    run = pipeline.start()
+    return pipeline.line_re.match, run, run.batch, pipeline.url_fields
+
+
+def merge_entry(entry, other):
+    if isinstance(entry, list):
+        entry.extend(other)
+    else:
+        entry.merge(other)
+
+
+def total_request_time(log_data):
+    # fsum is exact and order-independent, so the serial and the chunked
+    # parallel paths arrive at the very same total
+    entries = [log_data[url] for url in log_data if url not in TOTALS]
+    if entries and isinstance(entries[0], QuantileSketch):
+        return math.fsum(entry.sum for entry in entries)
+    return math.fsum(chain.from_iterable(entries))
+
+
+def split_log(log_path, parts):
+    log_size = os.path.getsize(log_path)
+    bounds = [0]
+
+    with open(log_path, 'rb') as log_file:
+        for i in range(1, parts):
+            offset = log_size * i // parts
+            if offset <= bounds[-1]:
+                continue
+            # Stepping back a byte keeps a line that starts exactly at the offset in its own chunk
+            log_file.seek(offset - 1)
+            log_file.readline()
+            line_start = log_file.tell()
+            if bounds[-1] < line_start < log_size:
+                bounds.append(line_start)
+
+    bounds.append(log_size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def read_log_chunk(log_path, start, end):
+    with open(log_path, 'rb') as log_file:
+        log_file.seek(start)
+        position = start
+        while position < end:
+            line = log_file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def parse_log_chunk(parse, reader, log_path, start, end):
+    return parse(reader(log_path, start, end))
+
+
+def merge_log_data(parts):
+    sections = aggregators.merge_sections([aggregators.get_sections(part) for part in parts])
+    if parts and isinstance(parts[0], columnar.ColumnarLog):
+        return aggregators.attach(columnar.merge_columnar(parts), sections)
+    if parts and isinstance(parts[0], heavy.HeavyLog):
+        return aggregators.attach(heavy.merge_heavy(parts), sections)
+
+    merged = {"total_count": 0, "total_req_time": 0, "total_errors": 0}
+
+    # Parts have to come in file order: the per-URL lists are concatenated,
+    # so both they and the URL order end up the same as after a serial run
+    for part in parts:
+        merged["total_count"] += part["total_count"]
+        merged["total_errors"] += part["total_errors"]
+        for url in part:
+            if url in TOTALS:
+                continue
+            if url in merged:
+                merge_entry(merged[url], part[url])
+            else:
+                merged[url] = part[url]
+
+    merged["total_req_time"] = total_request_time(merged)
+    return aggregators.attach(merged, sections)
+
+
+def parse_log_parallel(log_path, workers, parse=parse_log, reader=read_log_chunk):
+    chunks = split_log(log_path, workers)
+    info("Parsing %s in %d chunks with %d workers" % (log_path, len(chunks), workers))
+
+    with multiprocessing.Pool(min(workers, len(chunks))) as pool:
+        parts = pool.starmap(parse_log_chunk, [(parse, reader, log_path, start, end) for start, end in chunks])
+
+    return merge_log_data(parts)
+
+
+def parse_log_fragment(parse, reader, log_path, start, end, first):
+    # Gzip regions don't start and end on line boundaries. Everything up to the first line break
+    # and after the last one is handed back, so the lines split between two regions can be put together
+    lines = reader(log_path, start, end)
+    head = b"" if first else next(lines, b"")
+    tail = []
+
+    def complete_lines():
+        for line in lines:
+            if line.endswith(b"\n"):
+                yield line
+            else:
+                tail.append(line)
+
+    return head, parse(complete_lines()), b"".join(tail)
+
+
+def parse_log_fragments(log_path, workers, parse, reader, chunks):
+    info("Parsing %s in %d regions with %d workers" % (log_path, len(chunks), workers))
+
+    with multiprocessing.Pool(min(workers, len(chunks))) as pool:
+        results = pool.starmap(parse_log_fragment, [(parse, reader, log_path, start, end, i == 0)
+                                                    for i, (start, end) in enumerate(chunks)])
+
+    parts = []
+    pending = b""
+    for head, part, tail in results:
+        pending += head
+        if pending.endswith(b"\n"):
+            parts.append(parse([pending]))
+            pending = b""
+        parts.append(part)
+        pending += tail
+    if pending:
+        parts.append(parse([pending]))
+
+    return merge_log_data(parts)
+
 
-    return report_raw_data
+def parse_gzip_parallel(log_path, workers, parse=parse_log):
+    reader, chunks = gzindex.plan_chunks(log_path, workers)
+    if len(chunks) < 2:
+        return None
+
+    try:
+        return parse_log_fragments(log_path, workers, parse, reader, chunks)
+    except gzindex.SplitError as e:
+        info("Falling back to a sequential read: %s" % e)
+        return None
 
 
 def set_report_name(log_date):
@@ -167,15 +605,33 @@ def set_report_name(log_date):
     return log_name
 
 
+def set_range_report_name(date_from, date_to):
+    return "report-" + date_from.strftime("%Y.%m.%d") + "-" + date_to.strftime("%Y.%m.%d") + ".html"
+
+
 def construct_report(error_threshold, log_data, report_size):
-    if Decimal(log_data["total_errors"]) / Decimal(log_data["total_count"]) > error_threshold:
+    if log_data["total_errors"] and not log_data["total_count"]:
+        error("None of the %d lines could be parsed. The log is likely in an unsupported format!"
+              % log_data["total_errors"])
+    if log_data["total_count"] and \
+            Decimal(log_data["total_errors"]) / Decimal(log_data["total_count"]) > error_threshold:
         error("Error threshold is reached. Data is likely corrupt or in an unsupported format!")
 
+    if isinstance(log_data, columnar.ColumnarLog):
+        return columnar.url_report(log_data, report_size)
+
     fin_report = []
     for entry in log_data:
-        if entry in ('total_count', 'total_req_time', 'total_errors'):
+        if entry in TOTALS:
             continue
         entry_data = log_data[entry]
+        if isinstance(entry_data, QuantileSketch):
+            url_entry = sketch_report_entry(entry, entry_data, log_data)
+            if isinstance(log_data, heavy.HeavyLog):
+                # The true time sum is somewhere up to time_sum_err above time_sum
+                url_entry["time_sum_err"] = round(log_data.errors.get(entry, 0.0), 3)
+            fin_report.append(url_entry)
+            continue
         url_entry = {"count": len(entry_data),
                      "time_avg": round(statistics.mean(entry_data), 3),
                      "time_max": round(max(entry_data), 3),
@@ -189,17 +645,302 @@ def construct_report(error_threshold, log_data, report_size):
     return fin_report_sorted
 
 
-def generate_report_html(report_template, report_output_path, report_data):
+def sample_lines(lines, rate, seed=SAMPLE_SEED):
+    # Lines are picked by a seeded generator rather than every n-th one: the same log always gives
+    # the same sample, and a periodic pattern in the log can't line up with the sampling
+    random = Random(seed).random
+    return compress(lines, (random() < rate for _ in repeat(None)))
+
+
+def extrapolate_report(report_data, sample_rate):
+    # Counts and sums are scaled up, while shares, averages and percentiles are estimated by the sample as they are
+    for url_entry in report_data:
+        url_entry["count"] = round(url_entry["count"] / sample_rate)
+        for key in ("time_sum", "time_sum_err"):
+            if key in url_entry:
+                url_entry[key] = round(url_entry[key] / sample_rate, 3)
+    return report_data
+
+
+def sketch_report_entry(url, sketch, log_data):
+    # The sketch gives the higher percentiles almost for free, so they come along with the median
+    time_med, time_p90, time_p99 = sketch.quantiles(0.5, 0.9, 0.99)
+    return {"count": sketch.count,
+            "time_avg": round(sketch.mean(), 3),
+            "time_max": round(sketch.max, 3),
+            "time_sum": round(sketch.sum, 3),
+            "url": url,
+            "time_med": round(time_med, 3),
+            "time_p90": round(time_p90, 3),
+            "time_p99": round(time_p99, 3),
+            "time_perc": round((sketch.sum / log_data["total_req_time"] * 100), 3),
+            "count_perc": round((sketch.count / log_data["total_count"] * 100), 3)}
+
+
+def summarize_log_data(log_data, accuracy):
+    """Folds any kind of log data into per-URL sketches, which merge across days in bounded memory"""
+    summary = {key: log_data[key] for key in TOTALS}
+
+    if isinstance(log_data, columnar.ColumnarLog):
+        counts, times = columnar.group_by_url(log_data)
+        start = 0
+        for url, count in zip(log_data.urls, counts):
+            url_sketch = summary[url] = QuantileSketch(accuracy)
+            url_sketch.update(times[start:start + count].tolist())
+            start += count
+        return aggregators.attach(summary, aggregators.get_sections(log_data))
+
+    for url in log_data:
+        if url in TOTALS:
+            continue
+        entry = log_data[url]
+        if isinstance(entry, QuantileSketch):
+            summary[url] = entry
+        else:
+            url_sketch = summary[url] = QuantileSketch(accuracy)
+            url_sketch.update(entry)
+    return aggregators.attach(summary, aggregators.get_sections(log_data))
+
+
+def add_daily_trends(report_data, daily_stats):
+    # Daily medians of every reported URL (None on the days it wasn't requested)
+    # and their day-over-day changes
+    for url_entry in report_data:
+        daily = [day.get(url_entry["url"]) for day in daily_stats]
+        time_med_daily = [None if day is None else round(day[1], 3) for day in daily]
+        time_sum_daily = [None if day is None else round(day[0], 3) for day in daily]
+        url_entry["days"] = sum(day is not None for day in daily)
+        url_entry["time_med_daily"] = time_med_daily
+        url_entry["time_med_dod"] = day_over_day(time_med_daily)
+        url_entry["time_sum_dod"] = day_over_day(time_sum_daily)
+    return report_data
+
+
+def day_over_day(values):
+    return [None if previous is None or current is None else round(current - previous, 3)
+            for previous, current in zip(values, values[1:])]
+
+
+def get_log_parser(config):
+    stats_mode = config.get("STATS_MODE", "exact")
+    if stats_mode not in STATS_MODES:
+        error("Unknown STATS_MODE %s. Expected one of: %s" % (stats_mode, ", ".join(STATS_MODES)))
+
+    normalize = get_url_normalizer(config)
+    pipeline = get_pipeline(config, normalize)
+
+    if stats_mode == "approx":
+        return partial(parse_log, sketch_accuracy=config.get("QUANTILE_ACCURACY", 0.01), normalize=normalize,
+                       pipeline=pipeline)
+    if stats_mode == "heavy":
+        return partial(parse_log_heavy, url_budget=config.get("URL_BUDGET", 10000),
+                       sketch_accuracy=config.get("QUANTILE_ACCURACY", 0.01), normalize=normalize,
+                       pipeline=pipeline)
+    if stats_mode == "columnar":
+        if columnar.np is None:
+            error("STATS_MODE columnar requires numpy to be installed")
+        return partial(parse_log_columnar, normalize=normalize, pipeline=pipeline)
+    return partial(parse_log, normalize=normalize, pipeline=pipeline)
+
+
+def get_pipeline(config, normalize=None):
+    names = config.get("AGGREGATORS")
+    if not names:
+        return None
+    try:
+        return aggregators.Pipeline(names, normalize)
+    except ValueError as e:
+        error(str(e))
+
+
+class ErrorGuard(object):
+    """Aborts a parse as soon as the error rate is above ERROR_THRESHOLD with high confidence.
+
+    Called by the parsers on every unparsable line with the numbers of lines and errors so far.
+    """
+
+    def __init__(self, error_threshold, min_lines=1000, z=ERROR_CONFIDENCE_Z):
+        # ERROR_THRESHOLD is a ratio of errors to parsed lines, the bound is on the ratio of errors to all lines
+        error_threshold = float(error_threshold)
+        self.threshold = error_threshold / (1 + error_threshold)
+        self.min_lines = min_lines
+        self.z = z
+
+    def __call__(self, lines, errors):
+        if lines < self.min_lines:
+            return
+        if error_rate_lower_bound(errors, lines, self.z) > self.threshold:
+            error("Error threshold is reached after %d lines with %d errors. "
+                  "Data is likely corrupt or in an unsupported format!" % (lines, errors))
+
+
+def error_rate_lower_bound(errors, lines, z):
+    # Lower end of the Wilson score interval
+    rate = errors / lines
+    z2 = z * z
+    centre = rate + z2 / (2 * lines)
+    spread = z * math.sqrt(rate * (1 - rate) / lines + z2 / (4 * lines * lines))
+    return (centre - spread) / (1 + z2 / lines)
+
+
+def get_error_guard(config):
+    if "ERROR_THRESHOLD" not in config or config.get("ERROR_MIN_LINES") is None:
+        return None
+    return ErrorGuard(config["ERROR_THRESHOLD"], config["ERROR_MIN_LINES"])
+
+
+def get_sample_rate(config):
+    rate = config.get("SAMPLE")
+    if rate is None or rate == 1:
+        return None
+    if not 0 < rate < 1:
+        error("SAMPLE has to be a rate between 0 and 1, got %s" % rate)
+    return rate
+
+
+def get_url_normalizer(config):
+    try:
+        return urlnorm.get_normalizer(config.get("URL_RULES"))
+    except (ValueError, TypeError, re.error) as e:
+        error("Invalid URL_RULES: %s" % e)
+
+
+def get_parse_settings(config):
+    # Parser settings a stored aggregate depends on. The defaults are left out,
+    # so aggregates stored before these settings existed stay usable
+    settings = {}
+    if config.get("URL_RULES"):
+        settings["url_rules"] = config["URL_RULES"]
+    if config.get("STATS_MODE") == "heavy":
+        settings["url_budget"] = config.get("URL_BUDGET", 10000)
+    if config.get("AGGREGATORS"):
+        settings["aggregators"] = list(config["AGGREGATORS"])
+    return settings
+
+
+def get_aggregate_path(history_dir, log_path):
+    return os.path.join(history_dir, os.path.basename(log_path) + ".agg")
+
+
+def load_log_aggregate(aggregate_path, log_path, config):
+    if not os.path.isfile(aggregate_path):
+        return None
+
+    stats_mode = config.get("STATS_MODE", "exact")
+    try:
+        with open(aggregate_path, 'rb') as aggregate_file:
+            header, log_data = aggstore.load(aggregate_file, stats_mode, config.get("QUANTILE_ACCURACY", 0.01),
+                                             source=aggstore.log_source(log_path),
+                                             settings=get_parse_settings(config))
+    except aggstore.AggregateError as e:
+        info("Stored aggregate %s can't be used: %s" % (aggregate_path, e))
+        return None
+
+    info("Loaded the aggregate of %s from %s" % (log_path, aggregate_path))
+    return log_data
+
+
+def store_log_aggregate(aggregate_path, log_path, log_data, settings=None):
+    try:
+        aggstore.save(log_data, aggregate_path, aggstore.log_source(log_path), settings)
+    except OSError as e:
+        info("Could not store the aggregate of %s: %s" % (log_path, e))
+
+
+def get_log_data(config, log_info, profiler=None):
+    if profiler is None:
+        profiler = profiling.StageProfiler()
+    log_path = get_log_path(log_info)
+    sample_rate = get_sample_rate(config)
+    # A sampled parse is neither stored nor taken from the stored aggregates
+    history_dir = config.get("REPORT_HISTORY") if sample_rate is None else None
+
+    if history_dir:
+        aggregate_path = get_aggregate_path(history_dir, log_path)
+        with profiler.stage("load_aggregate"):
+            log_data = load_log_aggregate(aggregate_path, log_path, config)
+        if log_data is not None:
+            return log_data
+
+    workers = config.get("WORKERS", 1)
+    use_mmap = config.get("MMAP", False)
+    plain = getattr(log_info, "ext") in [".log", ".txt", None]
+    parse = get_log_parser(config)
+    on_error = get_error_guard(config)
+    if on_error is not None:
+        parse = partial(parse, on_error=on_error)
+    log_data = None
+    with profiler.stage("parse_log", deep=True) as record:
+        if workers > 1 and sample_rate is None and plain:
+            log_data = parse_log_parallel(log_path, workers, parse, mapped.read_lines if use_mmap else read_log_chunk)
+        elif workers > 1 and sample_rate is None:
+            log_data = parse_gzip_parallel(log_path, workers, parse)
+        if log_data is None:
+            # Progress is only followed in a sequential read
+            monitor = profiler.monitor(os.path.getsize(log_path) if plain else None, on_error)
+            lines = open_log(log_info, use_mmap)
+            if monitor is not None:
+                lines = monitor.track(lines)
+            if sample_rate is not None:
+                lines = sample_lines(lines, sample_rate)
+                if monitor is not None:
+                    lines = monitor.count_parsed(lines)
+            if monitor is None:
+                log_data = parse(lines)
+            else:
+                log_data = parse(lines, on_error=monitor.error)
+                record["read_time"] = round(monitor.read_time, 3)
+
+    if history_dir:
+        with profiler.stage("store_aggregate"):
+            store_log_aggregate(aggregate_path, log_path, log_data, get_parse_settings(config))
+    return log_data
+
+
+def generate_report_html(report_template, report_output_path, report_data, profile=None, sections=None, pages=None):
     if not os.path.isfile(report_template):
         error('The report-template is not found in ' + report_template)
 
     with open(report_template, 'r') as f:
         template = string.Template(f.read())
-        report = template.safe_substitute(table_json=json.dumps(report_data))
+        report = template.safe_substitute(table_json=json.dumps(report_data), profile_json=json.dumps(profile),
+                                          sections_json=json.dumps(sections or []), pages_json=json.dumps(pages))
+
+    # Written next to the report and renamed over it: a reader never sees half a report,
+    # and unlike a hard link this works on Windows and replaces an existing report
+    with reportio.atomic_open(report_output_path) as report_file:
+        report_file.write(report)
+
+
+def get_report_format(config):
+    report_format = config.get("REPORT_FORMAT", "html")
+    if report_format not in reportio.REPORT_FORMATS:
+        error("Unknown REPORT_FORMAT %s. Expected one of: %s" % (report_format, ", ".join(reportio.REPORT_FORMATS)))
+    return report_format
+
 
-    with tempfile.NamedTemporaryFile(mode='w') as temp:
-        temp.write(report)
-        os.link(temp.name, report_output_path)
+def get_report_name(config, report_name):
+    """The name of an html report in the configured format"""
+    extension = reportio.report_extension(get_report_format(config), config.get("REPORT_GZIP", False))
+    return os.path.splitext(report_name)[0] + extension
+
+
+def write_report(config, report_output_path, report_data, profile=None, sections=None):
+    report_format = get_report_format(config)
+    if report_format in reportio.MACHINE_FORMATS:
+        reportio.write_report(report_data, sections or [], report_output_path, report_format,
+                              config.get("REPORT_GZIP", False))
+        return
+
+    pages = None
+    if report_format == "html-pages":
+        # Rows are streamed into the page files, the report itself only lists them
+        pages_dir = reportio.get_pages_dir(report_output_path)
+        page_count, rows = reportio.write_pages(report_data, pages_dir, config.get("REPORT_PAGE_SIZE", 1000))
+        pages = {"dir": os.path.basename(pages_dir), "rows": rows,
+                 "pages": [reportio.page_name(number) for number in range(1, page_count + 1)]}
+        report_data = []
+    generate_report_html(config["REPORT_TEMPLATE"], report_output_path, report_data, profile, sections, pages)
 
 
 def error(message):
@@ -211,31 +952,367 @@ def info(message):
     logging.info(message)
 
 
+def parse_into_bucket(lines, bucket, accuracy, normalize=None):
+    log_data = parse_log(lines, accuracy, normalize)
+    bucket.count += log_data["total_count"]
+    bucket.errors += log_data["total_errors"]
+    for url, url_sketch in log_data.items():
+        if url in TOTALS:
+            continue
+        if url in bucket.entries:
+            bucket.entries[url].merge(url_sketch)
+        else:
+            bucket.entries[url] = url_sketch
+
+
+def window_log_data(window):
+    log_data = {"total_count": window.count, "total_req_time": 0, "total_errors": window.errors}
+    log_data.update(window.entries)
+    log_data["total_req_time"] = total_request_time(log_data)
+    return log_data
+
+
+def set_live_report_name(minutes):
+    return "report-live-%dm.html" % minutes
+
+
+def follow(config, refreshes=None):
+    log_path = config.get("FOLLOW_LOG") or os.path.join(config["LOG_DIR"], "nginx-access-ui.log")
+    windows = sorted(config.get("FOLLOW_WINDOWS", [5, 15, 60]))
+    interval = config.get("FOLLOW_INTERVAL", 10)
+    accuracy = config.get("QUANTILE_ACCURACY", 0.01)
+    error_threshold = Decimal(config["ERROR_THRESHOLD"])
+    normalize = get_url_normalizer(config)
+
+    report_dir = config["REPORT_DIR"]
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+
+    follower = LogFollower(log_path, from_start=config.get("FOLLOW_FROM_START", False))
+    # Requests are bucketed by the time they are read, minute by minute
+    rolling_window = RollingWindow(windows[-1] * 60, bucket_seconds=60, accuracy=accuracy)
+    info("Following %s, reporting the last %s minutes every %s seconds"
+         % (log_path, "/".join(map(str, windows)), interval))
+
+    refresh = 0
+    try:
+        while refreshes is None or refresh < refreshes:
+            now = time.time()
+            parse_into_bucket(follower.read_lines(), rolling_window.current(now), accuracy, normalize)
+
+            for minutes in windows:
+                log_data = window_log_data(rolling_window.collect(minutes * 60, now))
+                if not log_data["total_count"]:
+                    continue
+                try:
+                    report_data = construct_report(error_threshold, log_data, config["REPORT_SIZE"])
+                except RuntimeError:
+                    continue
+                report_output_path = os.path.join(report_dir, get_report_name(config, set_live_report_name(minutes)))
+                write_report(config, report_output_path, report_data)
+
+            refresh += 1
+            if refreshes is None or refresh < refreshes:
+                time.sleep(max(0, interval - (time.time() - now)))
+    finally:
+        follower.close()
+
+
+def get_profiler(config):
+    try:
+        return profiling.StageProfiler(config.get("PROFILE"))
+    except ValueError as e:
+        error(str(e))
+
+
+def render_report(config, report_output_path, report_data, profiler, sections=None):
+    # The report gets the profile of everything but its own rendering, the log gets all of it
+    profile = profiler.summary() if profiler.enabled else None
+    with profiler.stage("generate_report_html"):
+        write_report(config, report_output_path, report_data, profile, sections)
+    if profiler.enabled:
+        profiler.log_summary()
+
+
+def main_range(config):
+    date_from = parse_date(config["DATE_FROM"]) if config.get("DATE_FROM") else None
+    date_to = parse_date(config["DATE_TO"]) if config.get("DATE_TO") else None
+    logs = choose_logs(config["LOG_DIR"], date_from, date_to)
+    first_date, last_date = getattr(logs[0], "date"), getattr(logs[-1], "date")
+
+    report_dir = config["REPORT_DIR"]
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+
+    report_output_path = os.path.join(report_dir, get_report_name(config, set_range_report_name(first_date, last_date)))
+    if os.path.isfile(report_output_path):
+        if not config.get("FORCE"):
+            info("Report for %s - %s already exists" % (first_date.date(), last_date.date()))
+            return
+
+    profiler = get_profiler(config)
+    accuracy = config.get("QUANTILE_ACCURACY", 0.01)
+    range_data = {"total_count": 0, "total_req_time": 0, "total_errors": 0}
+    daily_stats = []
+    # Only one day of raw data is held at a time, the range itself is accumulated in sketches
+    for log_info in logs:
+        day_data = get_log_data(config, log_info, profiler)
+        with profiler.stage("merge_day"):
+            day_data = summarize_log_data(day_data, accuracy)
+            daily_stats.append({url: (day_data[url].sum, day_data[url].quantile(0.5))
+                                for url in day_data if url not in TOTALS})
+            range_data = merge_log_data([range_data, day_data])
+        info("Added %s to the trend report" % get_log_path(log_info))
+
+    error_threshold = Decimal(config["ERROR_THRESHOLD"])
+    with profiler.stage("construct_report"):
+        report_data = construct_report(error_threshold, range_data, config["REPORT_SIZE"])
+        add_daily_trends(report_data, daily_stats)
+        sections = aggregators.report_sections(range_data, config["REPORT_SIZE"])
+
+    render_report(config, report_output_path, report_data, profiler, sections)
+
+
+def backfill_log(config, log_info):
+    """Builds the report of one log. Runs in a worker process and never raises, so one bad log can't stop the others"""
+    log_path = get_log_path(log_info)
+    started = time.time()
+    try:
+        log_data = get_log_data(config, log_info)
+        report_data = construct_report(Decimal(config["ERROR_THRESHOLD"]), log_data, config["REPORT_SIZE"])
+        sections = aggregators.report_sections(log_data, config["REPORT_SIZE"])
+        report_name = get_report_name(config, set_report_name(getattr(log_info, "date")))
+        write_report(config, os.path.join(config["REPORT_DIR"], report_name), report_data, sections=sections)
+    except Exception as e:
+        return {"log": log_path, "error": "%s: %s" % (type(e).__name__, e)}
+
+    return {"log": log_path, "error": None, "seconds": time.time() - started,
+            "lines": log_data["total_count"] + log_data["total_errors"], "bytes": os.path.getsize(log_path)}
+
+
+def backfill_executor(workers):
+    # A fresh process for every log gives the memory of a big log back right after it
+    if sys.version_info >= (3, 11):
+        return ProcessPoolExecutor(workers, max_tasks_per_child=1)
+    return ProcessPoolExecutor(workers)
+
+
+def backfill_results(build_report, logs, workers):
+    """Yields the result of build_report for every log, in the order they finish.
+
+    A worker that dies instead of raising (killed for memory, crashed) breaks the whole pool,
+    and every log not finished by then fails with BrokenProcessPool. Those logs are retried
+    one per pool, so only the log that kills its own worker is reported as failed.
+    """
+    if workers == 1:
+        yield from map(build_report, logs)
+        return
+
+    broken = []
+    with backfill_executor(workers) as pool:
+        futures = {pool.submit(build_report, log_info): log_info for log_info in logs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+
+    for log_info in broken:
+        with backfill_executor(1) as pool:
+            try:
+                yield pool.submit(build_report, log_info).result()
+            except BrokenProcessPool:
+                yield {"log": get_log_path(log_info), "error": "the worker process died"}
+
+
+def backfill(config):
+    date_from = parse_date(config["DATE_FROM"]) if config.get("DATE_FROM") else None
+    date_to = parse_date(config["DATE_TO"]) if config.get("DATE_TO") else None
+    logs = scan_logs(config["LOG_DIR"])
+
+    report_dir = config["REPORT_DIR"]
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    with os.scandir(report_dir) as entries:
+        reports = {entry.name for entry in entries}
+
+    pending = [logs[log_date] for log_date in sorted(logs)
+               if get_report_name(config, set_report_name(log_date)) not in reports
+               and (date_from is None or log_date >= date_from) and (date_to is None or log_date <= date_to)]
+    if not pending:
+        info("Every log has a report, nothing to backfill")
+        return []
+
+    workers = min(max(1, config.get("WORKERS", 1)), len(pending))
+    info("Backfilling %d logs with %d workers" % (len(pending), workers))
+    # Logs are processed one per worker, so a worker can't parse its own log in parallel
+    build_report = partial(backfill_log, {**config, "WORKERS": 1})
+    started = time.time()
+    results = []
+    for result in backfill_results(build_report, pending, workers):
+        results.append(result)
+        if result["error"] is None:
+            info("Backfilled %s in %.1f s" % (result["log"], result["seconds"]))
+        else:
+            logging.error("Failed to backfill %s: %s" % (result["log"], result["error"]))
+
+    elapsed = max(time.time() - started, 1e-9)
+    done = [result for result in results if result["error"] is None]
+    lines = sum(result["lines"] for result in done)
+    mbytes = sum(result["bytes"] for result in done) / 2 ** 20
+    info("Backfilled %d of %d logs in %.1f s: %d lines (%d lines/s), %.1f MB (%.1f MB/s)"
+         % (len(done), len(results), elapsed, lines, lines / elapsed, mbytes, mbytes / elapsed))
+    if len(done) < len(results):
+        error("%d logs could not be backfilled: %s"
+              % (len(results) - len(done), ", ".join(result["log"] for result in results if result["error"])))
+    return results
+
+
+def get_partial_name(log_date):
+    # Every frontend has a log of the same name, the host tells their partials apart
+    return "nginx-access-ui.log-%s-%s.agg.gz" % (log_date.strftime("%Y%m%d"), socket.gethostname())
+
+
+def map_log(config):
+    """Writes the partial aggregate of one log: per-URL sketches with exact counts, sums and maxima"""
+    log_info = get_log_info(config["MAP_LOG"]) if config.get("MAP_LOG") else choose_log(config["LOG_DIR"])
+    log_path = get_log_path(log_info)
+    if config.get("STATS_MODE") != "heavy":
+        # Partials keep sketches, so the log is parsed straight into them
+        config = {**config, "STATS_MODE": "approx"}
+    log_data = get_log_data(config, log_info)
+
+    partial_path = os.path.join(config.get("PARTIAL_DIR", "partials"), get_partial_name(getattr(log_info, "date")))
+    source = {**aggstore.log_source(log_path), "host": socket.gethostname()}
+    aggstore.save(log_data, partial_path, source, get_parse_settings(config), compress=True)
+    info("Mapped %s to %s (%d bytes)" % (log_path, partial_path, os.path.getsize(partial_path)))
+    return partial_path
+
+
+def load_partial(partial_path, accuracy):
+    # Partials keep sketches, stored aggregates of the exact modes are folded into sketches as they are loaded
+    header = aggstore.read_header(partial_path)
+    with aggstore.open_aggregate(partial_path) as partial_file:
+        return aggstore.load(partial_file, "heavy" if "heavy" in header else "approx",
+                             header.get("accuracy", accuracy))
+
+
+def reduce_partials(partial_paths, accuracy=0.01):
+    """Merges partial aggregates into the log data of all their logs, one partial at a time.
+
+    Returns the log data and the dates of the logs.
+    """
+    log_data = None
+    parse_settings = None
+    merged_sources = set()
+    log_dates = set()
+    for partial_path in partial_paths:
+        try:
+            header, part = load_partial(partial_path, accuracy)
+        except (OSError, EOFError, aggstore.AggregateError) as e:
+            error("Can't load the partial aggregate %s: %s" % (partial_path, e))
+
+        # Sketches of other accuracies can't be merged, and URLs normalized by other rules don't match
+        settings = (header.get("settings", {}), header.get("accuracy", accuracy), "heavy" in header)
+        if parse_settings is None:
+            parse_settings = settings
+        elif settings != parse_settings:
+            error("%s was mapped with other settings than %s: %r" % (partial_path, partial_paths[0], settings))
+
+        source = header.get("source") or {}
+        source_key = tuple(source.get(key) for key in ("host", "name", "size", "mtime_ns"))
+        if source.get("name") is not None and source_key in merged_sources:
+            info("Skipping %s, the same log of the same host is already merged" % partial_path)
+            continue
+        merged_sources.add(source_key)
+
+        log_re = LOG_NAME_RE.match(source.get("name") or "")
+        if log_re is None:
+            error("Can't tell the date of the log %s was mapped from" % partial_path)
+        log_dates.add(datetime.strptime(log_re.group('date'), '%Y%m%d'))
+
+        log_data = part if log_data is None else merge_log_data([log_data, part])
+        info("Merged %s" % partial_path)
+
+    if log_data is None:
+        error("No partial aggregates to reduce")
+    info("Merged %d partial aggregates from %d hosts" % (len(merged_sources), len({key[0] for key in merged_sources})))
+    return log_data, sorted(log_dates)
+
+
+def reduce_report(config):
+    log_data, log_dates = reduce_partials(config["REDUCE"], config.get("QUANTILE_ACCURACY", 0.01))
+    first_date, last_date = log_dates[0], log_dates[-1]
+
+    report_dir = config["REPORT_DIR"]
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    if first_date == last_date:
+        report_name = set_report_name(first_date)
+    else:
+        report_name = set_range_report_name(first_date, last_date)
+    report_output_path = os.path.join(report_dir, get_report_name(config, report_name))
+    if os.path.isfile(report_output_path) and not config.get("FORCE"):
+        info("Report %s already exists" % report_output_path)
+        return
+
+    report_data = construct_report(Decimal(config["ERROR_THRESHOLD"]), log_data, config["REPORT_SIZE"])
+    sections = aggregators.report_sections(log_data, config["REPORT_SIZE"])
+    write_report(config, report_output_path, report_data, sections=sections)
+    info("Saved the report of the partial aggregates to %s" % report_output_path)
+    return report_output_path
+
+
 def main(config):
+    if config.get("SAMPLE") and (config.get("FOLLOW") or config.get("BACKFILL") or config.get("MAP")
+                                 or config.get("REDUCE") or config.get("DATE_FROM") or config.get("DATE_TO")):
+        error("Sampling is only supported for the report of the latest log")
+    if config.get("FOLLOW"):
+        return follow(config)
+    if config.get("MAP"):
+        return map_log(config)
+    if config.get("REDUCE"):
+        return reduce_report(config)
+    if config.get("BACKFILL"):
+        return backfill(config)
+    if config.get("DATE_FROM") or config.get("DATE_TO"):
+        return main_range(config)
+
+    profiler = get_profiler(config)
     log_dir = config["LOG_DIR"]
-    log_info = choose_log(log_dir)
+    with profiler.stage("choose_log"):
+        log_info = choose_log(log_dir)
     log_date = getattr(log_info, "date")
 
-    open_log_iterable = open_log(log_info)
-
     report_dir = config["REPORT_DIR"]
     if not os.path.isdir(report_dir):
         os.makedirs(report_dir)
 
-    report_output_path = os.path.join(report_dir, set_report_name(log_date))
+    sample_rate = get_sample_rate(config)
+    report_name = set_report_name(log_date)
+    if sample_rate is not None:
+        # A sampled report doesn't take the place of the full one
+        report_name = report_name.replace(".html", "-sample.html")
+    report_output_path = os.path.join(report_dir, get_report_name(config, report_name))
     if os.path.isfile(report_output_path):
-        info("Report for the latest log already exists")
-        return
+        if not config.get("FORCE"):
+            info("Report for the latest log already exists")
+            return
+        info("Report for the latest log already exists, rebuilding it")
 
-    report_template = config["REPORT_TEMPLATE"]
     report_size = config["REPORT_SIZE"]
 
-    report_raw_data = parse_log(open_log_iterable)
+    report_raw_data = get_log_data(config, log_info, profiler)
     error_threshold = Decimal(config["ERROR_THRESHOLD"])
 
-    report_data = construct_report(error_threshold, report_raw_data, report_size)
+    with profiler.stage("construct_report"):
+        report_data = construct_report(error_threshold, report_raw_data, report_size)
+        if sample_rate is not None:
+            info("Extrapolating a sample of %s of the lines" % sample_rate)
+            report_data = extrapolate_report(report_data, sample_rate)
+        sections = aggregators.report_sections(report_raw_data, report_size)
 
-    generate_report_html(report_template, report_output_path, report_data)
+    render_report(config, report_output_path, report_data, profiler, sections)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+import os
+import mmap
+
+
+def map_region(log_path, start=0, end=None):
+    """Maps the bytes [start, end) of a log read-only.
+
+    mmap offsets have to be multiples of ALLOCATIONGRANULARITY, so the mapping starts
+    on the page boundary before start. Returns the mapping and the region's bounds in it,
+    or None for an empty region (an empty file can't be mapped at all).
+    """
+    with open(log_path, 'rb') as log_file:
+        log_size = os.fstat(log_file.fileno()).st_size
+        end = log_size if end is None else min(end, log_size)
+        if start >= end:
+            return None
+
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(log_file.fileno(), end - offset, access=mmap.ACCESS_READ, offset=offset)
+
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped, start - offset, end - offset
+
+
+def read_lines(log_path, start=0, end=None):
+    """Yields the lines of [start, end) as memoryview slices of a mapping, without copying them.
+
+    A slice is valid only until the generator is closed or exhausted.
+    """
+    region = map_region(log_path, start, end)
+    if region is None:
+        return
+
+    mapped, position, stop = region
+    view = memoryview(mapped)
+    find = mapped.find
+    try:
+        while position < stop:
+            line_end = find(b"\n", position, stop)
+            line_end = stop if line_end == -1 else line_end + 1
+            yield view[position:line_end]
+            position = line_end
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:  # A consumer still holds a line, the mapping goes away with it
+            pass
@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import tracemalloc
+from itertools import islice
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS isn't reported there
+    resource = None
+
+PROFILE_MODES = ("stages", "cprofile", "tracemalloc")
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 5
+# Lines are pulled from the reader in batches, so timing the reads costs next to nothing per line
+READ_BATCH = 4096
+TOP_ENTRIES = 15
+
+
+def peak_rss_kb(who=None):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def workers_peak_rss_kb():
+    return None if resource is None else peak_rss_kb(resource.RUSAGE_CHILDREN)
+
+
+def cpu_time():
+    # Includes the finished worker processes of the parallel parsers
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageProfiler(object):
+    """Wall time, CPU time and peak memory of the pipeline stages.
+
+    A profiler made with mode None records nothing, so the pipeline can always go through it.
+    With the cprofile and tracemalloc modes, the stages marked as deep are also profiled
+    function by function or allocation by allocation.
+    """
+
+    def __init__(self, mode=None):
+        if mode not in PROFILE_MODES and mode is not None:
+            raise ValueError("Unknown profile mode %r. Expected one of: %s" % (mode, ", ".join(PROFILE_MODES)))
+        self.mode = mode
+        self.stages = []
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    @contextmanager
+    def stage(self, name, deep=False):
+        if not self.enabled:
+            yield {}
+            return
+
+        record = {"stage": name}
+        deep_profile = self._start_deep() if deep else None
+        peak, workers_peak = peak_rss_kb(), workers_peak_rss_kb()
+        wall_started, cpu_started = time.perf_counter(), cpu_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = round(time.perf_counter() - wall_started, 3)
+            record["cpu_time"] = round(cpu_time() - cpu_started, 3)
+            # ru_maxrss is the high-water mark of the whole process, so a stage's own memory shows
+            # only as the growth of that mark while it ran
+            record["peak_rss_kb"] = peak_rss_kb()
+            if record["peak_rss_kb"] is not None:
+                record["peak_rss_growth_kb"] = record["peak_rss_kb"] - peak
+            # Only a stage that ran worker processes can raise their peak
+            if workers_peak_rss_kb() != workers_peak:
+                record["workers_peak_rss_kb"] = workers_peak_rss_kb()
+            if deep_profile is not None:
+                self._stop_deep(name, deep_profile, record)
+            self.stages.append(record)
+
+    def monitor(self, total_bytes=None, on_error=None):
+        return ProgressMonitor(total_bytes, on_error=on_error) if self.enabled else None
+
+    def summary(self):
+        lines = []
+        for record in self.stages:
+            line = "%-22s wall %8.3f s  cpu %8.3f s" % (record["stage"], record["wall_time"], record["cpu_time"])
+            if "read_time" in record:
+                line += "  reading %.3f s" % record["read_time"]
+            if record.get("peak_rss_kb"):
+                line += "  rss high-water %d KB (+%d KB)" % (record["peak_rss_kb"], record["peak_rss_growth_kb"])
+            if record.get("workers_peak_rss_kb"):
+                line += "  workers rss high-water %d KB" % record["workers_peak_rss_kb"]
+            if "traced_peak_kb" in record:
+                line += "  traced peak %d KB" % record["traced_peak_kb"]
+            lines.append(line)
+        return lines
+
+    def log_summary(self):
+        for line in self.summary():
+            logging.info("Profile: " + line)
+
+    def _start_deep(self):
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            return profile
+        if self.mode == "tracemalloc":
+            tracemalloc.start()
+            return True
+        return None
+
+    def _stop_deep(self, name, deep_profile, record):
+        if self.mode == "cprofile":
+            deep_profile.disable()
+            stats_output = io.StringIO()
+            pstats.Stats(deep_profile, stream=stats_output).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+            logging.info("Profile of %s:\n%s" % (name, stats_output.getvalue()))
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            record["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:TOP_ENTRIES]
+            logging.info("Allocations of %s:\n%s" % (name, "\n".join(map(str, top))))
+
+
+class ProgressMonitor(object):
+    """Counts the lines and bytes a parser reads, times the reads and logs the progress every few seconds.
+
+    Parsers report unparsable lines with error(), which passes them on to `on_error` if there is one.
+    When only a sample of the lines is parsed, count_parsed() counts the sample, and the error rate is taken over it.
+    """
+
+    def __init__(self, total_bytes=None, interval=PROGRESS_INTERVAL, on_error=None):
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.on_error = on_error
+        self.lines = 0
+        self.bytes = 0
+        self.errors = 0
+        self.parsed_lines = None
+        self.read_time = 0.0
+
+    def error(self, lines, errors):
+        self.errors = errors
+        if self.on_error is not None:
+            self.on_error(lines, errors)
+
+    def count_parsed(self, lines):
+        self.parsed_lines = 0
+        for line in lines:
+            self.parsed_lines += 1
+            yield line
+
+    def track(self, lines):
+        lines = iter(lines)
+        started = reported = time.perf_counter()
+        while True:
+            read_started = time.perf_counter()
+            batch = list(islice(lines, READ_BATCH))
+            now = time.perf_counter()
+            self.read_time += now - read_started
+            if not batch:
+                return
+            self.lines += len(batch)
+            self.bytes += sum(map(len, batch))
+            if now - reported >= self.interval:
+                reported = now
+                self.report(now - started)
+            yield from batch
+
+    def report(self, elapsed):
+        parsed_lines = self.lines if self.parsed_lines is None else self.parsed_lines
+        message = "Read %.1f MB, %d lines, %d lines/s, %.2f%% errors" % (
+            self.bytes / 2 ** 20, self.lines, self.lines / elapsed, self.errors / max(parsed_lines, 1) * 100)
+        if self.total_bytes:
+            remaining = max(0, self.total_bytes - self.bytes)
+            message += ", ETA %d s" % (elapsed / self.bytes * remaining)
+        logging.info(message)
@@ -0,0 +1,137 @@
+import io
+import os
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# "html" embeds the rows into the report page, "html-pages" writes them into page files next to it
+# that the page loads as it is scrolled, "ndjson" and "csv" are for other tools
+REPORT_FORMATS = ("html", "html-pages", "ndjson", "csv")
+MACHINE_FORMATS = ("ndjson", "csv")
+PAGE_SIZE = 1000
+# A page is a script rather than plain JSON, so a report opened from disk can load it too
+PAGE_TEMPLATE = "loadReportPage(%d, %s);\n"
+
+
+def report_extension(report_format, compress=False):
+    if report_format in MACHINE_FORMATS:
+        return "." + report_format + (".gz" if compress else "")
+    return ".html"
+
+
+def get_pages_dir(report_path):
+    return os.path.splitext(report_path)[0] + ".pages"
+
+
+@contextmanager
+def atomic_open(path, compress=False, newline=None, binary=False):
+    """File written next to `path` and renamed over it once complete, so a reader never sees half a file.
+
+    Text unless `binary` is set. Reports and stored aggregates are all written through it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        # mkstemp creates the file readable by the owner only, reports and aggregates get the usual permissions
+        os.chmod(temp_path, 0o666 & ~_umask())
+        with os.fdopen(fd, 'wb') as raw_file:
+            # mtime=0 keeps the same output byte-for-byte the same
+            binary_file = gzip.GzipFile(fileobj=raw_file, mode='wb', mtime=0) if compress else raw_file
+            if binary:
+                with binary_file:
+                    yield binary_file
+            else:
+                with io.TextIOWrapper(binary_file, encoding="UTF-8", newline=newline) as text_file:
+                    yield text_file
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_ndjson(rows, path, compress=False):
+    with atomic_open(path, compress) as report_file:
+        for row in rows:
+            report_file.write(json.dumps(row))
+            report_file.write("\n")
+
+
+def write_csv(rows, path, compress=False):
+    rows = iter(rows)
+    first_row = next(rows, None)
+    with atomic_open(path, compress, newline="") as report_file:
+        if first_row is None:
+            return
+        writer = csv.DictWriter(report_file, fieldnames=list(first_row), extrasaction="ignore")
+        writer.writeheader()
+        writer.writerow(csv_row(first_row))
+        for row in rows:
+            writer.writerow(csv_row(row))
+
+
+def csv_row(row):
+    # Daily trends are lists, kept as JSON in their cell
+    return {key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in row.items()}
+
+
+def write_rows(rows, path, report_format, compress=False):
+    if report_format == "ndjson":
+        write_ndjson(rows, path, compress)
+    elif report_format == "csv":
+        write_csv(rows, path, compress)
+    else:
+        raise ValueError("Unknown machine-readable format %r" % report_format)
+
+
+def write_report(rows, sections, path, report_format, compress=False):
+    """Writes the report rows, and the rows of every section into a file of its own next to them"""
+    write_rows(rows, path, report_format, compress)
+    extension = report_extension(report_format, compress)
+    for section in sections:
+        write_rows(section["rows"], path[:-len(extension)] + "." + section["name"] + extension, report_format, compress)
+
+
+def write_pages(rows, pages_dir, page_size=PAGE_SIZE):
+    """Writes the rows, in their order, into numbered page files. Returns the page count and the row count"""
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(pages_dir)), suffix=".tmp")
+    try:
+        pages = total_rows = 0
+        page = []
+        for row in rows:
+            page.append(row)
+            if len(page) == page_size:
+                pages += 1
+                _write_page(temp_dir, pages, page)
+                total_rows += len(page)
+                page = []
+        if page or not pages:
+            pages += 1
+            _write_page(temp_dir, pages, page)
+            total_rows += len(page)
+        os.chmod(temp_dir, 0o777 & ~_umask())
+        # A directory can't be renamed over a full one
+        if os.path.isdir(pages_dir):
+            shutil.rmtree(pages_dir)
+        os.rename(temp_dir, pages_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return pages, total_rows
+
+
+def _write_page(pages_dir, number, rows):
+    with open(os.path.join(pages_dir, page_name(number)), 'w', encoding="UTF-8") as page_file:
+        page_file.write(PAGE_TEMPLATE % (number, json.dumps(rows)))
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def page_name(number):
+    return "page-%05d.js" % number
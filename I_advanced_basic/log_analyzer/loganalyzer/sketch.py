@@ -0,0 +1,162 @@
+import math
+from collections import Counter
+
+# Values at or below this are counted as zeros: nginx logs request_time with millisecond precision
+MIN_VALUE = 1e-9
+DEFAULT_MAX_BINS = 2048
+# Bucket keys are computed once per distinct value. request_time is rounded to milliseconds,
+# so there are few distinct values; the cap keeps the cache bounded on arbitrary input.
+KEY_CACHE_SIZE = 1 << 16
+
+_key_caches = {}
+
+
+class QuantileSketch(object):
+    """Mergeable per-URL timing accumulator.
+
+    count, sum, min and max are exact. Quantiles come from logarithmic buckets
+    (as in DDSketch), so every quantile estimate is within `accuracy` relative error
+    and the memory depends on the spread of the values, not on their number.
+    """
+
+    __slots__ = ('accuracy', 'max_bins', 'count', 'sum', 'min', 'max', 'zero_count', 'bins',
+                 '_log_gamma', '_keys')
+
+    def __init__(self, accuracy=0.01, max_bins=DEFAULT_MAX_BINS):
+        if not 0 < accuracy < 1:
+            raise ValueError("Sketch accuracy must be between 0 and 1, got %r" % accuracy)
+        self.accuracy = accuracy
+        self.max_bins = max_bins
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero_count = 0
+        self.bins = {}
+        self._log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self._keys = _key_caches.setdefault(accuracy, {})
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+        if value <= MIN_VALUE:
+            self.zero_count += 1
+            return
+
+        key = self._keys.get(value)
+        if key is None:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            if len(self._keys) < KEY_CACHE_SIZE:
+                self._keys[value] = key
+
+        bins = self.bins
+        if key in bins:
+            bins[key] += 1
+        else:
+            bins[key] = 1
+            if len(bins) > self.max_bins:
+                self._collapse()
+
+    def update(self, values):
+        """Adds a whole list of values; equal values are bucketed once"""
+        if not values:
+            return
+        self.count += len(values)
+        self.sum += sum(values)
+        self.max = max(self.max, max(values))
+        self.min = min(self.min, min(values))
+
+        keys = self._keys
+        bins = self.bins
+        for value, count in Counter(values).items():
+            if value <= MIN_VALUE:
+                self.zero_count += count
+                continue
+            key = keys.get(value)
+            if key is None:
+                key = math.ceil(math.log(value) / self._log_gamma)
+                if len(keys) < KEY_CACHE_SIZE:
+                    keys[value] = key
+            bins[key] = bins.get(key, 0) + count
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("Can't merge sketches with different accuracy: %r and %r"
+                             % (self.accuracy, other.accuracy))
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zero_count += other.zero_count
+
+        bins = self.bins
+        for key, count in other.bins.items():
+            bins[key] = bins.get(key, 0) + count
+        if len(bins) > self.max_bins:
+            self._collapse()
+        return self
+
+    def mean(self):
+        return self.sum / self.count
+
+    def quantile(self, q):
+        return self.quantiles(q)[0]
+
+    def quantiles(self, *qs):
+        """Returns estimates for several quantiles with a single walk over the buckets.
+
+        A quantile between two ranks is interpolated between their values, as statistics.median does
+        for an even count, so it stays within `accuracy` of the exact one.
+        """
+        if not self.count:
+            raise ValueError("Quantiles of an empty sketch are undefined")
+
+        positions = [q * (self.count - 1) for q in qs]
+        ranks = set()
+        for position in positions:
+            ranks.add(math.floor(position))
+            ranks.add(min(math.ceil(position), self.count - 1))
+        values = self._rank_values(sorted(ranks))
+
+        estimates = []
+        for position in positions:
+            low = math.floor(position)
+            high = min(math.ceil(position), self.count - 1)
+            estimates.append(values[low] + (position - low) * (values[high] - values[low]))
+        return estimates
+
+    def _rank_values(self, ranks):
+        """Estimated values of the given ranks (0-based, sorted) in the ordered values"""
+        gamma = math.exp(self._log_gamma)
+        values = dict.fromkeys(ranks, self.max)
+        position = 0
+
+        cumulative = self.zero_count
+        while position < len(ranks) and ranks[position] < cumulative:
+            values[ranks[position]] = max(self.min, 0.0)
+            position += 1
+
+        for key, count in sorted(self.bins.items()):
+            if position == len(ranks):
+                break
+            cumulative += count
+            value = min(max(2 * gamma ** key / (gamma + 1), self.min), self.max)
+            while position < len(ranks) and ranks[position] < cumulative:
+                values[ranks[position]] = value
+                position += 1
+
+        return values
+
+    def _collapse(self):
+        # Folds the lowest buckets together: only the accuracy of the smallest values suffers
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        folded = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += folded
@@ -0,0 +1,69 @@
+import re
+from functools import lru_cache
+
+# A path segment ends at the next slash, at the query string or at the end of the URL
+SEGMENT_END = rb"(?=[/?;#]|$)"
+
+# Built-in rules. In URL_RULES they can be mixed with custom [pattern, replacement] pairs
+# and are applied in the order they are listed there.
+BUILTIN_RULES = {
+    "query": (rb"[?#].*", b""),
+    "uuid": (rb"(?<=/)[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}" + SEGMENT_END,
+             b"{uuid}"),
+    "numeric": (rb"(?<=/)\d+" + SEGMENT_END, b"{id}"),
+    "hex": (rb"(?<=/)[0-9a-fA-F]{16,}" + SEGMENT_END, b"{hex}"),
+}
+# Results are cached per distinct raw URL; the cap keeps the cache bounded
+# when most URLs are unique, e.g. every one of them carries a session id
+CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=None)
+def compile_rule(rule):
+    if isinstance(rule, str):
+        if rule not in BUILTIN_RULES:
+            raise ValueError("Unknown URL rule %r. Expected one of: %s, or a [pattern, replacement] pair"
+                             % (rule, ", ".join(BUILTIN_RULES)))
+        pattern, replacement = BUILTIN_RULES[rule]
+    else:
+        pattern, replacement = (part.encode("UTF-8") for part in rule)
+    return re.compile(pattern), replacement
+
+
+def freeze_rules(rules):
+    # Rules come from JSON, where a custom rule is a list
+    return tuple(rule if isinstance(rule, str) else tuple(rule) for rule in rules)
+
+
+class UrlNormalizer(object):
+    """Maps the raw bytes of a URL to its template, e.g. /api/v2/banner/25019354?a=1 to /api/v2/banner/{id}"""
+
+    def __init__(self, rules):
+        self.rules = freeze_rules(rules)
+        self._compiled = [compile_rule(rule) for rule in self.rules]
+        self._cache = {}
+
+    def __call__(self, href):
+        url = self._cache.get(href)
+        if url is not None:
+            return url
+
+        url = href
+        for pattern, replacement in self._compiled:
+            url = pattern.sub(replacement, url)
+        if len(self._cache) < CACHE_SIZE:
+            self._cache[href] = url
+        return url
+
+    def __getstate__(self):
+        # Compiled patterns are shared through compile_rule in the worker processes as well
+        return {"rules": self.rules}
+
+    def __setstate__(self, state):
+        self.__init__(state["rules"])
+
+
+def get_normalizer(rules):
+    if not rules:
+        return None
+    return UrlNormalizer(rules)
@@ -2,12 +2,37 @@ import unittest
 from unittest.mock import patch, mock_open
 from unittest import mock
 import loganalyzer
+import sketch
+import columnar
+import aggregators
+import aggstore
+import follow
+import gzindex
+import mapped
+import urlnorm
+import profiling
+import csv
+import gzip
+import json
+import io
 import os
+import sys
 import hashlib
 import random
+import statistics
 import tempfile
+import shutil
+from datetime import datetime
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_DIR = os.path.join(THIS_DIR, "..", "benchmarks")
+
+
+def crash_on_log(log_info):
+    # A worker killed outright, as by the OOM killer, rather than an exception
+    if log_info.date == datetime(2017, 6, 29):
+        os._exit(1)
+    return {"log": loganalyzer.get_log_path(log_info), "error": None}
 
 
 class Test_functionality(unittest.TestCase):
@@ -157,6 +182,621 @@ class Test_functionality(unittest.TestCase):
             log_data_correct = self.log_data_correct
             self.assertEqual(log_data, log_data_correct)
 
+    def test_parse_line(self):
+        line = self.log_file.splitlines()[0]
+        self.assertEqual(loganalyzer.parse_line(line), ('/link1/', 2.0))
+        self.assertEqual(loganalyzer.parse_line(line.encode('utf-8') + b'\n'), ('/link1/', 2.0))
+        self.assertIsNone(loganalyzer.parse_line(line.replace('"GET', '"PUT')))
+        self.assertIsNone(loganalyzer.parse_line(line[:-4]))
+
+    def test_parse_log_parallel(self):
+        log_file = self.log_file + "\n/broken line/\n"
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp:
+            temp.write(log_file)
+        try:
+            chunks = loganalyzer.split_log(temp.name, 7)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], len(log_file))
+            # Every chunk should start right after a line break
+            for start, end in chunks[1:]:
+                self.assertEqual(log_file[start - 1], "\n")
+
+            log_data_serial = loganalyzer.parse_log(log_file.splitlines())
+            log_data_parallel = loganalyzer.parse_log_parallel(temp.name, 4)
+        finally:
+            os.remove(temp.name)
+
+        self.assertEqual(log_data_parallel, log_data_serial)
+        self.assertEqual(list(log_data_parallel), list(log_data_serial))
+        self.assertEqual(log_data_parallel["total_errors"], 1)
+
+    def test_mapped_read_lines(self):
+        # No line break at the end, and a chunk boundary past the first mapping page
+        log_file = (self.log_file + "\n/broken line/\n" * 300 + "/last line/").encode('utf-8')
+        with tempfile.NamedTemporaryFile(mode='wb', delete=False) as temp:
+            temp.write(log_file)
+        with tempfile.NamedTemporaryFile(mode='wb', delete=False) as empty:
+            pass
+        try:
+            self.assertEqual([bytes(line) for line in mapped.read_lines(temp.name)],
+                             log_file.splitlines(keepends=True))
+            self.assertEqual(list(mapped.read_lines(empty.name)), [])
+
+            chunks = loganalyzer.split_log(temp.name, 5)
+            self.assertGreater(chunks[1][0], 4096)
+            chunk_lines = [bytes(line) for start, end in chunks for line in mapped.read_lines(temp.name, start, end)]
+            self.assertEqual(chunk_lines, log_file.splitlines(keepends=True))
+
+            log_data_serial = loganalyzer.parse_log(log_file.splitlines())
+            self.assertEqual(loganalyzer.parse_log(mapped.read_lines(temp.name)), log_data_serial)
+            self.assertEqual(loganalyzer.parse_log_parallel(temp.name, 4, reader=mapped.read_lines), log_data_serial)
+        finally:
+            os.remove(temp.name)
+            os.remove(empty.name)
+
+    def test_parse_log_approx(self):
+        lines = self.log_file.splitlines()
+        log_data_exact = loganalyzer.parse_log(lines)
+        log_data_approx = loganalyzer.parse_log(lines, sketch_accuracy=0.01)
+
+        self.assertEqual(list(log_data_approx), list(log_data_exact))
+        for key in loganalyzer.TOTALS:
+            self.assertEqual(log_data_approx[key], log_data_exact[key])
+
+        report_exact = loganalyzer.construct_report(0.01, log_data_exact, 10)
+        report_approx = loganalyzer.construct_report(0.01, log_data_approx, 10)
+        for row_exact, row_approx in zip(report_exact, report_approx):
+            for key in ("url", "count", "count_perc", "time_sum", "time_perc", "time_avg", "time_max"):
+                self.assertEqual(row_approx[key], row_exact[key])
+            self.assertAlmostEqual(row_approx["time_med"], row_exact["time_med"], delta=row_exact["time_med"] * 0.01)
+            self.assertIn("time_p99", row_approx)
+
+    @unittest.skipIf(columnar.np is None, "numpy is not installed")
+    def test_parse_log_columnar(self):
+        lines = self.log_file.splitlines() + ["/broken line/"]
+        log_data = loganalyzer.parse_log(lines)
+        log_data_columnar = loganalyzer.parse_log_columnar(lines)
+
+        for key in loganalyzer.TOTALS:
+            self.assertEqual(log_data_columnar[key], log_data[key])
+        for report_size in (0, 3, 10, 20):
+            self.assertEqual(loganalyzer.construct_report(0.01, log_data_columnar, report_size),
+                             loganalyzer.construct_report(0.01, log_data, report_size))
+
+        merged = loganalyzer.merge_log_data([loganalyzer.parse_log_columnar(lines[:333]),
+                                             loganalyzer.parse_log_columnar(lines[333:])])
+        self.assertEqual(merged.urls, log_data_columnar.urls)
+        self.assertEqual(merged.url_ids, log_data_columnar.url_ids)
+        self.assertEqual(merged["total_errors"], 1)
+
+    def test_url_normalizer(self):
+        normalize = urlnorm.UrlNormalizer(["query", "uuid", "numeric", ["^/export/[^/]+\\.csv$", "/export/{file}"]])
+        self.assertEqual(normalize(b"/api/v2/banner/25019354?campaign=7"), b"/api/v2/banner/{id}")
+        self.assertEqual(normalize(b"/api/v2/slot/4705/groups/"), b"/api/v2/slot/{id}/groups/")
+        self.assertEqual(normalize(b"/agency/outlays/123e4567-e89b-12d3-a456-426614174000/"),
+                         b"/agency/outlays/{uuid}/")
+        self.assertEqual(normalize(b"/export/2017-06-30.csv"), b"/export/{file}")
+        self.assertEqual(normalize(b"/api/1v/banner"), b"/api/1v/banner")
+        with self.assertRaises(ValueError):
+            urlnorm.UrlNormalizer(["numbers"])
+
+        lines = [line.replace('/ HTTP', '/?page=' + str(i) + ' HTTP') for i, line in
+                 enumerate(self.log_file.splitlines())]
+        config = {"URL_RULES": ["query"], "QUANTILE_ACCURACY": 0.01}
+        for stats_mode in ("exact", "approx", "columnar", "heavy"):
+            if stats_mode == "columnar" and columnar.np is None:
+                continue
+            parse = loganalyzer.get_log_parser({**config, "STATS_MODE": stats_mode})
+            report = loganalyzer.construct_report(0.01, parse(lines), 10)
+            self.assertEqual([row["url"] for row in report], ["/link%d/" % i for i in range(10, 0, -1)])
+
+    def test_parse_log_heavy(self):
+        rnd = random.Random(3)
+        # A few heavy URLs over a long tail of URLs requested once or twice
+        requests = [("/heavy/%d/" % (i % 5), 1.0 + i % 5) for i in range(2000)]
+        requests += [("/tail/%d/" % rnd.randrange(3000), 0.1) for _ in range(3000)]
+        rnd.shuffle(requests)
+        template = self.log_file.splitlines()[0]
+        lines = [template.replace("/link1/", url).replace(" 2.0", " %.3f" % request_time)
+                 for url, request_time in requests]
+
+        log_data_exact = loganalyzer.parse_log(lines)
+        log_data = loganalyzer.parse_log_heavy(lines, 50)
+        self.assertEqual(len(log_data) - len(loganalyzer.TOTALS), 50)
+        self.assertEqual(log_data["total_count"], log_data_exact["total_count"])
+        self.assertAlmostEqual(log_data["total_req_time"], log_data_exact["total_req_time"])
+
+        report = loganalyzer.construct_report(0.01, log_data, 5)
+        self.assertEqual([row["url"] for row in report],
+                         [row["url"] for row in loganalyzer.construct_report(0.01, log_data_exact, 5)])
+        for url in log_data:
+            if url in loganalyzer.TOTALS:
+                continue
+            time_sum = sum(log_data_exact[url])
+            self.assertLessEqual(log_data[url].sum, time_sum + 1e-9)
+            self.assertLessEqual(time_sum, log_data[url].sum + log_data.errors.get(url, 0.0) + 1e-9)
+        self.assertIn("time_sum_err", report[0])
+
+        merged = loganalyzer.merge_log_data([loganalyzer.parse_log_heavy(lines[:2500], 50),
+                                             loganalyzer.parse_log_heavy(lines[2500:], 50)])
+        self.assertEqual(len(merged) - len(loganalyzer.TOTALS), 50)
+        self.assertEqual([row["url"] for row in loganalyzer.construct_report(0.01, merged, 5)],
+                         [row["url"] for row in report])
+        for url in merged:
+            if url not in loganalyzer.TOTALS:
+                self.assertLessEqual(sum(log_data_exact[url]), merged[url].sum + merged.errors.get(url, 0.0) + 1e-9)
+
+        aggregate = io.BytesIO()
+        aggstore.dump(log_data, aggregate)
+        aggregate.seek(0)
+        header, stored = aggstore.load(aggregate, "heavy", 0.01)
+        self.assertEqual(stored.errors, log_data.errors)
+        self.assertEqual(loganalyzer.construct_report(0.01, stored, 10), loganalyzer.construct_report(0.01, log_data, 10))
+
+    def test_aggregators(self):
+        self.assertEqual(aggregators.build_line_re(aggregators.URL_FIELDS).pattern, loganalyzer.LINE_RE.pattern)
+        lines = self.log_file.splitlines()
+        # Every third line comes from another client at another hour, with a 404
+        for i in range(0, len(lines), 3):
+            lines[i] = lines[i].replace("1.169.137.128", "10.0.0.1").replace(":03:50:23", ":04:10:00") \
+                .replace(" 200 100 ", " 404 10 ")
+        lines.append("/broken line/")
+        pipeline = aggregators.Pipeline(["status", "hourly", "clients", "bytes"])
+
+        log_data = loganalyzer.parse_log(lines, pipeline=pipeline)
+        self.assertEqual(log_data, loganalyzer.parse_log(lines))
+        sections = aggregators.get_sections(log_data)
+        self.assertEqual(sections["status"].counts, {"200": 666, "404": 334})
+        self.assertEqual([(row["hour"], row["count"]) for row in sections["hourly"].rows(10)],
+                         [("2017-06-29 03:00", 666), ("2017-06-29 04:00", 334)])
+        self.assertEqual([(row["ip"], row["count"]) for row in sections["clients"].rows(10)],
+                         [("1.169.137.128", 666), ("10.0.0.1", 334)])
+        self.assertEqual(sum(row["bytes_sum"] for row in sections["bytes"].rows(10)), 666 * 100 + 334 * 10)
+
+        # Every stats mode feeds the same aggregators, and split parses merge into the same sections
+        columnar_data = loganalyzer.parse_log_columnar(lines, pipeline=pipeline)
+        merged = loganalyzer.merge_log_data([loganalyzer.parse_log(lines[:500], pipeline=pipeline),
+                                             loganalyzer.parse_log(lines[500:], pipeline=pipeline)])
+        report_sections = aggregators.report_sections(log_data, 10)
+        self.assertEqual(aggregators.report_sections(columnar_data, 10), report_sections)
+        self.assertEqual(aggregators.report_sections(merged, 10), report_sections)
+
+        aggregate = io.BytesIO()
+        aggstore.dump(log_data, aggregate)
+        aggregate.seek(0)
+        header, stored = aggstore.load(aggregate)
+        self.assertEqual(aggregators.report_sections(stored, 10), report_sections)
+
+        with self.assertRaises(ValueError):
+            aggregators.Pipeline(["no_such_aggregator"])
+
+    def test_profile(self):
+        lines = (self.log_file + "\n/broken line/").encode('utf-8').splitlines(keepends=True)
+        monitor = profiling.ProgressMonitor(interval=0)
+        with patch("profiling.logging.info") as mock_logger:
+            log_data = loganalyzer.parse_log(monitor.track(lines), on_error=monitor.error)
+            self.assertIn("lines/s", mock_logger.call_args[0][0])
+        self.assertEqual(log_data, loganalyzer.parse_log(lines))
+        self.assertEqual((monitor.lines, monitor.errors, monitor.bytes), (1001, 1, sum(map(len, lines))))
+
+        # Under sampling the error rate is taken over the sampled lines, not over all the lines read
+        monitor = profiling.ProgressMonitor(interval=3600)
+        sampled = (line for i, line in enumerate(monitor.track(lines)) if i % 10 == 0)
+        loganalyzer.parse_log(monitor.count_parsed(sampled), on_error=monitor.error)
+        self.assertEqual((monitor.lines, monitor.parsed_lines, monitor.errors), (1001, 101, 1))
+        with patch("profiling.logging.info") as mock_logger:
+            monitor.report(1.0)
+            self.assertIn("0.99% errors", mock_logger.call_args[0][0])
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(temp_dir, "nginx-access-ui.log-20170630"), 'wb') as log:
+                log.writelines(lines)
+            log_info = loganalyzer.choose_log(temp_dir)
+            profiler = profiling.StageProfiler("stages")
+            self.assertEqual(loganalyzer.get_log_data({}, log_info, profiler), log_data)
+            self.assertEqual([record["stage"] for record in profiler.stages], ["parse_log"])
+            self.assertIn("read_time", profiler.stages[0])
+            self.assertGreaterEqual(profiler.stages[0]["peak_rss_growth_kb"], 0)
+            self.assertTrue(profiler.summary()[0].startswith("parse_log"))
+
+            disabled = profiling.StageProfiler()
+            self.assertEqual(loganalyzer.get_log_data({}, log_info, disabled), log_data)
+            self.assertEqual(disabled.stages, [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_error_guard(self):
+        lines = self.log_file.splitlines()
+        guard = loganalyzer.ErrorGuard(0.01, min_lines=100)
+        # 1% of errors is within the threshold, 20% is over it long before the end of the log
+        self.assertEqual(loganalyzer.parse_log(lines[:990] + ["/broken line/"] * 10, on_error=guard)["total_errors"], 10)
+        broken = [line if i % 5 else "/broken line/" for i, line in enumerate(lines * 10)]
+        with patch("loganalyzer.error", side_effect=RuntimeError) as mock_error:
+            with self.assertRaises(RuntimeError):
+                loganalyzer.parse_log(broken, on_error=guard)
+            self.assertIn("after 101 lines", mock_error.call_args[0][0])
+        with self.assertRaises(RuntimeError):
+            loganalyzer.parse_log_columnar(broken, on_error=guard)
+
+        with patch("loganalyzer.error", side_effect=RuntimeError) as mock_error:
+            with self.assertRaises(RuntimeError):
+                loganalyzer.construct_report(0.01, loganalyzer.parse_log(["/broken line/"]), 10)
+            self.assertIn("None of the 1 lines", mock_error.call_args[0][0])
+        self.assertEqual(loganalyzer.construct_report(0.01, loganalyzer.parse_log([]), 10), [])
+
+    def test_sample(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(temp_dir, "nginx-access-ui.log-20170630"), 'w') as log:
+                log.write(self.log_file)
+            log_info = loganalyzer.choose_log(temp_dir)
+            config = {"SAMPLE": 0.2, "ERROR_THRESHOLD": 0.01, "ERROR_MIN_LINES": 1000,
+                      "REPORT_HISTORY": os.path.join(temp_dir, "history")}
+            log_data = loganalyzer.get_log_data(config, log_info)
+            self.assertEqual(loganalyzer.get_log_data(config, log_info), log_data)
+            self.assertAlmostEqual(log_data["total_count"], 200, delta=40)
+            self.assertFalse(os.path.exists(config["REPORT_HISTORY"]))
+
+            # The log repeats every 10 lines, which a sample of every 5th line would have gotten badly wrong
+            report = loganalyzer.extrapolate_report(loganalyzer.construct_report(0.01, log_data, 10), 0.2)
+            self.assertEqual(len(report), 10)
+            self.assertAlmostEqual(sum(row["count"] for row in report), 1000, delta=200)
+            self.assertAlmostEqual(sum(row["time_sum"] for row in report), 11000, delta=11000 * 0.2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_quantile_sketch(self):
+        rnd = random.Random(1)
+        values = [round(rnd.expovariate(3), 3) for _ in range(10001)]
+        whole = sketch.QuantileSketch(0.02)
+        left, right = sketch.QuantileSketch(0.02), sketch.QuantileSketch(0.02)
+        for i, value in enumerate(values):
+            whole.add(value)
+            (left if i % 2 else right).add(value)
+        left.merge(right)
+
+        self.assertEqual(left.bins, whole.bins)
+        self.assertEqual(left.count, len(values))
+        self.assertEqual(left.max, max(values))
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(whole.quantile(q), exact, delta=exact * 0.02)
+
+        # With an even count the median lies between the two middle values
+        for count in (2, 12, 1000):
+            even = [round(rnd.expovariate(3), 3) for _ in range(count)]
+            even_sketch = sketch.QuantileSketch(0.02)
+            even_sketch.update(even)
+            median = statistics.median(even)
+            self.assertAlmostEqual(even_sketch.quantile(0.5), median, delta=median * 0.02)
+
+        with self.assertRaises(ValueError):
+            left.merge(sketch.QuantileSketch(0.01))
+
+    def test_log_aggregate(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(temp_dir, "nginx-access-ui.log-20170630")
+            with open(log_path, 'w') as log:
+                log.write(self.log_file)
+            log_info = loganalyzer.choose_log(temp_dir)
+            config = {"REPORT_HISTORY": os.path.join(temp_dir, "history"), "STATS_MODE": "exact"}
+
+            log_data = loganalyzer.get_log_data(config, log_info)
+            aggregate_path = loganalyzer.get_aggregate_path(config["REPORT_HISTORY"], log_path)
+            self.assertTrue(os.path.isfile(aggregate_path))
+
+            with mock.patch('loganalyzer.open_log') as open_log:
+                self.assertEqual(loganalyzer.get_log_data(config, log_info), log_data)
+                open_log.assert_not_called()
+
+            if columnar.np is not None:
+                log_data_columnar = loganalyzer.get_log_data({**config, "STATS_MODE": "columnar"}, log_info)
+                self.assertEqual(loganalyzer.construct_report(0.01, log_data_columnar, 10),
+                                 loganalyzer.construct_report(0.01, log_data, 10))
+
+            log_data_approx = loganalyzer.get_log_data({**config, "STATS_MODE": "approx", "QUANTILE_ACCURACY": 0.01},
+                                                       log_info)
+            with open(aggregate_path, 'rb') as aggregate:
+                header, stored = aggstore.load(aggregate)
+            self.assertEqual(header["source"]["name"], "nginx-access-ui.log-20170630")
+            self.assertEqual(stored, log_data)
+
+            # A log that changed since the aggregate was stored gets parsed again
+            with open(log_path, 'a') as log:
+                log.write("\n/broken line/")
+            self.assertEqual(loganalyzer.get_log_data(config, log_info)["total_errors"], 1)
+
+            sketch_path = os.path.join(temp_dir, "sketch.agg")
+            aggstore.save(log_data_approx, sketch_path)
+            with open(sketch_path, 'rb') as aggregate:
+                header, stored = aggstore.load(aggregate, "approx", 0.01)
+            self.assertEqual(loganalyzer.construct_report(0.01, stored, 10),
+                             loganalyzer.construct_report(0.01, log_data_approx, 10))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_range(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_dir = os.path.join(temp_dir, "log")
+            os.makedirs(log_dir)
+            # The second day is twice as slow as the first one
+            for day, factor in (("20170628", 1), ("20170629", 2), ("20170701", 1)):
+                with open(os.path.join(log_dir, "nginx-access-ui.log-" + day), 'w') as log:
+                    log.write(self.log_file.replace(".0\n", "%d.0\n" % factor))
+            config = {**self.cfg_default,
+                      "LOG_DIR": log_dir,
+                      "REPORT_DIR": os.path.join(temp_dir, "reports"),
+                      "REPORT_TEMPLATE": THIS_DIR + self.cfg_default["REPORT_TEMPLATE"],
+                      "REPORT_HISTORY": os.path.join(temp_dir, "history"),
+                      "DATE_FROM": "20170628",
+                      "DATE_TO": "2017-06-30"}
+
+            logs = loganalyzer.choose_logs(log_dir, datetime(2017, 6, 28), datetime(2017, 6, 30))
+            self.assertEqual([log.date for log in logs], [datetime(2017, 6, 28), datetime(2017, 6, 29)])
+
+            loganalyzer.main(config)
+            report_path = os.path.join(config["REPORT_DIR"], "report-2017.06.28-2017.06.29.html")
+            report_contents = open(report_path).read()
+            self.assertIn('"time_med_dod"', report_contents)
+            self.assertEqual(len(os.listdir(config["REPORT_HISTORY"])), 2)
+
+            log_data = loganalyzer.parse_log(self.log_file.splitlines())
+            summary = loganalyzer.summarize_log_data(log_data, 0.01)
+            daily_stats = [{"/link1/": (10.0, 2.0)}, {}, {"/link1/": (30.0, 3.0)}, {"/link1/": (20.0, 2.5)}]
+            report_data = loganalyzer.add_daily_trends(loganalyzer.construct_report(0.01, summary, 10), daily_stats)
+            link1 = [row for row in report_data if row["url"] == "/link1/"][0]
+            self.assertEqual(link1["days"], 3)
+            self.assertEqual(link1["time_med_dod"], [None, None, -0.5])
+            self.assertEqual(link1["time_sum_dod"], [None, None, -10.0])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_backfill(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_dir = os.path.join(temp_dir, "log")
+            report_dir = os.path.join(temp_dir, "reports")
+            os.makedirs(log_dir)
+            os.makedirs(report_dir)
+            for day in ("20170628", "20170629", "20170630"):
+                with open(os.path.join(log_dir, "nginx-access-ui.log-" + day), 'w') as log:
+                    log.write(self.log_file)
+            with gzip.open(os.path.join(log_dir, "nginx-access-ui.log-20170701.gz"), 'wt') as log:
+                log.write("not an nginx log\n" * 2000)
+            # Already has a report
+            with open(os.path.join(report_dir, "report-2017.06.29.html"), 'w') as report:
+                report.write("old report")
+
+            config = {**self.cfg_default, "LOG_DIR": log_dir, "REPORT_DIR": report_dir,
+                      "REPORT_TEMPLATE": THIS_DIR + self.cfg_default["REPORT_TEMPLATE"],
+                      "REPORT_HISTORY": os.path.join(temp_dir, "history"), "ERROR_MIN_LINES": 1000, "WORKERS": 2}
+            with patch("loganalyzer.error", side_effect=RuntimeError) as mock_error:
+                with self.assertRaises(RuntimeError):
+                    loganalyzer.backfill(config)
+                self.assertIn("1 logs could not be backfilled", mock_error.call_args[0][0])
+
+            self.assertEqual(sorted(os.listdir(report_dir)),
+                             ["report-2017.06.28.html", "report-2017.06.29.html", "report-2017.06.30.html"])
+            with open(os.path.join(report_dir, "report-2017.06.29.html")) as report:
+                self.assertEqual(report.read(), "old report")
+            with open(os.path.join(report_dir, "report-2017.06.30.html")) as report:
+                self.assertIn("/link10/", report.read())
+
+            os.remove(os.path.join(log_dir, "nginx-access-ui.log-20170701.gz"))
+            self.assertEqual(loganalyzer.backfill(config), [])
+
+            logs = [loganalyzer.LogInfo(log_dir, datetime(2017, 6, day), None) for day in (28, 29, 30)]
+            results = sorted(loganalyzer.backfill_results(crash_on_log, logs, 2), key=lambda result: result["log"])
+            self.assertEqual([result["error"] for result in results], [None, "the worker process died", None])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_report_formats(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            report_data = loganalyzer.construct_report(0.01, loganalyzer.parse_log(self.log_file.splitlines()), 10)
+            sections = [{"name": "status", "title": "Requests by status", "rows": [{"status": "200", "count": 1000}]}]
+            config = {**self.cfg_default, "REPORT_GZIP": True,
+                      "REPORT_TEMPLATE": os.path.join(THIS_DIR, "..", "loganalyzer", "files", "templates", "report.html")}
+
+            config["REPORT_FORMAT"] = "ndjson"
+            report_path = os.path.join(temp_dir, loganalyzer.get_report_name(config, "report-2017.06.30.html"))
+            self.assertTrue(report_path.endswith("report-2017.06.30.ndjson.gz"))
+            loganalyzer.write_report(config, report_path, report_data, sections=sections)
+            with gzip.open(report_path, 'rt') as report:
+                self.assertEqual([json.loads(line) for line in report], report_data)
+            with gzip.open(os.path.join(temp_dir, "report-2017.06.30.status.ndjson.gz"), 'rt') as report:
+                self.assertEqual(json.loads(report.read()), {"status": "200", "count": 1000})
+
+            config.update(REPORT_FORMAT="csv", REPORT_GZIP=False)
+            report_path = os.path.join(temp_dir, loganalyzer.get_report_name(config, "report-2017.06.30.html"))
+            loganalyzer.write_report(config, report_path, report_data)
+            with open(report_path, newline="") as report:
+                rows = list(csv.DictReader(report))
+            self.assertEqual([(row["url"], float(row["time_sum"])) for row in rows],
+                             [(row["url"], row["time_sum"]) for row in report_data])
+
+            config.update(REPORT_FORMAT="html-pages", REPORT_PAGE_SIZE=3)
+            report_path = os.path.join(temp_dir, "report-2017.06.30.html")
+            loganalyzer.write_report(config, report_path, report_data)
+            pages_dir = os.path.join(temp_dir, "report-2017.06.30.pages")
+            self.assertEqual(sorted(os.listdir(pages_dir)), ["page-00001.js", "page-00002.js", "page-00003.js",
+                                                             "page-00004.js"])
+            with open(os.path.join(pages_dir, "page-00004.js")) as page:
+                self.assertEqual(page.read(), "loadReportPage(4, %s);\n" % json.dumps(report_data[9:]))
+            with open(report_path) as report:
+                self.assertIn('"rows": 10', report.read())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_map_reduce(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            lines = self.log_file.splitlines(keepends=True)
+            # Two frontends with a log of the same name, each mapped on its own
+            partials = []
+            for frontend, frontend_lines in (("a", lines[:300]), ("b", lines[300:])):
+                log_path = os.path.join(temp_dir, frontend, "nginx-access-ui.log-20170630")
+                os.makedirs(os.path.dirname(log_path))
+                with open(log_path, 'w') as log:
+                    log.writelines(frontend_lines)
+                config = {**self.cfg_default, "REPORT_HISTORY": "", "MAP_LOG": log_path, "AGGREGATORS": ["status"],
+                          "PARTIAL_DIR": os.path.join(temp_dir, "partials-" + frontend)}
+                partials.append(loganalyzer.map_log(config))
+
+            log_data, log_dates = loganalyzer.reduce_partials(partials + partials[:1])
+            self.assertEqual(log_dates, [datetime(2017, 6, 30)])
+            exact_report = loganalyzer.construct_report(0.01, loganalyzer.parse_log(lines), 10)
+            report = loganalyzer.construct_report(0.01, log_data, 10)
+            self.assertEqual([(row["url"], row["count"], row["time_sum"]) for row in report],
+                             [(row["url"], row["count"], row["time_sum"]) for row in exact_report])
+            for row, exact_row in zip(report, exact_report):
+                self.assertLessEqual(abs(row["time_med"] - exact_row["time_med"]), exact_row["time_med"] * 0.01)
+            self.assertEqual(aggregators.get_sections(log_data)["status"].counts, {"200": 1000})
+
+            config = {**config, "URL_RULES": ["numeric"], "PARTIAL_DIR": os.path.join(temp_dir, "partials-c")}
+            with patch("loganalyzer.error", side_effect=RuntimeError) as mock_error:
+                with self.assertRaises(RuntimeError):
+                    loganalyzer.reduce_partials(partials + [loganalyzer.map_log(config)])
+                self.assertIn("mapped with other settings", mock_error.call_args[0][0])
+
+            report_dir = os.path.join(temp_dir, "reports")
+            config = {**config, "REDUCE": partials, "REPORT_DIR": report_dir,
+                      "REPORT_TEMPLATE": THIS_DIR + self.cfg_default["REPORT_TEMPLATE"]}
+            self.assertEqual(loganalyzer.reduce_report(config), os.path.join(report_dir, "report-2017.06.30.html"))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_bench_pipeline(self):
+        temp_dir = tempfile.mkdtemp()
+        # The stages run in spawned processes, which import the benchmark by its module name
+        with patch("sys.path", [BENCHMARKS_DIR] + sys.path), patch("builtins.print"):
+            import bench_pipeline
+            try:
+                output = os.path.join(temp_dir, "results.json")
+                self.assertEqual(bench_pipeline.main(["--lines", "2000", "--urls", "50", "--workers", "2",
+                                                      "--work-dir", temp_dir, "--output", output]), 0)
+                with open(output) as results_file:
+                    results = json.load(results_file)
+                self.assertEqual(list(results["stages"]), list(bench_pipeline.STAGES))
+                self.assertEqual(results["params"]["workers"], 2)
+                with open(os.path.join(temp_dir, "nginx-access-ui.log-20170630")) as log:
+                    self.assertEqual(results["total_errors"], log.read().count(bench_pipeline.genlog.ERROR_LINE))
+                # Nothing is left behind by the stages
+                self.assertEqual(sorted(os.listdir(temp_dir)), ["nginx-access-ui.log-20170630", "results.json"])
+            finally:
+                shutil.rmtree(temp_dir)
+
+    def test_log_follower(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(temp_dir, "nginx-access-ui.log")
+            with open(log_path, 'wb') as log:
+                log.write(b"old line\n")
+            follower = follow.LogFollower(log_path)
+            self.assertEqual(list(follower.read_lines()), [])
+
+            with open(log_path, 'ab') as log:
+                log.write(b"first\nsec")
+            self.assertEqual(list(follower.read_lines()), [b"first"])
+            with open(log_path, 'ab') as log:
+                log.write(b"ond\n")
+            self.assertEqual(list(follower.read_lines()), [b"second"])
+
+            # Truncated in place
+            with open(log_path, 'wb') as log:
+                log.write(b"after truncation\n")
+            self.assertEqual(list(follower.read_lines()), [b"after truncation"])
+
+            # Rotated: the tail of the old file comes before the new file
+            with open(log_path, 'ab') as log:
+                log.write(b"last old line\n")
+            os.rename(log_path, log_path + "-20170630")
+            with open(log_path, 'wb') as log:
+                log.write(b"new file\n")
+            self.assertEqual(list(follower.read_lines()), [b"last old line", b"new file"])
+            follower.close()
+
+            # A backlog is yielded chunk by chunk rather than read in full first
+            with open(log_path, 'ab') as log:
+                log.write(b"backlog line\n" * 1000)
+            follower = follow.LogFollower(log_path, from_start=True, chunk_size=1024)
+            lines = follower.read_lines()
+            self.assertEqual(next(lines), b"new file")
+            self.assertEqual(follower.offset, 1024)
+            self.assertEqual(sum(1 for _ in lines), 1000)
+            follower.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_rolling_window(self):
+        lines = self.log_file.encode('utf-8').splitlines()
+        rolling_window = follow.RollingWindow(15 * 60, bucket_seconds=60)
+        loganalyzer.parse_into_bucket(lines[:500], rolling_window.current(1000 * 60), 0.01)
+        loganalyzer.parse_into_bucket(lines[500:] + [b"garbage"], rolling_window.current(1010 * 60 + 5), 0.01)
+
+        last_5 = loganalyzer.window_log_data(rolling_window.collect(5 * 60, 1010 * 60 + 30))
+        last_15 = loganalyzer.window_log_data(rolling_window.collect(15 * 60, 1010 * 60 + 30))
+        self.assertEqual((last_5["total_count"], last_5["total_errors"]), (500, 1))
+        self.assertEqual((last_15["total_count"], last_15["total_errors"]), (1000, 1))
+        self.assertEqual(last_15["/link1/"].count, 100)
+
+        rolling_window.current(1016 * 60)
+        self.assertEqual(len(rolling_window.buckets), 2)
+        self.assertEqual(loganalyzer.window_log_data(rolling_window.collect(15 * 60, 1016 * 60))["total_count"], 500)
+
+    def test_follow(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(temp_dir, "nginx-access-ui.log")
+            with open(log_path, 'w') as log:
+                log.write(self.log_file + "\n")
+            config = {**self.cfg_default,
+                      "REPORT_DIR": temp_dir,
+                      "REPORT_TEMPLATE": THIS_DIR + self.cfg_default["REPORT_TEMPLATE"],
+                      "FOLLOW_LOG": log_path,
+                      "FOLLOW_FROM_START": True,
+                      "FOLLOW_WINDOWS": [5, 15]}
+            loganalyzer.follow(config, refreshes=1)
+            for name in ("report-live-5m.html", "report-live-15m.html"):
+                self.assertIn("/link10/", open(os.path.join(temp_dir, name)).read())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_parse_gzip_parallel(self):
+        log_file = (self.log_file + "\n/broken line/\n").encode('utf-8')
+        log_data_serial = loganalyzer.parse_log(log_file.splitlines())
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # Members split the lines at arbitrary places, as pigz and bgzip do
+            multi_member_path = os.path.join(temp_dir, "nginx-access-ui.log-20170630.gz")
+            with open(multi_member_path, 'wb') as log:
+                for start in range(0, len(log_file), 9973):
+                    log.write(gzip.compress(log_file[start:start + 9973]))
+            boundaries = gzindex.find_member_boundaries(multi_member_path, 4)
+            self.assertEqual(len(boundaries), 5)
+            self.assertEqual(loganalyzer.parse_gzip_parallel(multi_member_path, 4), log_data_serial)
+
+            single_member_path = os.path.join(temp_dir, "nginx-access-ui.log-20170701.gz")
+            with open(single_member_path, 'wb') as log:
+                log.write(gzip.compress(log_file))
+            self.assertEqual(gzindex.find_member_boundaries(single_member_path, 4),
+                             [0, os.path.getsize(single_member_path)])
+            log_info = loganalyzer.LogInfo(temp_dir, datetime(2017, 7, 1), ".gz")
+            self.assertEqual(loganalyzer.parse_log(loganalyzer.open_log(log_info)), log_data_serial)
+            if gzindex.indexed_gzip is None:
+                self.assertIsNone(loganalyzer.parse_gzip_parallel(single_member_path, 4))
+            else:
+                # The first sequential read has left an index next to the log
+                self.assertTrue(gzindex.has_index(single_member_path))
+                self.assertEqual(loganalyzer.parse_gzip_parallel(single_member_path, 4), log_data_serial)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_construct_report(self):
         config = self.cfg_default
         report_data = self.log_data_correct
@@ -30,7 +30,16 @@
 # Можно свободно определять свои функции и т.п.
 # -----------------
 
-from itertools import combinations, product
+import os
+import random
+import pickle
+from functools import lru_cache
+from itertools import combinations, combinations_with_replacement, product
+
+try:
+    import numpy as np
+except ImportError:  # evaluate_batch недоступна без numpy
+    np = None
 
 RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 BLACK_SUITS = ['C', 'S']
@@ -108,13 +117,390 @@ def two_pair(ranks):
         return None
 
 
+# Быстрая оценка "руки" (в духе Cactus Kev).
+# Карта кодируется целым числом:
+#   ssss ssss ssss ssss | xxxbbbbb bbbbbbbb cdhsrrrr xxpppppp
+# b - бит ранга, cdhs - бит масти, r - номер ранга (0-12), p - простое число ранга,
+# s - счетчик мастей: по 4 бита на масть, так что сумма кодов карт (>> 32) дает число карт каждой масти.
+# Произведение простых чисел однозначно задает набор рангов "руки" из 5, 6 или 7 карт,
+# а пять карт одной масти означают флеш. Таблицы строятся один раз из hand_rank,
+# поэтому порядок сил в точности совпадает с порядком hand_rank. Чтобы не строить их при каждом
+# импорте (и в каждом рабочем процессе), готовые таблицы хранятся в poker_tables.pickle рядом с модулем.
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+SUITS = ['S', 'H', 'D', 'C']
+SUIT_BITS = 0xF000
+# Если в счетчике мастей есть 5 и больше, прибавка 3 поднимает старший бит этой масти
+FLUSH_CHECK = 0x3333
+FLUSH_BITS = {0x8 << (4 * suit): 1 << (12 + suit) for suit in range(4)}
+
+
+def card_code(card):
+    """Возвращает целочисленный код карты"""
+    rank = RANKS.index(card[0])
+    suit = SUITS.index(card[1])
+    return 1 << (32 + 4 * suit) | 1 << (16 + rank) | 1 << (12 + suit) | rank << 8 | PRIMES[rank]
+
+
+CARD_CODES = {rank + suit: card_code(rank + suit) for rank in RANKS for suit in SUITS}
+
+
+def _rank_tables():
+    """Строит таблицы сил "рук" из 5ти карт: по произведению простых чисел для флешей и всех остальных.
+    Сила - номер значения hand_rank среди всех возможных, от худшего к лучшему"""
+    hands = []
+    for ranks in combinations_with_replacement(RANKS, 5):
+        if max(ranks.count(rank) for rank in ranks) > 4:
+            continue
+        # Одинаковые ранги идут подряд, так что масти по кругу не повторяются и не дают флеш
+        hands.append((False, [rank + SUITS[i % 4] for i, rank in enumerate(ranks)]))
+        if len(set(ranks)) == 5:
+            hands.append((True, [rank + SUITS[0] for rank in ranks]))
+
+    rated = []
+    for is_flush, hand in hands:
+        primes = 1
+        for card in hand:
+            primes *= CARD_CODES[card] & 0xFF
+        rated.append((hand_rank(hand), is_flush, primes, "".join(card[0] for card in hand)))
+    # Значения hand_rank содержат списки, поэтому равные ищутся среди соседей после сортировки
+    rated.sort(key=lambda item: item[0])
+
+    hand_ranks, strength_ranks, flushes, others = [], [], {}, {}
+    for rank, is_flush, primes, ranks in rated:
+        if not hand_ranks or hand_ranks[-1] != rank:
+            hand_ranks.append(rank)
+            strength_ranks.append(ranks)
+        (flushes if is_flush else others)[primes] = len(hand_ranks) - 1
+
+    _add_larger_hands(flushes, combinations)
+    _add_larger_hands(others, combinations_with_replacement)
+    return hand_ranks, strength_ranks, flushes, others
+
+
+def _add_larger_hands(strengths, rank_sets):
+    """Дополняет таблицу наборами из 6 и 7 рангов: сила набора - лучшая среди наборов на ранг меньше"""
+    for size in (6, 7):
+        for ranks in rank_sets(range(len(RANKS)), size):
+            if any(ranks[i] == ranks[i + 4] for i in range(size - 4)):
+                continue
+            primes = 1
+            for rank in ranks:
+                primes *= PRIMES[rank]
+            strengths[primes] = max(strengths[primes // PRIMES[rank]] for rank in set(ranks))
+
+
+TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "poker_tables.pickle")
+# Меняется вместе с hand_rank или устройством таблиц, чтобы старый файл не загрузился
+TABLES_VERSION = 1
+
+
+def load_rank_tables(path=TABLES_PATH):
+    """Таблицы сил из файла. Если файла нет или он другой версии, таблицы строятся и сохраняются"""
+    try:
+        with open(path, "rb") as tables_file:
+            version, tables = pickle.load(tables_file)
+        if version == TABLES_VERSION:
+            return tables
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    tables = _rank_tables()
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp_path, "wb") as tables_file:
+            pickle.dump((TABLES_VERSION, tables), tables_file, protocol=4)
+        os.replace(temp_path, path)
+    except OSError:
+        # Каталог только для чтения: таблицы будут строиться при каждом импорте
+        pass
+    return tables
+
+
+# HAND_RANKS[сила] - значение hand_rank, STRENGTH_RANKS[сила] - ранги 5ти карт с этой силой
+HAND_RANKS, STRENGTH_RANKS, FLUSH_STRENGTHS, STRENGTHS = load_rank_tables()
+
+
+def evaluate5(c1, c2, c3, c4, c5):
+    """Возвращает силу "руки" из 5ти карт, заданных кодами. Чем больше, тем сильнее"""
+    primes = (c1 & 0xFF) * (c2 & 0xFF) * (c3 & 0xFF) * (c4 & 0xFF) * (c5 & 0xFF)
+    if c1 & c2 & c3 & c4 & c5 & SUIT_BITS:
+        return FLUSH_STRENGTHS[primes]
+    return STRENGTHS[primes]
+
+
+def evaluate7(c1, c2, c3, c4, c5, c6, c7):
+    """Возвращает силу лучшей "руки" из 5ти карт среди 7ми, заданных кодами"""
+    flush = (((c1 + c2 + c3 + c4 + c5 + c6 + c7) >> 32) + FLUSH_CHECK) & 0x8888
+    if flush:
+        # Каре и фулл-хаус при флеше в 7ми картах невозможны, так что лучшая "рука" - из карт этой масти
+        suit_bit = FLUSH_BITS[flush]
+        primes = 1
+        for code in (c1, c2, c3, c4, c5, c6, c7):
+            if code & suit_bit:
+                primes *= code & 0xFF
+        return FLUSH_STRENGTHS[primes]
+    return STRENGTHS[(c1 & 0xFF) * (c2 & 0xFF) * (c3 & 0xFF) * (c4 & 0xFF) * (c5 & 0xFF) * (c6 & 0xFF) * (c7 & 0xFF)]
+
+
+def evaluate(codes):
+    """Сила лучшей "руки" из 5ти карт среди 5, 6 или 7ми, заданных кодами"""
+    primes = 1
+    suits = 0
+    for code in codes:
+        primes *= code & 0xFF
+        suits += code >> 32
+    flush = (suits + FLUSH_CHECK) & 0x8888
+    if flush:
+        suit_bit = FLUSH_BITS[flush]
+        primes = 1
+        for code in codes:
+            if code & suit_bit:
+                primes *= code & 0xFF
+        return FLUSH_STRENGTHS[primes]
+    return STRENGTHS[primes]
+
+
+def hand_strength(hand):
+    """Сила лучшей "руки" из 5ти карт среди 5, 6 или 7ми. Порядок сил совпадает с порядком hand_rank,
+    а HAND_RANKS[сила] - значение hand_rank этой "руки"
+    """
+    codes = CARD_CODES
+    if len(hand) == 7:
+        return evaluate7(codes[hand[0]], codes[hand[1]], codes[hand[2]], codes[hand[3]],
+                         codes[hand[4]], codes[hand[5]], codes[hand[6]])
+    if len(hand) == 5:
+        return evaluate5(codes[hand[0]], codes[hand[1]], codes[hand[2]], codes[hand[3]], codes[hand[4]])
+    return evaluate([codes[card] for card in hand])
+
+
+def strength_cards(hand, strength):
+    """Возвращает 5 карт "руки" с данной силой - те же, что первыми дает combinations(hand, 5).
+    Для каждого нужного ранга берутся первые по порядку карты, для флеша - только карты его масти"""
+    needed = dict.fromkeys(RANKS, 0)
+    for rank in STRENGTH_RANKS[strength]:
+        needed[rank] += 1
+    suit = None
+    if HAND_RANKS[strength][0] in (5, 8):
+        suits = [card[1] for card in hand]
+        suit = max(SUITS, key=suits.count)
+
+    cards = []
+    for card in hand:
+        if needed[card[0]] and (suit is None or card[1] == suit):
+            needed[card[0]] -= 1
+            cards.append(card)
+    return tuple(cards)
+
+
 def best_hand(hand):
     """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
-    return max(combinations(hand, 5), key = hand_rank)
+    return strength_cards(hand, hand_strength(hand))
+
+
+# Оценка сразу многих "рук" на numpy.
+# Карта в массиве - номер ранга в RANKS * 4 + номер масти в SUITS
+CARD_NUMBERS = {rank + suit: RANKS.index(rank) * 4 + SUITS.index(suit) for rank in RANKS for suit in SUITS}
+BATCH_CHUNK = 1 << 16
+
+
+def card_numbers(hands):
+    """Переводит список "рук" одного размера в массив номеров карт для evaluate_batch"""
+    return np.array([[CARD_NUMBERS[card] for card in hand] for hand in hands], dtype=np.int8)
+
+
+@lru_cache(maxsize=None)
+def batch_tables():
+    """Таблицы сил в виде массивов: отсортированные произведения простых чисел и их силы
+    для флешей и остальных, и число карт каждого ранга у "руки" каждой силы"""
+    tables = []
+    for strengths in (FLUSH_STRENGTHS, STRENGTHS):
+        keys = np.array(sorted(strengths), dtype=np.int64)
+        tables.append((keys, np.array([strengths[key] for key in keys.tolist()], dtype=np.int16)))
+    needed = np.zeros((len(HAND_RANKS), len(RANKS)), dtype=np.int8)
+    for strength, ranks in enumerate(STRENGTH_RANKS):
+        for rank in ranks:
+            needed[strength, RANKS.index(rank)] += 1
+    return tables[0], tables[1], needed
+
+
+def evaluate_batch(cards, return_cards=False):
+    """Силы лучших "рук" из 5ти карт для массива "рук" из 5-7 карт (N x 5..7, номера карт как в CARD_NUMBERS).
+    С return_cards=True возвращает еще N x 5 номеров столбцов выигрышных карт - тех же, что выбирает best_hand"""
+    if np is None:
+        raise RuntimeError("evaluate_batch требует numpy")
+    cards = np.asarray(cards)
+    if cards.ndim != 2 or not 5 <= cards.shape[1] <= 7:
+        raise ValueError("Ожидается массив N x 5..7 карт, получен %s" % (cards.shape,))
+    strengths = np.empty(len(cards), dtype=np.int16)
+    winners = np.empty((len(cards), 5), dtype=np.int8) if return_cards else None
+    # По частям, чтобы промежуточные массивы не росли вместе с N
+    for start in range(0, len(cards), BATCH_CHUNK):
+        chunk = slice(start, start + BATCH_CHUNK)
+        _check_batch(cards[chunk], start)
+        ranks, suits = np.divmod(cards[chunk].astype(np.intp), 4)
+        strengths[chunk], flush_suits = _batch_strengths(ranks, suits)
+        if return_cards:
+            winners[chunk] = _batch_cards(ranks, suits, strengths[chunk], flush_suits)
+    return (strengths, winners) if return_cards else strengths
+
+
+def _check_batch(cards, start):
+    """Номера карт должны быть от 0 до 51 и не повторяться в одной "руке" """
+    bad = (cards < 0).any(axis=1) | (cards >= len(CARD_NUMBERS)).any(axis=1)
+    ordered = np.sort(cards, axis=1)
+    bad |= (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+    if bad.any():
+        rows = np.flatnonzero(bad) + start
+        raise ValueError("Неверные или повторяющиеся номера карт в строках %s" % rows[:10].tolist())
+
+
+def _table_lookup(keys, values, products):
+    """Силы по произведениям простых чисел. Произведение не из таблицы - ошибка, а не чужая сила"""
+    index = np.minimum(np.searchsorted(keys, products), len(keys) - 1)
+    missing = keys[index] != products
+    if missing.any():
+        raise ValueError("Нет таких наборов рангов в таблице сил: %s" % products[missing][:10].tolist())
+    return values[index]
+
+
+def _batch_strengths(ranks, suits):
+    """Силы по рангам и мастям карт; масть флеша для "рук" с флешем и -1 для остальных"""
+    (flush_keys, flush_values), (keys, values), _ = batch_tables()
+    rank_primes = np.array(PRIMES, dtype=np.int64)[ranks]
+    strengths = _table_lookup(keys, values, rank_primes.prod(axis=1))
+
+    suit_counts = (suits[:, :, None] == np.arange(len(SUITS))).sum(axis=1)
+    flush_suits = np.where(suit_counts.max(axis=1) >= 5, suit_counts.argmax(axis=1), -1)
+    flushes = np.flatnonzero(flush_suits >= 0)
+    if len(flushes):
+        # Каре и фулл-хаус при флеше в 7ми картах невозможны, так что лучшая "рука" - из карт этой масти
+        in_suit = suits[flushes] == flush_suits[flushes, None]
+        flush_primes = np.where(in_suit, rank_primes[flushes], 1).prod(axis=1)
+        strengths[flushes] = _table_lookup(flush_keys, flush_values, flush_primes)
+    return strengths, flush_suits
+
+
+def _batch_cards(ranks, suits, strengths, flush_suits):
+    """Столбцы выигрышных карт, как в strength_cards: первые карты каждого нужного ранга"""
+    needed = batch_tables()[2][strengths]
+    rows = np.arange(len(ranks))
+    taken = np.zeros(ranks.shape, dtype=bool)
+    for column in range(ranks.shape[1]):
+        rank = ranks[:, column]
+        take = (needed[rows, rank] > 0) & ((flush_suits < 0) | (suits[:, column] == flush_suits))
+        needed[rows, rank] -= take
+        taken[:, column] = take
+    return np.nonzero(taken)[1].reshape(len(ranks), 5)
+
+
+JOKER_CARDS = {'?B': [rank + suit for rank in RANKS for suit in BLACK_SUITS],
+               '?R': [rank + suit for rank in RANKS for suit in RED_SUITS]}
+JOKER_SUITS = {'?B': BLACK_SUITS, '?R': RED_SUITS}
+RANK_PRIMES = dict(zip(RANKS, PRIMES))
 
 
 def best_wild_hand(hand):
-    """best_hand но с джокерами"""
+    """best_hand но с джокерами. Возвращает то же, что и перебор всех подстановок в product_wild_hand"""
+    jokerless = [card for card in hand if card not in JOKERS]
+    jokers = [joker for joker in JOKERS if joker in hand]
+    if not jokers:
+        return best_hand(hand)
+    flush_suit, (best, row_best, second_index, strengths) = wild_table(jokerless, jokers)
+
+    """Перебор шел по product: черный джокер во внешнем цикле, красный - во внутреннем.
+    Берем первую по этому порядку подстановку с лучшей силой"""
+    taken = set(jokerless)
+    first = next(card for card in JOKER_CARDS[jokers[0]]
+                 if card not in taken and row_best[card[0], card[1] == flush_suit] == best)
+    wild = [first]
+    if len(jokers) == 2:
+        row = strengths[first[0], first[1] == flush_suit]
+        wild.append(next(card for card in JOKER_CARDS[jokers[1]]
+                         if card not in taken and row[second_index[card[0], card[1] == flush_suit]] == best))
+    return strength_cards(jokerless + wild, best)
+
+
+def wild_hand_strength(hand):
+    """Сила "руки", которую вернет best_wild_hand, без выбора самих карт"""
+    jokerless = [card for card in hand if card not in JOKERS]
+    jokers = [joker for joker in JOKERS if joker in hand]
+    if not jokers:
+        return hand_strength(hand)
+    return wild_table(jokerless, jokers)[1][0]
+
+
+def wild_table(jokerless, jokers):
+    """Масть флеша (или None) и wild_strengths для карт без джокеров.
+    Флеш возможен только в масти, где уже есть 4 карты (в 7ми картах такая масть одна,
+    а джокер добавляет в масть не больше одной карты). Поэтому сила зависит только от вида
+    значения джокера: его ранга и того, попал ли он в эту масть"""
+    suits = [card[1] for card in jokerless]
+    flush_suit = max(SUITS, key=suits.count)
+    flush_count = suits.count(flush_suit)
+    if flush_count < 4:
+        flush_suit, flush_count = None, 0
+    primes = flush_primes = 1
+    for card in jokerless:
+        primes *= RANK_PRIMES[card[0]]
+        if card[1] == flush_suit:
+            flush_primes *= RANK_PRIMES[card[0]]
+    return flush_suit, wild_strengths(primes, flush_primes, flush_count,
+                                      tuple(joker_suits(joker, jokerless, flush_suit) for joker in jokers))
+
+
+def joker_suits(joker, jokerless, flush_suit):
+    """Может ли джокер попасть в масть флеша, и ранги, которые он не может принять вне нее"""
+    other_suits = [suit for suit in JOKER_SUITS[joker] if suit != flush_suit]
+    taken = {}
+    for card in jokerless:
+        if card[1] in other_suits:
+            taken[card[0]] = taken.get(card[0], 0) + 1
+    blocked = tuple(sorted(rank for rank, count in taken.items() if count == len(other_suits)))
+    return len(other_suits) < 2, blocked
+
+
+@lru_cache(maxsize=4096)
+def wild_strengths(primes, flush_primes, flush_count, jokers):
+    """Силы "руки" при всех видах значений джокеров по произведениям простых чисел рангов карт
+    (всех и в масти флеша), числу карт в масти флеша и joker_suits каждого джокера.
+    Возвращает лучшую силу, лучшую силу при каждом виде первого джокера,
+    номера видов второго и для каждого вида первого джокера список сил по видам второго"""
+    joker_kinds = []
+    for can_flush, blocked in jokers:
+        kinds = {}
+        for rank, rank_prime in zip(RANKS, PRIMES):
+            if rank not in blocked:
+                kinds[rank, False] = (rank_prime, 1, False)
+            # Значения в масти флеша заняты только картами этой масти
+            if can_flush and flush_primes % rank_prime:
+                kinds[rank, True] = (rank_prime, rank_prime, True)
+        joker_kinds.append(kinds)
+    # Без второго джокера у него одно "значение", ничего не меняющее
+    if len(joker_kinds) == 1:
+        joker_kinds.append({None: (1, 1, False)})
+
+    first_kinds, second_kinds = joker_kinds
+    second = list(second_kinds.values())
+    # Каре и фулл-хаус при флеше в 7ми картах невозможны
+    strengths = {}
+    for kind, (rank_prime, flush_prime, in_flush) in first_kinds.items():
+        wild_primes = primes * rank_prime
+        wild_flush_primes = flush_primes * flush_prime
+        count = flush_count + in_flush
+        if count + 1 < 5:
+            strengths[kind] = [STRENGTHS[wild_primes * second_prime] for second_prime, _, _ in second]
+        else:
+            strengths[kind] = [FLUSH_STRENGTHS[wild_flush_primes * second_flush_prime]
+                               if count + second_in_flush >= 5 else STRENGTHS[wild_primes * second_prime]
+                               for second_prime, second_flush_prime, second_in_flush in second]
+    row_best = {kind: max(row) for kind, row in strengths.items()}
+    second_index = {kind: i for i, kind in enumerate(second_kinds)}
+    return max(row_best.values()), row_best, second_index, strengths
+
+
+def product_wild_hand(hand):
+    """best_wild_hand перебором всех подстановок джокеров. Лучшая "рука" каждой подстановки
+    ищется перебором combinations по hand_rank, а не через best_hand, чтобы проверка
+    best_wild_hand не зависела от таблиц сил"""
 
     black_joker = [rank + suit for rank in RANKS for suit in BLACK_SUITS]
     red_joker = [rank + suit for rank in RANKS for suit in RED_SUITS]
@@ -136,7 +522,8 @@ def best_wild_hand(hand):
     else:
         possibilties = jokerless
 
-    best_wild_hand = max(map(best_hand, product(*possibilties)), key = hand_rank)
+    best_wild_hand = max((max(combinations(cards, 5), key = hand_rank) for cards in product(*possibilties)),
+                         key = hand_rank)
     return best_wild_hand
 
 
@@ -148,6 +535,14 @@ def test_best_hand():
             == ['8C', '8S', 'TC', 'TD', 'TH'])
     assert (sorted(best_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    # При равных "руках" - те же карты, что и у max по combinations
+    assert (best_hand("AS AD KS KD QS QD 2C".split())
+            == ('AS', 'AD', 'KS', 'KD', 'QS'))
+    rng = random.Random(0)
+    deck = list(CARD_CODES)
+    for _ in range(2000):
+        hand = rng.sample(deck, 7)
+        assert best_hand(hand) == max(combinations(hand, 5), key = hand_rank), hand
     print ('OK')
 
 
@@ -159,9 +554,71 @@ def test_best_wild_hand():
             == ['7C', 'TC', 'TD', 'TH', 'TS'])
     assert (sorted(best_wild_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    # Сверка с перебором подстановок по hand_rank: обычные "руки" и "руки" с 3-5 картами одной масти
+    rng = random.Random(0)
+    deck = list(CARD_CODES)
+    for i in range(300):
+        jokers = rng.choice([['?B'], ['?R'], JOKERS])
+        if i % 2:
+            suit = rng.choice(SUITS)
+            cards = rng.sample([rank + suit for rank in RANKS], rng.randint(3, 5))
+        else:
+            cards = []
+        cards += rng.sample([card for card in deck if card not in cards], 7 - len(jokers) - len(cards))
+        hand = cards + jokers
+        rng.shuffle(hand)
+        assert best_wild_hand(hand) == product_wild_hand(hand), hand
+    print ('OK')
+
+
+def test_hand_strength(step=97):
+    """Сравнивает силы с hand_rank на каждой step-й "руке" из 5ти карт (step=1 - на всех)"""
+    print ("test_hand_strength...")
+    assert len(HAND_RANKS) == 7462
+    # Сохраненные таблицы - те же, что строятся из hand_rank
+    assert (HAND_RANKS, STRENGTH_RANKS, FLUSH_STRENGTHS, STRENGTHS) == tuple(_rank_tables())
+    # Колесо A-5 в hand_rank не стрит, а старшая карта
+    assert (HAND_RANKS[hand_strength("AS 2D 3C 4H 5S".split())]
+            == (0, [14, 5, 4, 3, 2]))
+    assert (hand_strength("2D 3C 4H 5S 6S".split())
+            < hand_strength("AS 2S 3S 4S 5S".split())
+            < hand_strength("2S 3S 4S 5S 6S".split()))
+    assert (hand_strength("TD TC TH 8C 8S".split())
+            > hand_strength("TD TC TH 7C 7D".split()))
+    deck = list(CARD_CODES)
+    for i, hand in enumerate(combinations(deck, 5)):
+        if i % step == 0:
+            assert HAND_RANKS[hand_strength(hand)] == hand_rank(hand), hand
+    print ('OK')
+
+
+def test_evaluate_batch():
+    print ("test_evaluate_batch...")
+    if np is None:
+        print ('numpy не установлен, пропускаем')
+        return
+    rng = random.Random(0)
+    deck = list(CARD_CODES)
+    hands = [rng.sample(deck, 7) for _ in range(2000)]
+    hands.append("6C 7C 8C 9C TC 5C JS".split())
+    hands.append("AS AD KS KD QS QD 2C".split())
+    strengths, winners = evaluate_batch(card_numbers(hands), return_cards=True)
+    for hand, strength, columns in zip(hands, strengths, winners):
+        assert strength == hand_strength(hand), hand
+        assert tuple(hand[column] for column in columns) == best_hand(hand), hand
+    # Повторяющиеся и несуществующие карты - ошибка, а не сила чужой "руки"
+    for bad_row in ([0, 0, 0, 0, 0, 4, 8], [0, 4, 8, 12, 16, 20, 52], [-1, 4, 8, 12, 16, 20, 24]):
+        try:
+            evaluate_batch(np.array([list(range(0, 28, 4)), bad_row]))
+        except ValueError as e:
+            assert "[1]" in str(e), e
+        else:
+            assert False, bad_row
     print ('OK')
 
 
 if __name__ == '__main__':
+    test_hand_strength()
     test_best_hand()
+    test_evaluate_batch()
     test_best_wild_hand()
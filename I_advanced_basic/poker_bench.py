@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# -----------------
+# Проверка и замер скорости оценки "рук".
+# Оценщик - модуль с функциями best_hand и best_wild_hand как в poker.py
+# (и, если есть, hand_strength и evaluate_batch с card_numbers).
+# Порядок "рук" из 5ти карт сверяется с hand_rank на всех 2 598 960 "руках",
+# best_hand - с перебором combinations по hand_rank, best_wild_hand - с перебором
+# подстановок джокеров с тем же перебором combinations. Эталоны опираются только на hand_rank,
+# так что ошибка в таблицах сил не спрячется в эталоне. Отчет пишется в JSON,
+# с --baseline в него добавляется ускорение относительно прошлого отчета.
+#
+#   python poker_bench.py [--evaluator poker] [--five-step 1] [--output report.json] [--baseline old.json]
+# -----------------
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import importlib
+from itertools import combinations, product
+
+import poker
+
+EXAMPLES = 5
+
+
+def freeze(rank):
+    """Значение hand_rank, которое можно использовать как ключ словаря"""
+    return tuple(freeze(part) if isinstance(part, list) else part for part in rank)
+
+
+def random_hands(rng, count, size=7, jokers=False):
+    """Случайные "руки". С jokers в каждой один или два джокера"""
+    deck = list(poker.CARD_CODES)
+    hands = []
+    for _ in range(count):
+        wild = rng.choice([['?B'], ['?R'], poker.JOKERS]) if jokers else []
+        hand = rng.sample(deck, size - len(wild)) + wild
+        rng.shuffle(hand)
+        hands.append(hand)
+    return hands
+
+
+def check(name, hands, result, reference):
+    """Сверяет result(hand) с reference(hand) на всех "руках" """
+    mismatches = []
+    for hand in hands:
+        got, expected = result(hand), reference(hand)
+        if got != expected:
+            mismatches.append({"hand": hand, "got": list(got), "expected": list(expected)})
+    return _check_report(name, len(hands), mismatches)
+
+
+def check_five_cards(strength, step=1):
+    """Сила каждой "руки" из 5ти карт должна упорядочивать их так же, как hand_rank:
+    у равных по hand_rank "рук" одна сила, и силы растут вместе с hand_rank"""
+    strengths = {}
+    mismatches = []
+    hands = 0
+    for i, hand in enumerate(combinations(list(poker.CARD_CODES), 5)):
+        if i % step:
+            continue
+        hands += 1
+        rank = freeze(poker.hand_rank(hand))
+        value = strength(hand)
+        if strengths.setdefault(rank, value) != value:
+            mismatches.append({"hand": list(hand), "got": value, "expected": strengths[rank]})
+    ordered = sorted(strengths.items())
+    for (rank, value), (next_rank, next_value) in zip(ordered, ordered[1:]):
+        if not value < next_value:
+            mismatches.append({"hand_rank": [rank, next_rank], "got": [value, next_value]})
+    return _check_report("five_card", hands, mismatches)
+
+
+def check_batch(evaluator, hands):
+    """evaluate_batch должна давать те же силы, что hand_strength, и те же карты, что best_hand"""
+    strengths, winners = evaluator.evaluate_batch(evaluator.card_numbers(hands), return_cards=True)
+    mismatches = []
+    for hand, strength, columns in zip(hands, strengths.tolist(), winners.tolist()):
+        cards = [hand[column] for column in columns]
+        if strength != evaluator.hand_strength(hand) or tuple(cards) != tuple(evaluator.best_hand(hand)):
+            mismatches.append({"hand": hand, "got": cards, "expected": list(evaluator.best_hand(hand))})
+    return _check_report("batch", len(hands), mismatches)
+
+
+def _check_report(name, hands, mismatches):
+    return {"check": name, "hands": hands, "mismatches": len(mismatches), "examples": mismatches[:EXAMPLES]}
+
+
+def measure(name, function, hands):
+    """Скорость function на "руках": время и "рук" в секунду"""
+    started = time.perf_counter()
+    for hand in hands:
+        function(hand)
+    return _speed_report(name, len(hands), time.perf_counter() - started)
+
+
+def measure_batch(evaluator, hands):
+    cards = evaluator.card_numbers(hands)
+    started = time.perf_counter()
+    evaluator.evaluate_batch(cards)
+    return _speed_report("batch", len(hands), time.perf_counter() - started)
+
+
+def _speed_report(name, hands, seconds):
+    seconds = max(seconds, 1e-9)
+    return {"path": name, "hands": hands, "seconds": round(seconds, 6), "hands_per_second": round(hands / seconds, 1)}
+
+
+def legacy_best_hand(hand):
+    """best_hand в исходном виде: лучшая по hand_rank из всех combinations"""
+    return max(combinations(hand, 5), key=poker.hand_rank)
+
+
+def legacy_wild_hand(hand):
+    """best_wild_hand в исходном виде: лучшая по hand_rank среди legacy_best_hand всех подстановок джокеров"""
+    cards = [card for card in hand if card not in poker.JOKERS]
+    options = [[card] for card in cards]
+    for joker in poker.JOKERS:
+        if joker in hand:
+            options.append([card for card in poker.JOKER_CARDS[joker] if card not in cards])
+    return max(map(legacy_best_hand, product(*options)), key=poker.hand_rank)
+
+
+def run(evaluator, seed=0, five_step=1, seven_hands=20000, wild_hands=300, batch_hands=1000000):
+    """Проверки и замеры для модуля evaluator. Возвращает отчет"""
+    rng = random.Random(seed)
+    seven = random_hands(rng, seven_hands)
+    wild = random_hands(rng, wild_hands, jokers=True)
+    has_strength = hasattr(evaluator, "hand_strength")
+    has_batch = getattr(evaluator, "evaluate_batch", None) is not None and getattr(evaluator, "np", None) is not None
+
+    checks = []
+    if has_strength:
+        checks.append(check_five_cards(evaluator.hand_strength, five_step))
+    checks.append(check("seven_card", seven, lambda hand: tuple(evaluator.best_hand(hand)), legacy_best_hand))
+    checks.append(check("wild", wild, lambda hand: tuple(evaluator.best_wild_hand(hand)), legacy_wild_hand))
+    if has_batch:
+        checks.append(check_batch(evaluator, seven))
+
+    five = random_hands(rng, seven_hands, size=5)
+    speed = [measure("five_card_reference", poker.hand_rank, five)]
+    if has_strength:
+        speed.append(measure("five_card", evaluator.hand_strength, five))
+        speed.append(measure("seven_card_strength", evaluator.hand_strength, seven))
+    speed.append(measure("seven_card_reference", legacy_best_hand, seven[:seven_hands // 10]))
+    speed.append(measure("seven_card", evaluator.best_hand, seven))
+    speed.append(measure("wild", evaluator.best_wild_hand, wild))
+    if has_batch:
+        speed.append(measure_batch(evaluator, random_hands(rng, batch_hands)))
+
+    return {"evaluator": evaluator.__name__, "python": platform.python_version(), "seed": seed,
+            "passed": all(result["mismatches"] == 0 for result in checks),
+            "checks": checks, "speed": speed}
+
+
+def compare(report, baseline):
+    """Ускорение каждого пути относительно отчета baseline"""
+    baseline_speed = {result["path"]: result["hands_per_second"] for result in baseline["speed"]}
+    return {result["path"]: round(result["hands_per_second"] / baseline_speed[result["path"]], 3)
+            for result in report["speed"] if baseline_speed.get(result["path"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка и замер скорости оценки покерных рук")
+    parser.add_argument("--evaluator", default="poker", help="модуль оценщика")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--five-step", type=int, default=1,
+                        help="проверять каждую N-ю руку из 5ти карт (1 - все 2 598 960)")
+    parser.add_argument("--seven-hands", type=int, default=20000)
+    parser.add_argument("--wild-hands", type=int, default=300)
+    parser.add_argument("--batch-hands", type=int, default=1000000)
+    parser.add_argument("--output", help="файл отчета, по умолчанию stdout")
+    parser.add_argument("--baseline", help="прошлый отчет для сравнения скорости")
+    args = parser.parse_args()
+
+    report = run(importlib.import_module(args.evaluator), args.seed, args.five_step,
+                 args.seven_hands, args.wild_hands, args.batch_hands)
+    if args.baseline:
+        with open(args.baseline, encoding="UTF-8") as baseline_file:
+            report["speedup"] = compare(report, json.load(baseline_file))
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as report_file:
+            report_file.write(text + "\n")
+    else:
+        print(text)
+    return 0 if report["passed"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
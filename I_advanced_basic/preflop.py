@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+# -----------------
+# Таблица эквити префлоп: 169 классов стартовых рук (пары, одномастные и разномастные)
+# друг против друга. Таблица строится один раз генератором и хранится в бинарном файле,
+# который при импорте отображается в память (mmap), так что все процессы читают одни и те же
+# страницы из кэша ОС. Эквити диапазонов считается взвешенной суммой по таблице.
+# Таблицы сил poker тоже лежат готовыми (poker_tables.pickle рядом с preflop.bin), так что импорт
+# модуля и его рабочие процессы не строят оценщик заново.
+#
+#   python preflop.py --generate [--trials N] [--combos] [--output файл]
+# -----------------
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+import time
+from itertools import combinations, permutations
+
+import poker
+
+# Класс i*13 + j: при i == j пара, при i < j одномастные, при i > j разномастные (ранги от туза к двойке)
+RANKS_DESC = poker.RANKS[::-1]
+HAND_CLASSES = [RANKS_DESC[min(i, j)] + RANKS_DESC[max(i, j)] + ("" if i == j else "s" if i < j else "o")
+                for i in range(13) for j in range(13)]
+CLASS_INDEX = {name: i for i, name in enumerate(HAND_CLASSES)}
+# Карты в комбинации идут в порядке poker.CARD_NUMBERS
+COMBOS = [a + b for a, b in combinations(list(poker.CARD_CODES), 2)]
+COMBO_INDEX = {combo: i for i, combo in enumerate(COMBOS)}
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop.bin")
+COMBO_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_combos.bin")
+# Заголовок: метка, версия, размер таблицы, розыгрышей на клетку, seed
+HEADER = struct.Struct("<4sHHII")
+MAGIC = b"PFEQ"
+VERSION = 1
+# Эквити хранится как uint16: 0 - 0%, 65535 - 100%
+SCALE = 65535
+# Клетка таблицы комбинаций для пересекающихся рук
+NO_MATCHUP = 0xFFFF
+TRIALS = 20000
+# Розыгрышей, которые генератор делает за раз
+GENERATE_ROWS = 1 << 18
+
+
+def hand_class(cards):
+    """Класс стартовой руки из двух карт, например ['AS', 'KS'] -> 'AKs'"""
+    first, second = sorted(cards, key=lambda card: poker.RANKS.index(card[0]), reverse=True)
+    if first[0] == second[0]:
+        return first[0] + second[0]
+    return first[0] + second[0] + ("s" if first[1] == second[1] else "o")
+
+
+def class_combos(name):
+    """Все комбинации карт класса"""
+    return [combo for combo in COMBOS if hand_class([combo[:2], combo[2:]]) == name]
+
+
+def matchup_counts():
+    """Число пар непересекающихся комбинаций для каждой пары классов"""
+    combos = [[(combo[:2], combo[2:]) for combo in class_combos(name)] for name in HAND_CLASSES]
+    counts = bytearray(len(HAND_CLASSES) ** 2)
+    for i, hero in enumerate(combos):
+        for j, villain in enumerate(combos):
+            counts[i * len(HAND_CLASSES) + j] = sum(1 for a in hero for b in villain if not set(a) & set(b))
+    return counts
+
+
+class EquityTable(object):
+    """Таблица эквити из файла, отображенного в память"""
+
+    def __init__(self, path):
+        with open(path, "rb") as table_file:
+            self.map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.size, self.trials, self.seed = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s - не таблица эквити версии %d" % (path, VERSION))
+        cells = self.size * self.size
+        view = memoryview(self.map)
+        self.equities = view[HEADER.size:HEADER.size + 2 * cells].cast("H")
+        # Для классов за эквити идут числа пар комбинаций
+        self.counts = view[HEADER.size + 2 * cells:HEADER.size + 3 * cells] if self.size == len(HAND_CLASSES) else None
+
+    def equity(self, i, j):
+        value = self.equities[i * self.size + j]
+        return None if value == NO_MATCHUP else value / SCALE
+
+
+def load_table(path=TABLE_PATH):
+    return EquityTable(path) if os.path.exists(path) else None
+
+
+TABLE = load_table()
+
+
+def class_equity(hero, villain, table=None):
+    """Эквити класса hero против класса villain"""
+    table = table or _table()
+    return table.equity(CLASS_INDEX[hero], CLASS_INDEX[villain])
+
+
+def parse_range(hand_range):
+    """Диапазон - словарь класс: вес, список классов или строка классов через запятую (вес 1)"""
+    if isinstance(hand_range, str):
+        hand_range = [name.strip() for name in hand_range.split(",") if name.strip()]
+    if not isinstance(hand_range, dict):
+        hand_range = dict.fromkeys(hand_range, 1.0)
+    unknown = [name for name in hand_range if name not in CLASS_INDEX]
+    if unknown:
+        raise ValueError("Неизвестные классы рук: %s" % ", ".join(unknown))
+    return hand_range
+
+
+def range_equity(hero_range, villain_range, table=None):
+    """Эквити диапазона против диапазона: среднее по парам комбинаций классов,
+    взвешенное весами классов и числом непересекающихся пар комбинаций.
+    По таблице комбинаций классы раскрываются в комбинации, и каждая непересекающаяся пара весит 1"""
+    table = table or _table()
+    hero_cells, villain_cells = _range_cells(hero_range, table), _range_cells(villain_range, table)
+    total = weights = 0.0
+    for hero, hero_weight in hero_cells:
+        row = hero * table.size
+        for villain, villain_weight in villain_cells:
+            cell = row + villain
+            if table.counts is not None:
+                weight = hero_weight * villain_weight * table.counts[cell]
+            elif table.equities[cell] != NO_MATCHUP:
+                weight = hero_weight * villain_weight
+            else:
+                continue
+            total += weight * table.equities[cell]
+            weights += weight
+    if not weights:
+        raise ValueError("У диапазонов нет непересекающихся комбинаций")
+    return total / weights / SCALE
+
+
+def _range_cells(hand_range, table):
+    """Номера строк таблицы для диапазона с их весами"""
+    hand_range = parse_range(hand_range)
+    if table.counts is not None:
+        return [(CLASS_INDEX[name], weight) for name, weight in hand_range.items()]
+    return [(COMBO_INDEX[combo], weight) for name, weight in hand_range.items() for combo in class_combos(name)]
+
+
+def combo_equity(hero, villain, table):
+    """Эквити двух карт hero против двух карт villain по таблице комбинаций (None, если карты пересекаются)"""
+    return table.equity(_combo_index(hero), _combo_index(villain))
+
+
+def _combo_index(cards):
+    first, second = sorted(cards, key=poker.CARD_NUMBERS.get)
+    return COMBO_INDEX[first + second]
+
+
+def _table():
+    if TABLE is None:
+        raise RuntimeError("Нет таблицы %s, постройте ее: python preflop.py --generate" % TABLE_PATH)
+    return TABLE
+
+
+def sample_equities(heroes, villains, trials, rng):
+    """Эквити каждой пары наборов комбинаций heroes[k] против villains[k] методом Монте-Карло:
+    в каждом из trials розыгрышей берутся случайные непересекающиеся комбинации и случайный борд.
+    Комбинации - массивы номеров карт (n x 2) как в poker.CARD_NUMBERS"""
+    np = poker.np
+    pairs = len(heroes)
+    hero = np.empty((pairs, trials, 2), dtype=np.int64)
+    villain = np.empty((pairs, trials, 2), dtype=np.int64)
+    for k in range(pairs):
+        hero[k] = heroes[k][rng.integers(len(heroes[k]), size=trials)]
+        villain[k] = villains[k][rng.integers(len(villains[k]), size=trials)]
+        # Пересекающиеся пары выбираются заново, так что пары комбинаций равновероятны
+        while True:
+            clash = ((hero[k, :, :, None] == villain[k, :, None, :]).any(axis=(1, 2)))
+            if not clash.any():
+                break
+            hero[k, clash] = heroes[k][rng.integers(len(heroes[k]), size=clash.sum())]
+            villain[k, clash] = villains[k][rng.integers(len(villains[k]), size=clash.sum())]
+    hero = hero.reshape(-1, 2)
+    villain = villain.reshape(-1, 2)
+
+    # Борд - 5 карт с наименьшими случайными ключами, у известных карт ключ больше любого
+    rows = np.arange(len(hero))[:, None]
+    keys = rng.random((len(hero), 52), dtype=np.float32)
+    keys[rows, hero] = 2
+    keys[rows, villain] = 2
+    board = np.argpartition(keys, 5, axis=1)[:, :5]
+
+    hero_strengths = poker.evaluate_batch(np.concatenate([hero, board], axis=1))
+    villain_strengths = poker.evaluate_batch(np.concatenate([villain, board], axis=1))
+    shares = (hero_strengths > villain_strengths) + 0.5 * (hero_strengths == villain_strengths)
+    return shares.reshape(pairs, trials).mean(axis=1)
+
+
+def generate(path=TABLE_PATH, trials=TRIALS, seed=0, combos=False, log=None):
+    """Строит таблицу эквити классов (или, с combos, всех пар комбинаций) и записывает ее в path"""
+    np = poker.np
+    if np is None:
+        raise RuntimeError("Генератору таблицы нужен numpy")
+    rng = np.random.default_rng(seed)
+    numbers = {combo: [poker.CARD_NUMBERS[combo[:2]], poker.CARD_NUMBERS[combo[2:]]] for combo in COMBOS}
+    if combos:
+        groups = [np.array([numbers[combo]]) for combo in COMBOS]
+        tasks = combo_tasks()
+    else:
+        groups = [np.array([numbers[combo] for combo in class_combos(name)]) for name in HAND_CLASSES]
+        # Эквити j против i - остаток от эквити i против j, поэтому считается только верхний треугольник
+        tasks = [(i, j, [(i, j)]) for i in range(len(groups)) for j in range(i + 1, len(groups))]
+    size = len(groups)
+
+    equities = np.full((size, size), NO_MATCHUP, dtype=np.uint16)
+    if not combos:
+        # Класс против самого себя симметричен
+        np.fill_diagonal(equities, round(SCALE / 2))
+    started = time.time()
+    block_size = max(1, GENERATE_ROWS // trials)
+    for start in range(0, len(tasks), block_size):
+        block = tasks[start:start + block_size]
+        block_equities = sample_equities([groups[i] for i, _, _ in block], [groups[j] for _, j, _ in block],
+                                         trials, rng)
+        for (_, _, cells), equity in zip(block, block_equities):
+            value = int(round(equity * SCALE))
+            for i, j in cells:
+                equities[i, j] = value
+                equities[j, i] = SCALE - value
+        if log:
+            log("%d/%d matchups, %.0f s" % (start + len(block), len(tasks), time.time() - started))
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as table_file:
+        table_file.write(HEADER.pack(MAGIC, VERSION, size, trials, seed))
+        table_file.write(equities.astype("<u2").tobytes())
+        if not combos:
+            table_file.write(matchup_counts())
+    os.replace(temp_path, path)
+    return EquityTable(path)
+
+
+def combo_tasks():
+    """Пары непересекающихся комбинаций, сгруппированные с точностью до перестановки мастей:
+    (комбинация, комбинация, все пары номеров комбинаций с тем же эквити)"""
+    np = poker.np
+    first, second = np.triu_indices(len(COMBOS), 1)
+    cards = np.array([[poker.CARD_NUMBERS[combo[:2]], poker.CARD_NUMBERS[combo[2:]]] for combo in COMBOS])
+    pairs = np.concatenate([cards[first], cards[second]], axis=1)
+    disjoint = (pairs[:, :2, None] != pairs[:, None, 2:]).all(axis=(1, 2))
+    first, second, pairs = first[disjoint], second[disjoint], pairs[disjoint]
+
+    # Ключ пары - наименьший по всем перестановкам мастей номер пары карт
+    ranks, suits = np.divmod(pairs, 4)
+    keys = None
+    for renamed in permutations(range(4)):
+        cards = ranks * 4 + np.array(renamed)[suits]
+        hero, villain = np.sort(cards[:, :2], axis=1), np.sort(cards[:, 2:], axis=1)
+        perm_keys = ((hero[:, 0] * 52 + hero[:, 1]) * 52 + villain[:, 0]) * 52 + villain[:, 1]
+        keys = perm_keys if keys is None else np.minimum(keys, perm_keys)
+
+    _, representatives, groups = np.unique(keys, return_index=True, return_inverse=True)
+    first, second = first.tolist(), second.tolist()
+    members = [[] for _ in representatives]
+    for group, i, j in zip(groups.tolist(), first, second):
+        members[group].append((i, j))
+    return [(first[k], second[k], cells) for k, cells in zip(representatives.tolist(), members)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Таблица эквити префлоп")
+    parser.add_argument("--generate", action="store_true", help="построить таблицу")
+    parser.add_argument("--combos", action="store_true", help="таблица всех пар комбинаций вместо классов")
+    parser.add_argument("--trials", type=int, default=TRIALS, help="розыгрышей на клетку таблицы")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл таблицы")
+    args = parser.parse_args()
+    if not args.generate:
+        test_preflop()
+        return
+    path = args.output or (COMBO_TABLE_PATH if args.combos else TABLE_PATH)
+    generate(path, args.trials, args.seed, args.combos, log=lambda message: print(message, file=sys.stderr))
+    print(path)
+
+
+def test_preflop():
+    print ("test_preflop...")
+    assert len(HAND_CLASSES) == 169 and sum(len(class_combos(name)) for name in HAND_CLASSES) == 1326
+    assert hand_class(["KS", "AS"]) == "AKs" and hand_class(["2D", "2C"]) == "22" and hand_class(["TD", "JC"]) == "JTo"
+    assert os.path.dirname(poker.TABLES_PATH) == os.path.dirname(TABLE_PATH) and os.path.exists(poker.TABLES_PATH)
+    table = TABLE
+    if table is None:
+        print ('нет таблицы, строим маленькую')
+        table = generate(TABLE_PATH + ".test", trials=200)
+        os.remove(TABLE_PATH + ".test")
+    precision = 4 / table.trials ** 0.5
+    assert abs(class_equity("AA", "KK", table) - 0.82) < precision
+    assert abs(class_equity("AA", "KK", table) + class_equity("KK", "AA", table) - 1) < 1e-9
+    assert class_equity("T9s", "T9s", table) == round(SCALE / 2) / SCALE
+    # Диапазон из одного класса - это сам класс
+    assert range_equity("AA", "KK", table) == class_equity("AA", "KK", table)
+    # AA против {KK, AKs}: пар комбинаций 36 и 12 (у AKs один туз может совпасть)
+    expected = (36 * class_equity("AA", "KK", table) + 12 * class_equity("AA", "AKs", table)) / 48
+    assert abs(range_equity("AA", "KK, AKs", table) - expected) < 1e-4
+
+    # По таблице комбинаций диапазон считается по парам комбинаций. В маленькой таблице
+    # у каждой пары эквити ее классов, так что ответ тот же, что по таблице классов
+    classes = ["AA", "KK", "AKs", "AKo"]
+    combo_equities = [NO_MATCHUP] * len(COMBOS) ** 2
+    for hero, villain in permutations([combo for name in classes for combo in class_combos(name)], 2):
+        if not set([hero[:2], hero[2:]]) & set([villain[:2], villain[2:]]):
+            cell = COMBO_INDEX[hero] * len(COMBOS) + COMBO_INDEX[villain]
+            combo_equities[cell] = table.equities[CLASS_INDEX[hand_class([hero[:2], hero[2:]])] * table.size +
+                                                  CLASS_INDEX[hand_class([villain[:2], villain[2:]])]]
+    combo_path = TABLE_PATH + ".combos.test"
+    with open(combo_path, "wb") as table_file:
+        table_file.write(HEADER.pack(MAGIC, VERSION, len(COMBOS), table.trials, 0))
+        table_file.write(struct.pack("<%dH" % len(combo_equities), *combo_equities))
+    combo_table = EquityTable(combo_path)
+    assert combo_table.counts is None
+    for hero_range, villain_range in [("AA", "KK"), ("AA", "KK, AKs"), ("AKs, AKo", {"AA": 1, "KK": 0.5})]:
+        assert abs(range_equity(hero_range, villain_range, combo_table) -
+                   range_equity(hero_range, villain_range, table)) < 1e-9
+    assert combo_equity(["AS", "AH"], ["KD", "KC"], combo_table) == class_equity("AA", "KK", table)
+    del combo_table
+    os.remove(combo_path)
+    print ('OK')
+
+
+if __name__ == '__main__':
+    main()